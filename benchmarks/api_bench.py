@@ -0,0 +1,122 @@
+import pytest
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import requests
+from singupy import api
+
+pytest.importorskip('pytest_benchmark')
+
+log = logging.getLogger(__name__)
+
+# Constants for benchmarks
+PORT = 5090
+ENDPOINT = 'bench'
+ROWS = [1_000, 100_000]
+TABLES = [1, 10]
+CLIENTS = 8
+REQUESTS_PER_ROUND = 64
+
+
+def make_dataframe(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"id": np.arange(rows),
+                         "kv": rng.choice([400, 220, 150, 132, 60, 50, 10], rows),
+                         "value": rng.random(rows),
+                         "name": rng.choice(["alpha", "beta", "gamma", "delta"], rows)})
+
+
+@pytest.fixture(scope="module", params=[(rows, tables) for rows in ROWS for tables in TABLES],
+                ids=lambda param: f"{param[0]}rows-{param[1]}tables")
+def dataframe_api(request):
+    rows, tables = request.param
+    test_api = api.DataFrameAPI(enable_web=False, cache_size=0)
+    for table in range(tables):
+        test_api[f"table{table}"] = make_dataframe(rows, seed=table)
+    return test_api
+
+
+@pytest.fixture(scope="module")
+def web_api():
+    test_api = api.DataFrameAPI(make_dataframe(10_000), dbname='bench', port=PORT, endpoint=ENDPOINT, cache_size=0)
+    yield test_api
+    test_api.web.stop()
+
+
+# ----- DataFrameAPI -----
+@pytest.mark.parametrize("query", ["SELECT * FROM table0 WHERE id < 100;",
+                                   "SELECT kv, COUNT(*) AS cnt, AVG(value) AS mean FROM table0 GROUP BY kv;",
+                                   "SELECT * FROM table0;"], ids=["filter", "aggregate", "full"])
+def test_query(benchmark, dataframe_api, query):
+    result = benchmark(dataframe_api.query_dataframe, query)
+    assert len(result) > 0
+
+
+def test_query_cached(benchmark):
+    test_api = api.DataFrameAPI(make_dataframe(100_000), dbname='table0', enable_web=False)
+    query = "SELECT kv, COUNT(*) AS cnt FROM table0 GROUP BY kv;"
+    test_api.query_dataframe(query)
+    benchmark(test_api.query_dataframe, query)
+    assert test_api.cache.stats()['hits'] > 0
+
+
+def test_metadata(benchmark, dataframe_api):
+    metadata = benchmark(dataframe_api.metadata)
+    assert len(metadata['dataframes']) > 0
+
+
+def test_update(benchmark, dataframe_api):
+    dataframe = make_dataframe(len(dataframe_api['table0']), seed=99)
+
+    def update():
+        dataframe_api['scratch'] = dataframe
+
+    benchmark(update)
+
+
+# ----- Serialization ('dict' is serialized by flask-restful, see 'test_to_dict') -----
+@pytest.mark.parametrize("fmt", [fmt for fmt in api.supported_formats() if fmt != 'dict'])
+def test_serialize(benchmark, fmt):
+    dataframe = make_dataframe(100_000)
+    benchmark(api._serialize, dataframe, fmt)
+
+
+def test_to_dict(benchmark):
+    dataframe = make_dataframe(100_000)
+    benchmark(dataframe.to_dict)
+
+
+# ----- HTTP -----
+def test_http_latency(benchmark, web_api):
+    url = f"http://localhost:{PORT}/{ENDPOINT}"
+    with requests.Session() as session:
+        def post():
+            return session.post(url, json={"sql-query": "SELECT * FROM bench WHERE id < 100;", "format": "split"})
+
+        response = benchmark(post)
+    assert response.status_code == 200
+
+
+def test_http_throughput(benchmark, web_api):
+    '''Time REQUESTS_PER_ROUND queries sent by CLIENTS concurrent clients - the requests/s are in 'extra_info'.'''
+    url = f"http://localhost:{PORT}/{ENDPOINT}"
+    sessions = [requests.Session() for _ in range(CLIENTS)]
+
+    def post(index: int):
+        response = sessions[index % CLIENTS].post(url, json={"sql-query": "SELECT * FROM bench WHERE id < 100;",
+                                                             "format": "split"})
+        return response.status_code
+
+    with ThreadPoolExecutor(max_workers=CLIENTS) as executor:
+        def round():
+            return list(executor.map(post, range(REQUESTS_PER_ROUND)))
+
+        statuses = benchmark.pedantic(round, rounds=5, warmup_rounds=1)
+    for session in sessions:
+        session.close()
+
+    assert set(statuses) == {200}
+    # No timings are kept when the benchmarks are disabled (i.e. with '--benchmark-disable')
+    if benchmark.stats is not None:
+        benchmark.extra_info['requests_per_second'] = REQUESTS_PER_ROUND / benchmark.stats.stats.mean
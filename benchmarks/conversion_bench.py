@@ -0,0 +1,56 @@
+import pytest
+import logging
+import numpy as np
+import pandas as pd
+from singupy.conversion import kv_to_letter, kv_to_letters
+from singupy.verification import dataframe_columns, Column, DataFrameSchema
+
+pytest.importorskip('pytest_benchmark')
+
+log = logging.getLogger(__name__)
+
+# Constants for benchmarks
+ROWS = 500_000
+
+
+@pytest.fixture(scope="module")
+def voltages():
+    return pd.Series(np.random.default_rng(0).choice([400, 220, 150, 132, 60, 50, 33, 20, 10, 0.4], ROWS))
+
+
+@pytest.fixture(scope="module")
+def dataframes():
+    rng = np.random.default_rng(0)
+    return {f"frame{index}": pd.DataFrame({"id": np.arange(ROWS // 10), "kv": rng.random(ROWS // 10) * 400,
+                                           "name": "equipment"}) for index in range(24)}
+
+
+# ----- conversion -----
+def test_kv_to_letter_apply(benchmark, voltages):
+    benchmark.pedantic(voltages.apply, args=(kv_to_letter,), rounds=3)
+
+
+def test_kv_to_letters(benchmark, voltages):
+    result = benchmark(kv_to_letters, voltages)
+    assert result.tolist() == voltages.apply(kv_to_letter).tolist()
+
+
+# ----- verification -----
+def test_dataframe_columns(benchmark, dataframes):
+    def verify():
+        for dataframe in dataframes.values():
+            dataframe_columns(dataframe, ["id", "kv", "name"])
+
+    benchmark(verify)
+
+
+def test_dataframe_schema(benchmark, dataframes):
+    schema = DataFrameSchema({"id": Column('integer', nullable=False, unique=True),
+                              "kv": Column('numeric', min=0, max=500),
+                              "name": Column('string')}, key="id")
+
+    def validate():
+        return [schema.validate(dataframe) for dataframe in dataframes.values()]
+
+    reports = benchmark(validate)
+    assert all(report.ok for report in reports)
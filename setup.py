@@ -12,7 +12,12 @@ setup(
         'Flask-RESTful>=0.3.9',
         'requests>=2.27.1'
     ],
-    version='0.1.4',
+    extras_require={
+        'arrow': ['pyarrow>=7.0.0'],
+        'waitress': ['waitress>=2.1.0'],
+        'zstd': ['zstandard>=0.18.0']
+    },
+    version='0.2.23',
     license='Apache License 2.0',
     description='Library for Singularity',
     long_description=open('README.md').read(),
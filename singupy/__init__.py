@@ -1 +1,15 @@
-__all__ = ['hello', 'api', 'conversion', 'verification']
+import importlib
+
+__all__ = ['hello', 'api', 'client', 'conversion', 'verification']
+
+
+def __getattr__(name: str):
+    # The modules are imported when first used (i.e. 'singupy.conversion'), so importing singupy does not load the
+    # dependencies of all of them (i.e. the web stack of 'api')
+    if name in __all__:
+        return importlib.import_module(f'.{name}', __name__)
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
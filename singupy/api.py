@@ -1,29 +1,407 @@
 from __future__ import annotations
 
 # Modules related to flask/web
-from flask import Flask
-from flask_restful import Resource, Api, reqparse
-from werkzeug.serving import make_server
-import requests
+from flask import Flask, Response, request, g
+from flask_restful import Resource, Api, reqparse, inputs
+from werkzeug.serving import make_server, BaseWSGIServer, WSGIRequestHandler
+from werkzeug.http import quote_etag
 
 # Modules related to pandas
+import numpy as np
 import pandas as pd
-from pandasql import PandaSQL
+from pandas.io.sql import to_sql
 
 # Generic modules
 import logging
 import time
+import gzip
+import zlib
+import hashlib
 import re
-from threading import Thread
-from typing import Callable
+import io
+import os
+import json
+import queue
+import shutil
+import sqlite3
+import tempfile
+import weakref
+import random
+import cProfile
+import pstats
+import multiprocessing
+from importlib.util import find_spec
+from collections import OrderedDict, Counter, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager, ExitStack
+from functools import lru_cache
+from datetime import datetime, timezone
+from itertools import count
+from threading import Thread, Event, Lock, RLock, Condition, BoundedSemaphore, get_ident, local
+from typing import Callable, Iterator
 
 # Initialize log
 log = logging.getLogger(__name__)
 
+# Formats (and their mimetypes) that query results returned as a DataFrame can be sent in - 'dict' is the default
+RESPONSE_FORMATS = {
+    'dict': 'application/json',
+    'split': 'application/json',
+    'records': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+
+def supported_formats() -> list:
+    '''
+    List the response formats that can be used in this environment (the binary formats requires 'pyarrow').
+
+    Returns
+    -------
+    list
+        Names of the formats that can be requested with the 'format' key of a 'POST'.
+    '''
+    binary = ['arrow', 'parquet'] if find_spec('pyarrow') is not None else []
+    return [fmt for fmt in RESPONSE_FORMATS if fmt not in ('arrow', 'parquet') or fmt in binary]
+
+
+# Formats that query results can be streamed in (in chunks) - 'ndjson' is the default
+STREAM_FORMATS = ['ndjson', 'csv', 'arrow']
+
+# Name of the file listing the dataframes of a snapshot (see 'DataFrameAPI.save_snapshot')
+SNAPSHOT_MANIFEST = 'manifest.json'
+
+# Content encodings responses can be compressed with in order of preference (and the level used for each)
+CONTENT_ENCODINGS = {
+    'zstd': 3,
+    'gzip': 1
+}
+
+
+def supported_encodings() -> list:
+    '''
+    List the content encodings that can be used in this environment ('zstd' requires 'zstandard').
+
+    Returns
+    -------
+    list
+        Names of the encodings responses are compressed with (if accepted by the client) in order of preference.
+    '''
+    return [encoding for encoding in CONTENT_ENCODINGS if encoding != 'zstd' or find_spec('zstandard') is not None]
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    '''Compress a response body with the given content encoding.'''
+    if encoding == 'zstd':
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=CONTENT_ENCODINGS[encoding]).compress(data)
+    return gzip.compress(data, compresslevel=CONTENT_ENCODINGS[encoding], mtime=0)
+
+
+def _compress_chunks(chunks: Iterator[bytes], encoding: str) -> Iterator[bytes]:
+    '''Compress a streamed response with the given content encoding - each chunk is flushed so it is sent at once.'''
+    if encoding == 'zstd':
+        import zstandard
+
+        compressor = zstandard.ZstdCompressor(level=CONTENT_ENCODINGS[encoding]).compressobj()
+        flush = zstandard.COMPRESSOBJ_FLUSH_BLOCK
+    else:
+        compressor = zlib.compressobj(CONTENT_ENCODINGS[encoding], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        flush = zlib.Z_SYNC_FLUSH
+    try:
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(flush)
+        yield compressor.flush()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+def _serialize(dataframe: pd.DataFrame, fmt: str):
+    '''Serialize a dataframe to the given format (except 'dict' which is left for flask-restful to encode).'''
+    if fmt in ('split', 'records'):
+        return dataframe.to_json(orient=fmt, date_format='iso')
+    elif fmt == 'ndjson':
+        return dataframe.to_json(orient='records', lines=True, date_format='iso') + '\n' if not dataframe.empty else ''
+    elif fmt == 'csv':
+        return dataframe.to_csv(index=False)
+    elif fmt in ('arrow', 'parquet'):
+        if fmt not in supported_formats():
+            raise ImportError(f"The '{fmt}' format requires the 'pyarrow' package to be installed on the server.")
+        import pyarrow as pa
+
+        buffer = io.BytesIO()
+        if fmt == 'parquet':
+            dataframe.to_parquet(buffer, index=False)
+        else:
+            table = pa.Table.from_pandas(dataframe, preserve_index=False)
+            with pa.ipc.new_stream(buffer, table.schema) as writer:
+                writer.write_table(table)
+        return buffer.getvalue()
+    raise ValueError(f"Unknown format '{fmt}' - valid formats are: {list(RESPONSE_FORMATS)}")
+
+
+def _serialize_chunks(chunks: Iterator[pd.DataFrame], fmt: str) -> Iterator[bytes]:
+    '''Serialize dataframes to one stream in the given format, one chunk at a time so memory usage is bounded.'''
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"Format '{fmt}' cannot be streamed - valid formats are: {STREAM_FORMATS}")
+    if fmt == 'arrow':
+        if fmt not in supported_formats():
+            raise ImportError(f"The '{fmt}' format requires the 'pyarrow' package to be installed on the server.")
+        import pyarrow as pa
+
+    writer = schema = None
+    buffer = io.BytesIO()
+    for number, chunk in enumerate(chunks):
+        if fmt == 'ndjson':
+            yield _serialize(chunk, fmt).encode()
+        elif fmt == 'csv':
+            yield chunk.to_csv(index=False, header=number == 0).encode()
+        else:
+            # All record batches must follow the schema of the first chunk
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = pa.ipc.new_stream(buffer, schema)
+            writer.write_table(table)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if writer is not None:
+        writer.close()
+        yield buffer.getvalue()
+
+
+def _serialize_event(event: str, data: dict) -> bytes:
+    '''
+    Serialize an event of a subscription in the Server-Sent Events format - DataFrames in 'data' are written as lists
+    of records. An event of None is a comment, which keeps the connection alive.
+    '''
+    if event is None:
+        return b': keep-alive\n\n'
+    fields = [f"{json.dumps(str(name))}: " + (value.to_json(orient='records', date_format='iso')
+                                              if isinstance(value, pd.DataFrame) else json.dumps(value, default=str))
+              for name, value in data.items()]
+    return f"event: {event}\ndata: {{{', '.join(fields)}}}\n\n".encode()
+
+
+# Backends that can be used to serve a SQLRestAPI
+SERVER_BACKENDS = ['werkzeug', 'waitress']
+
+
+class QueryLimitError(Exception):
+    '''
+    Raised when a query exceeds one of the limits of a DataFrameAPI (i.e. returns too many rows).
+
+    Attributes
+    ----------
+    limit : str
+        Name of the exceeded limit
+    status : int
+        HTTP status the webservice responds with
+
+    '''
+    def __init__(self, message: str, limit: str, status: int = 413):
+        super().__init__(message)
+        self.limit = limit
+        self.status = status
+
+    def __reduce__(self):
+        # Keep limit and status when the error is sent from a worker process
+        return self.__class__, (str(self), self.limit, self.status)
+
+
+class QueryTimeoutError(QueryLimitError, TimeoutError):
+    '''Raised when a query exceeds the time limit of a DataFrameAPI and has been interrupted.'''
+    def __init__(self, message: str, limit: str = 'query_timeout', status: int = 408):
+        super().__init__(message, limit, status)
+
+
+class _Metrics():
+    '''
+    Thread safe registry of counters, gauges and histograms rendered in the Prometheus text format.
+
+    Metrics are declared with 'counter', 'gauge' and 'histogram' and updated with 'inc', 'set' and 'observe' (labels
+    are given as keyword arguments). Collectors added with 'add_collector' are called when rendering and must return
+    an iterable of (name, type, help, {labels: value}) tuples, where labels is a tuple of (label, value) pairs.
+    '''
+    TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+    SIZE_BUCKETS = (1, 10, 100, 1000, 10**4, 10**5, 10**6, 10**7, 10**8)
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__metrics = {}
+        self.__values = {}
+        self.__collectors = []
+
+    def __declare(self, name: str, kind: str, help: str, buckets: tuple = None) -> None:
+        with self.__lock:
+            self.__metrics[name] = (kind, help, buckets)
+            self.__values[name] = {}
+
+    def counter(self, name: str, help: str) -> None:
+        self.__declare(name, 'counter', help)
+
+    def gauge(self, name: str, help: str) -> None:
+        self.__declare(name, 'gauge', help)
+
+    def histogram(self, name: str, help: str, buckets: tuple = TIME_BUCKETS) -> None:
+        self.__declare(name, 'histogram', help, tuple(buckets))
+
+    def add_collector(self, collector: Callable[[], list]) -> None:
+        self.__collectors.append(collector)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            values = self.__values[name]
+            values[key] = values.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        with self.__lock:
+            self.__values[name][tuple(sorted(labels.items()))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        buckets = self.__metrics[name][2]
+        with self.__lock:
+            values = self.__values[name]
+            if key not in values:
+                # Counts per bucket (and +Inf), then the sum of the observed values
+                values[key] = [0] * (len(buckets) + 1) + [0]
+            counts = values[key]
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def value(self, name: str, **labels):
+        '''The value of a counter/gauge, or the number of observations of a histogram (None if not recorded).'''
+        with self.__lock:
+            value = self.__values[name].get(tuple(sorted(labels.items())))
+        return value[-2] if isinstance(value, list) else value
+
+    @staticmethod
+    def __labels(labels: tuple, extra: tuple = ()) -> str:
+        labels = labels + extra
+        if not labels:
+            return ''
+        escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+        return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + '}'
+
+    def render(self) -> str:
+        '''Render all metrics (including those of the collectors) in the Prometheus text format.'''
+        lines = []
+        with self.__lock:
+            metrics = [(name, kind, help, buckets, dict(self.__values[name]))
+                       for name, (kind, help, buckets) in self.__metrics.items()]
+        for collector in self.__collectors:
+            try:
+                metrics.extend((name, kind, help, None, values) for name, kind, help, values in collector())
+            except Exception as e:
+                log.error(f'Metrics collector failed: {e!r}')
+
+        # Collectors (i.e. of several DataFrameAPIs on one server) may report the same metric with other labels
+        combined = {}
+        for name, kind, help, buckets, values in metrics:
+            if name in combined:
+                combined[name][4].update(values)
+            else:
+                combined[name] = (name, kind, help, buckets, dict(values))
+
+        for name, kind, help, buckets, values in combined.values():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in values.items():
+                if kind == 'histogram':
+                    # The bucket counts are cumulative already, and the +Inf bucket is the total count
+                    for bound, total in zip(buckets + ('+Inf',), value[:-1]):
+                        lines.append(f'{name}_bucket{self.__labels(labels, (("le", bound),))} {total}')
+                    lines.append(f'{name}_sum{self.__labels(labels)} {value[-1]}')
+                    lines.append(f'{name}_count{self.__labels(labels)} {value[-2]}')
+                else:
+                    lines.append(f'{name}{self.__labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class _PooledWSGIServer(BaseWSGIServer):
+    '''
+    Werkzeug WSGI server that handles requests with a fixed pool of worker threads.
+
+    Accepted connections wait in a bounded queue, so a burst of requests is throttled (and eventually held back in the
+    socket backlog) instead of spawning a thread per request.
+    '''
+    multithread = True
+
+    class _RequestHandler(WSGIRequestHandler):
+        '''
+        Speak HTTP/1.1 like the threaded werkzeug server, so streamed responses are chunked. Werkzeug closes the
+        connection after each response in any case, so idle connections never occupy the workers.
+        '''
+        protocol_version = 'HTTP/1.1'
+
+    def __init__(self, host: str, port: int, app, workers: int, queue_size: int = None):
+        super().__init__(host, port, app, handler=self._RequestHandler)
+        self.__queue = queue.Queue(maxsize=queue_size or workers * 4)
+        self.__workers = [Thread(target=self.__work, daemon=True) for _ in range(workers)]
+        for worker in self.__workers:
+            worker.start()
+
+    def process_request(self, request, client_address):
+        '''Queue the request for the workers - blocks if the queue is full.'''
+        self.__queue.put((request, client_address))
+
+    def __work(self):
+        '''Handle requests from the queue until the server is closed.'''
+        while (item := self.__queue.get()) is not None:
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def server_close(self):
+        '''Close the socket and stop the workers once the queued requests are handled.'''
+        super().server_close()
+        for _ in self.__workers:
+            self.__queue.put(None)
+        for worker in self.__workers:
+            worker.join(timeout=15)
+
+
+class _WaitressServer():
+    '''Adapter giving a waitress server the same interface as the werkzeug servers (requires 'waitress').'''
+    def __init__(self, host: str, port: int, app, workers: int = None):
+        from waitress.server import create_server
+
+        self.__server = create_server(app, host=host, port=port, threads=workers or 4)
+
+    def serve_forever(self):
+        self.__server.run()
+
+    def shutdown(self):
+        from waitress import wasyncore
+
+        # Closing all sockets (also the open client connections) makes the waitress main loop exit - it is done from
+        # within the main loop, so no socket is closed while the loop is waiting for it
+        self.__server.task_dispatcher.shutdown()
+        self.__server.trigger.pull_trigger(lambda: wasyncore.close_all(self.__server._map))
+
+    def server_close(self):
+        pass
+
 
 class SQLRestAPI():
     '''
     Class for creating a SQL Rest API/endpoint that will respond to SQL queries.
+    Further endpoints (i.e. of several DataFrameAPIs) can be added with 'add_endpoint', so they share one server.
 
     Attributes
     ----------
@@ -31,12 +409,43 @@ class SQLRestAPI():
         The port to expose the webservice on
     endpoint : str
         The endpoint where the webservice is available (i.e. http:/host:port/endpoint)
+    endpoints : list
+        The endpoint of the webservice followed by the endpoints added with 'add_endpoint'
     getcall : Callable[[], dict]
         Function to call when endpoint is called with a 'GET' - must return a 'dict' object
-    postcall : Callable[[str], dict]
-        Function to call when endpoint is called with a 'POST' and a sql-query - must return a 'dict' object
+    postcall : Callable[[str], dict | pd.DataFrame]
+        Function to call when endpoint is called with a 'POST' and a sql-query - must return a 'dict' object or a
+        pandas DataFrame (which will be sent in the format requested by the client)
+    streamcall : Callable[[str, int], Iterator[pd.DataFrame]]
+        Function to call when endpoint is called with a 'POST', a sql-query and 'stream' set - must return an iterator
+        of pandas DataFrames with at most 'chunksize' rows each
+    chunksize : int
+        Number of rows in each chunk when streaming a response
     host : str
         Can be changed if required, but will default to '0.0.0.0' which will allow access from outside as well
+    backend : str
+        The server backend used to serve the webservice (see 'SERVER_BACKENDS')
+    workers : int
+        Number of worker threads handling requests - if None the werkzeug backend uses a thread per request
+    health_endpoint : str
+        Endpoint of a lightweight health check which responds to a 'GET' without calling 'getcall'
+    metrics_endpoint : str
+        Endpoint serving the metrics of the webservice in the Prometheus text format
+    etagcall : Callable[[str], str]
+        Function returning the ETag of the response to a query (or of the 'GET' when called with None) - clients
+        sending it back in 'If-None-Match' get a '304 Not Modified' without the query being run
+    subscribecall : Callable[[str], Iterator[tuple]]
+        Function to call when endpoint is called with a query and 'subscribe' set - must return an iterator of events
+        (name and dict of data), which are pushed to the client as Server-Sent Events
+    max_subscriptions : int
+        Number of subscriptions that can be open at once - each holds a worker, so one worker is kept for other
+        requests (None if the werkzeug backend starts a thread per request)
+    stopping : Event
+        Set while the webservice is being stopped, so open subscriptions end at once
+    compress_min_size : int
+        Responses of at least this many bytes (and all streamed responses) are compressed if the client accepts it
+    metrics : _Metrics
+        The metrics registry - collectors of further metrics can be added with 'metrics.add_collector'
     ready : bool
         Will return true if webservice is up and false if it is not
     thread : Thread
@@ -44,7 +453,11 @@ class SQLRestAPI():
 
     '''
     def __init__(self, port: int = 5000, endpoint: str = '', getcall: Callable[[], dict] = None,
-                 postcall: Callable[[str], dict] = None, start: bool = True, host: str = '0.0.0.0'):
+                 postcall: Callable[[str], dict] = None, start: bool = True, host: str = '0.0.0.0',
+                 streamcall: Callable[[str, int], Iterator[pd.DataFrame]] = None, chunksize: int = 10000,
+                 backend: str = 'werkzeug', workers: int = None, health_endpoint: str = 'health',
+                 metrics_endpoint: str = 'metrics', etagcall: Callable[[str], str] = None,
+                 compress_min_size: int = 1024, subscribecall: Callable[[str], Iterator[tuple]] = None):
         '''
         Parameters
         ----------
@@ -54,18 +467,69 @@ class SQLRestAPI():
             The endpoint where the webservice is available (i.e. http:/host:port/endpoint)
         getcall : Callable[[], dict]
             Function to call when endpoint is called with a 'GET' - must return a 'dict' object
-        postcall : Callable[[str], dict]
+        postcall : Callable[[str], dict | pd.DataFrame]
             Function to call when endpoint is called with a 'POST' and a sql-query (string) - must return a 'dict' object
+            or a pandas DataFrame (which will be sent in the format requested by the client)
         start : bool
             Enable the webhost at instantiation
         host : str
             Can be changed if required, but will default to '0.0.0.0' which will allow access from outside as well
+        streamcall : Callable[[str, int], Iterator[pd.DataFrame]]
+            Function to call when endpoint is called with a 'POST', a sql-query (string) and 'stream' set - must return
+            an iterator of pandas DataFrames with at most 'chunksize' (int) rows each
+        chunksize : int, default 10000
+            Number of rows in each chunk when streaming a response
+        backend : str, default 'werkzeug'
+            The server backend - 'werkzeug' (included with flask) or 'waitress' (production server, requires 'waitress')
+        workers : int, default None
+            Number of worker threads handling requests. If None the werkzeug backend starts a thread per request (and
+            waitress uses 4 threads) - set it to bound the number of concurrent requests and threads
+        health_endpoint : str, default 'health'
+            Endpoint of a lightweight health check (i.e. for liveness probes) - set to None to disable it
+        metrics_endpoint : str, default 'metrics'
+            Endpoint serving request metrics in the Prometheus text format - set to None to disable it
+        etagcall : Callable[[str], str], default None
+            Function returning the ETag of the response to a query (string), or of the 'GET' when called with None. It
+            must change whenever the response would change - clients sending it back in 'If-None-Match' get a '304 Not
+            Modified' without the query being run. Return None (or leave it unset) to disable ETags.
+        compress_min_size : int, default 1024
+            Responses of at least this many bytes (and all streamed responses) are compressed with the best encoding
+            accepted by the client (see 'CONTENT_ENCODINGS') - set to None to disable compression
+        subscribecall : Callable[[str], Iterator[tuple]], default None
+            Function to call when endpoint is called with a query (string) and 'subscribe' set (or with a 'GET' with the
+            query in the query string) - must return an iterator of events as tuples of the event name and a dict of
+            data (DataFrames are sent as lists of records), or (None, None) to only keep the connection alive. The
+            events are pushed to the client as Server-Sent Events until it disconnects or the iterator ends
         '''
+        if backend not in SERVER_BACKENDS:
+            log.error(f"Tried to use unknown server backend '{backend}'.")
+            raise ValueError(f"Unknown server backend '{backend}' - valid backends are: {SERVER_BACKENDS}")
+        self.__backend = backend
+        self.__workers = workers
         self.__port = port
         self.__host = host
         self.__endpoint = endpoint
+        self.__health_endpoint = health_endpoint
+        self.__metrics_endpoint = metrics_endpoint
+        self.__routes = {}
+        self.__endpoints = {}
+        self.metrics = _Metrics()
+        self.metrics.counter('singupy_requests_total', 'Number of requests to the endpoint')
+        self.metrics.gauge('singupy_requests_in_flight', 'Number of requests to the endpoint being handled')
+        self.metrics.histogram('singupy_request_duration_seconds', 'Time spent on each stage of handling queries')
+        self.metrics.histogram('singupy_result_rows', 'Number of rows in query results', _Metrics.SIZE_BUCKETS)
+        self.metrics.histogram('singupy_response_bytes', 'Size of (non-streamed) responses', _Metrics.SIZE_BUCKETS)
+        self.metrics.counter('singupy_query_errors_total', 'Number of failed queries by type of error')
+        self.metrics.set('singupy_requests_in_flight', 0)
         self.getcall = getcall
         self.postcall = postcall
+        self.streamcall = streamcall
+        self.etagcall = etagcall
+        self.subscribecall = subscribecall
+        self.stopping = Event()
+        self.__stop_callbacks = []
+        self.chunksize = chunksize
+        self.compress_min_size = compress_min_size
         self.__update_process()
         if start:
             self.start()
@@ -76,9 +540,104 @@ class SQLRestAPI():
         '''
         self.__app = Flask(__name__)
         self.__api = Api(self.__app)
-        self.__api.add_resource(self.__QueryData, f"/{self.endpoint}",
-                                resource_class_kwargs={'GET': self.getcall, 'POST': self.postcall})
-        self.thread = self.__serverThread(self.host, self.port, self.__app)
+        # An endpoint added with 'add_endpoint' takes over the endpoint of the server if it has no functions
+        endpoints = {self.endpoint: {'GET': self.getcall, 'POST': self.postcall, 'STREAM': self.streamcall,
+                                     'ETAG': self.etagcall, 'SUBSCRIBE': self.subscribecall}}
+        endpoints.update(self.__endpoints)
+        # Each subscription holds a worker while it is open, so a bounded pool keeps one worker for other requests
+        self.__subscriptions = None if self.max_subscriptions is None else BoundedSemaphore(self.max_subscriptions)
+        for endpoint, calls in endpoints.items():
+            self.__api.add_resource(self.__QueryData, f"/{endpoint}",
+                                    endpoint='query' if endpoint == self.endpoint else f"query:{endpoint}",
+                                    resource_class_kwargs={**calls, 'rest_api': self,
+                                                           'subscriptions': self.__subscriptions})
+        if self.health_endpoint is not None and self.health_endpoint not in endpoints:
+            self.__app.add_url_rule(f"/{self.health_endpoint}", 'health', lambda: {'status': 'ok'})
+        if self.metrics_endpoint is not None and self.metrics_endpoint not in endpoints \
+                and self.metrics_endpoint != self.health_endpoint:
+            self.__app.add_url_rule(f"/{self.metrics_endpoint}", 'metrics',
+                                    lambda: Response(self.metrics.render(), mimetype='text/plain; version=0.0.4'))
+        for route, function in self.__routes.items():
+            self.__app.add_url_rule(f"/{route}", f"route:{route}", self.__route_view(function))
+        self.__app.before_request(self.__before_request)
+        self.__app.after_request(self.__after_request)
+        self.thread = self.__serverThread(self.host, self.port, self.__app, self.backend, self.workers)
+
+    @staticmethod
+    def __route_view(function: Callable[[], dict]) -> Callable[[], tuple]:
+        '''View of a route added with 'add_route' - errors are returned like errors of 'getcall'.'''
+        def view():
+            try:
+                return function(), 200
+            except Exception as e:
+                return {'error': f"'GET' failed with message '{e}'"}, 400
+        return view
+
+    def add_route(self, route: str, getcall: Callable[[], dict]) -> None:
+        '''
+        Add a route to the webservice which responds to a 'GET' with the result of a function (i.e. for admin data).
+
+        Parameters
+        ----------
+        route : str
+            The route to add (i.e. http:/host:port/route)
+        getcall : Callable[[], dict]
+            Function to call when the route is called with a 'GET' - must return a 'dict' object
+        '''
+        if self.thread.is_alive():
+            log.error('Tried to add a route while thread is running.')
+            raise AttributeError('Cannot add a route when thread is running.')
+        self.__routes[route] = getcall
+        self.__update_process()
+
+    def add_stop_callback(self, callback: Callable[[], None]) -> None:
+        '''
+        Add a function to call when the webservice is being stopped (after 'stopping' is set) - i.e. to wake a
+        'subscribecall' iterator waiting for changes, so its subscription ends at once instead of holding up the stop.
+
+        Parameters
+        ----------
+        callback : Callable[[], None]
+            The function to call - it must not block
+        '''
+        self.__stop_callbacks.append(callback)
+
+    def add_endpoint(self, endpoint: str, getcall: Callable[[], dict] = None, postcall: Callable[[str], dict] = None,
+                     streamcall: Callable[[str, int], Iterator[pd.DataFrame]] = None,
+                     etagcall: Callable[[str], str] = None,
+                     subscribecall: Callable[[str], Iterator[tuple]] = None) -> None:
+        '''
+        Add a further endpoint to the webservice, which handles requests like the endpoint of the webservice but with
+        its own functions - so several datasets (i.e. DataFrameAPIs) can share one server, port and pool of workers.
+
+        Parameters
+        ----------
+        endpoint : str
+            The endpoint to add (i.e. http:/host:port/endpoint) - it can be the endpoint of the webservice if no
+            functions were given for that
+        getcall, postcall, streamcall, etagcall, subscribecall : Callable
+            Functions called by the endpoint, like the parameters of the same names of the webservice
+
+        Raises
+        ------
+        ValueError
+            If the endpoint is already in use.
+        '''
+        if self.thread.is_alive():
+            log.error('Tried to add an endpoint while thread is running.')
+            raise AttributeError('Cannot add an endpoint when thread is running.')
+        in_use = (self.__endpoints, self.__routes, (self.health_endpoint, self.metrics_endpoint))
+        if any(endpoint in used for used in in_use) or endpoint == self.endpoint and \
+                any(call is not None for call in (self.getcall, self.postcall, self.streamcall, self.subscribecall)):
+            log.error(f"Tried to add the endpoint '{endpoint}' which is already in use.")
+            raise ValueError(f"The endpoint '{endpoint}' is already in use.")
+        self.__endpoints[endpoint] = {'GET': getcall, 'POST': postcall, 'STREAM': streamcall, 'ETAG': etagcall,
+                                      'SUBSCRIBE': subscribecall}
+        self.__update_process()
+
+    @property
+    def endpoints(self) -> list:
+        return [self.endpoint] + [endpoint for endpoint in self.__endpoints if endpoint != self.endpoint]
 
     @property
     def port(self) -> int:
@@ -119,15 +678,128 @@ class SQLRestAPI():
             self.__host = value
             self.__update_process()
 
+    @property
+    def backend(self) -> str:
+        return self.__backend
+
+    @backend.setter
+    def backend(self, value: str):
+        if self.thread.is_alive():
+            log.error('Tried to set backend while thread is running.')
+            raise AttributeError('Cannot set backend when thread is running.')
+        elif value not in SERVER_BACKENDS:
+            log.error(f"Tried to use unknown server backend '{value}'.")
+            raise ValueError(f"Unknown server backend '{value}' - valid backends are: {SERVER_BACKENDS}")
+        else:
+            self.__backend = value
+            self.__update_process()
+
+    @property
+    def workers(self) -> int:
+        return self.__workers
+
+    @workers.setter
+    def workers(self, value: int):
+        if self.thread.is_alive():
+            log.error('Tried to set workers while thread is running.')
+            raise AttributeError('Cannot set workers when thread is running.')
+        else:
+            self.__workers = value
+            self.__update_process()
+
+    @property
+    def max_subscriptions(self) -> int:
+        threads = self.workers if self.backend == 'werkzeug' else self.workers or 4
+        return None if threads is None else max(threads - 1, 0)
+
+    @property
+    def health_endpoint(self) -> str:
+        return self.__health_endpoint
+
+    @health_endpoint.setter
+    def health_endpoint(self, value: str):
+        if self.thread.is_alive():
+            log.error('Tried to set health_endpoint while thread is running.')
+            raise AttributeError('Cannot set health_endpoint when thread is running.')
+        else:
+            self.__health_endpoint = value
+            self.__update_process()
+
+    @property
+    def metrics_endpoint(self) -> str:
+        return self.__metrics_endpoint
+
+    @metrics_endpoint.setter
+    def metrics_endpoint(self, value: str):
+        if self.thread.is_alive():
+            log.error('Tried to set metrics_endpoint while thread is running.')
+            raise AttributeError('Cannot set metrics_endpoint when thread is running.')
+        else:
+            self.__metrics_endpoint = value
+            self.__update_process()
+
+    def __before_request(self):
+        '''Start timing requests to the endpoints (the health and metrics endpoints are not measured)'''
+        if request.endpoint is not None and request.endpoint.split(':')[0] == 'query':
+            g.metrics_start = time.perf_counter()
+            self.metrics.inc('singupy_requests_in_flight')
+
+    def __after_request(self, response: Response) -> Response:
+        '''
+        Record the stages of a request to the endpoint - the resource marks when the request is parsed and when the
+        query has run (in 'g'), the rest until now is serialization (and compression). Sending is timed until the
+        response is closed.
+        '''
+        response = self.__compress(response)
+        if 'metrics_start' not in g:
+            return response
+        start = g.metrics_start
+        now = time.perf_counter()
+        stages = {}
+        if 'metrics_parsed' in g:
+            stages['parse'] = g.metrics_parsed - start
+            if 'metrics_queried' in g:
+                stages['query'] = g.metrics_queried - g.metrics_parsed
+                stages['serialize'] = now - g.metrics_queried
+        for stage, duration in stages.items():
+            self.metrics.observe('singupy_request_duration_seconds', duration, stage=stage)
+        if 'metrics_rows' in g:
+            self.metrics.observe('singupy_result_rows', g.metrics_rows)
+        if not response.is_streamed and response.content_length is not None:
+            self.metrics.observe('singupy_response_bytes', response.content_length)
+        self.metrics.inc('singupy_requests_total', method=request.method, status=response.status_code)
+
+        def sent():
+            end = time.perf_counter()
+            self.metrics.observe('singupy_request_duration_seconds', end - now, stage='send')
+            self.metrics.observe('singupy_request_duration_seconds', end - start, stage='total')
+            self.metrics.inc('singupy_requests_in_flight', -1)
+
+        response.call_on_close(sent)
+        return response
+
+    def __compress(self, response: Response) -> Response:
+        '''Compress a response with the best encoding accepted by the client, if it is large enough or streamed'''
+        if self.compress_min_size is None or response.status_code != 200 or 'Content-Encoding' in response.headers \
+                or response.mimetype == RESPONSE_FORMATS['parquet']:
+            return response
+        response.vary.add('Accept-Encoding')
+        if not response.is_streamed and response.calculate_content_length() < self.compress_min_size:
+            return response
+        encoding = request.accept_encodings.best_match(supported_encodings())
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = _compress_chunks(response.response, encoding)
+        else:
+            response.set_data(_compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
     @property
     def ready(self) -> bool:
         if self.thread.is_alive():
-            try:
-                requests.get(f'http://localhost:{self.port}/{self.endpoint}')
-            except Exception:
-                return False
-            else:
-                return True
+            return self.thread.started.is_set()
         else:
             log.error('Webserver has not been started yet.')
             return False
@@ -147,11 +819,15 @@ class SQLRestAPI():
             log.error('START of webservice requested, but it has already been started.')
         else:
             log.info("Starting webservice..")
+            self.stopping.clear()
             self.thread.start()
             if wait_for_ready:
+                # The server thread signals when the socket is bound, so there is no need to poll the webservice
                 req_start = time.time()
-                while not self.ready:
-                    time.sleep(0.25)
+                while not self.thread.started.wait(timeout=0.05):
+                    if not self.thread.is_alive():
+                        log.error('Webservice failed to start.')
+                        raise RuntimeError(f'Webservice failed to start - is port {self.port} already in use?')
                     if time.time() - req_start > timeout:
                         log.error(f'Webservice did not start within timeout of {timeout} seconds.')
                         raise TimeoutError(f'Webservice did not start within timeout of {timeout} seconds.')
@@ -167,30 +843,52 @@ class SQLRestAPI():
         '''
         if self.thread.is_alive():
             log.info("Stopping webservice..")
+            self.stopping.set()
+            for callback in self.__stop_callbacks:
+                callback()
             self.thread.shutdown()
-            req_start = time.time()
-            while self.thread.is_alive():
-                time.sleep(0.25)
-                if time.time() - req_start > timeout:
-                    log.error(f'Webservice did not stop within timeout of {timeout} seconds.')
-                    raise TimeoutError(f'Webservice did not stop within timeout of {timeout} seconds.')
+            self.thread.join(timeout=timeout)
+            if self.thread.is_alive():
+                log.error(f'Webservice did not stop within timeout of {timeout} seconds.')
+                raise TimeoutError(f'Webservice did not stop within timeout of {timeout} seconds.')
         else:
             log.error('STOP of webservice requested, but it has not been started.')
 
     class __serverThread(Thread):
-        '''This subclass instantiates the server-thread and adds the ability to shut down the server.'''
-        def __init__(self, host, port, app):
+        '''
+        This subclass instantiates the server-thread and adds the ability to shut down the server.
+        The 'started' event is set as soon as the server socket is bound.
+        '''
+        def __init__(self, host, port, app, backend='werkzeug', workers=None):
             self.__app = app
             self.__host = host
             self.__port = port
+            self.__backend = backend
+            self.__workers = workers
             self.server = None
+            self.started = Event()
             Thread.__init__(self, daemon=True)
 
         def run(self):
             '''Run the webserver'''
-            log.info('starting server')
-            self.server = make_server(host=self.__host, port=self.__port, app=self.__app, threaded=True)
-            self.server.serve_forever()
+            log.info(f'starting {self.__backend} server')
+            try:
+                if self.__backend == 'waitress':
+                    self.server = _WaitressServer(self.__host, self.__port, self.__app, self.__workers)
+                elif self.__workers is not None:
+                    self.server = _PooledWSGIServer(self.__host, self.__port, self.__app, self.__workers)
+                else:
+                    self.server = make_server(host=self.__host, port=self.__port, app=self.__app, threaded=True)
+            except (Exception, SystemExit) as e:
+                # Werkzeug exits (instead of raising) if the socket can not be bound
+                log.error(f'Server could not be started on port {self.__port}: {e!r}')
+                return
+            self.started.set()
+            try:
+                self.server.serve_forever()
+            finally:
+                self.started.clear()
+                self.server.server_close()
 
         def shutdown(self):
             '''Shutdown the webserver'''
@@ -204,157 +902,2278 @@ class SQLRestAPI():
         def __init__(self, **kwargs):
             self.get_callable = kwargs['GET']
             self.post_callable = kwargs['POST']
+            self.stream_callable = kwargs['STREAM']
+            self.etag_callable = kwargs['ETAG']
+            self.subscribe_callable = kwargs['SUBSCRIBE']
+            self.rest_api = kwargs['rest_api']
+            self.subscriptions = kwargs['subscriptions']
+
+        def etag(self, query: str = None, fmt: str = None, **options) -> str:
+            '''ETag of the response to a query (or the 'GET') in a format - None if it cannot be found'''
+            if self.etag_callable is None:
+                return None
+            try:
+                tag = self.etag_callable(query, **options)
+            except Exception as e:
+                log.warning(f"Could not find the ETag of the response - it is sent without: {e}")
+                return None
+            return tag if tag is None or fmt is None else f"{tag}-{fmt}"
+
+        @staticmethod
+        def not_modified(tag: str) -> Response:
+            '''Response telling the client its copy is still valid, if it has the tag in 'If-None-Match' (else None)'''
+            if tag is None or not request.if_none_match.contains_weak(tag):
+                return None
+            response = Response(status=304)
+            response.set_etag(tag, weak=True)
+            return response
 
         def get(self):
-            '''Handles 'GET' requests to the endpoint'''
+            '''Handles 'GET' requests to the endpoint - with a query in the query string it subscribes to the query'''
+            if self.subscribe_callable is not None and ('sql-query' in request.args or 'statement' in request.args):
+                g.metrics_parsed = time.perf_counter()
+                try:
+                    options = {key: request.args[key] for key in ('statement',) if key in request.args}
+                    if 'params' in request.args:
+                        options['params'] = self.query_params(json.loads(request.args['params']))
+                    if 'key' in request.args:
+                        options['key'] = request.args.getlist('key')
+                    return self.subscribe(request.args.get('sql-query'), **options)
+                except Exception as e:
+                    return self.error(e)
+
+            tag = self.etag()
+            not_modified = self.not_modified(tag)
+            if not_modified is not None:
+                return not_modified
             try:
                 state = 200
                 message = self.get_callable()
             except Exception as e:
                 state = 400
                 message = {'error': f"'GET' failed with message '{e}'"}
-            return message, state
+            return message, state, {'ETag': quote_etag(tag, weak=True)} if tag is not None and state == 200 else {}
+
+        @staticmethod
+        def response_format(requested: str = None) -> str:
+            '''Find the format to send a DataFrame in - the 'format' key is used if given, otherwise the Accept header'''
+            if requested is not None:
+                return requested
+            mimetypes = list(dict.fromkeys(RESPONSE_FORMATS.values()))
+            mimetype = request.accept_mimetypes.best_match(mimetypes, default=RESPONSE_FORMATS['dict'])
+            return next(fmt for fmt in RESPONSE_FORMATS if RESPONSE_FORMATS[fmt] == mimetype)
+
+        @staticmethod
+        def query_params(value):
+            '''Type of the 'params' key - the values bound to the placeholders of the query'''
+            if not isinstance(value, (list, dict)):
+                raise ValueError("'params' must be a list (for '?' placeholders) or an object (for ':name' placeholders)")
+            return value
+
+        @staticmethod
+        def row_key(value):
+            '''Type of the 'key' key - the column(s) identifying a row of the result of a subscribed query'''
+            if isinstance(value, str):
+                return [value]
+            if not isinstance(value, list) or not all(isinstance(column, str) for column in value):
+                raise ValueError("'key' must be a column name or a list of column names")
+            return value
 
         def post(self):
             '''Handles 'POST' requests to the endpoint'''
             parser = reqparse.RequestParser()
             parser.add_argument('sql-query')
+            parser.add_argument('params', type=self.query_params, location='json')
+            parser.add_argument('statement')
+            parser.add_argument('format', choices=list(RESPONSE_FORMATS),
+                                help="{error_msg} - valid formats are: " + f"{list(RESPONSE_FORMATS)}")
+            parser.add_argument('stream', type=inputs.boolean, default=False)
+            parser.add_argument('subscribe', type=inputs.boolean, default=False)
+            parser.add_argument('key', type=self.row_key, location='json')
             args = parser.parse_args(strict=True)
+            g.metrics_parsed = time.perf_counter()
 
-            if args['sql-query'] is not None:
-                try:
-                    state = 200
-                    message = self.post_callable(args['sql-query'])
-                    if 'error' in message:
-                        state = 400
-                        message = {'error': f"Query failed with message '{message['error']}'"}
-                except Exception as e:
-                    state = 400
-                    message = {'error': f"Query failed with message '{e}'"}
-            else:
-                state = 400
-                message = {'error': "No query specified - use the key 'sql-query' to POST a query."}
-            return message, state
+            # Parameters and statements are only passed on when given, so functions without them keep working
+            query = args['sql-query']
+            options = {key: args[key] for key in ('params', 'statement') if args[key] is not None}
+            if query is None and 'statement' not in options:
+                return {'error': "No query specified - use the key 'sql-query' to POST a query."}, 400
+            try:
+                if args['subscribe']:
+                    return self.subscribe(query, **options, **({'key': args['key']} if args['key'] is not None else {}))
+                if args['stream']:
+                    return self.stream(query, args['format'], **options)
+            except Exception as e:
+                return self.error(e)
+            return self.query(query, self.response_format(args['format']), **options)
 
+        def query(self, query: str, fmt: str, **options):
+            '''
+            Respond with the result of a query in a format - or with a 304 if the client has the current version of it
+            (see 'etag').
+            '''
+            tag = self.etag(query, fmt, **options)
+            not_modified = self.not_modified(tag)
+            if not_modified is not None:
+                return not_modified
+            try:
+                message = self.post_callable(query, **options)
+                g.metrics_queried = time.perf_counter()
+                if isinstance(message, pd.DataFrame):
+                    return self.dataframe_response(message, fmt, tag)
+            except Exception as e:
+                return self.error(e)
+            if 'error' in message:
+                return {'error': f"Query failed with message '{message['error']}'"}, 400
+            return message, 200, {'ETag': quote_etag(tag, weak=True)} if tag is not None else {}
 
-class DataFrameAPI():
-    '''
-    Class for creating an SQL API for a pandas DataFrame.
-    It includes the 'SQLRestAPI' class so it can be exposed on a webservice.
+        @staticmethod
+        def dataframe_response(dataframe: pd.DataFrame, fmt: str, tag: str = None):
+            '''Respond with a DataFrame in a format (as a dict by flask-restful for 'dict') - with the ETag if given'''
+            g.metrics_rows = len(dataframe)
+            if fmt == 'dict':
+                return dataframe.to_dict(), 200, {'ETag': quote_etag(tag, weak=True)} if tag is not None else {}
+            response = Response(_serialize(dataframe, fmt), status=200, mimetype=RESPONSE_FORMATS[fmt])
+            if tag is not None:
+                response.set_etag(tag, weak=True)
+            return response
 
-    Attributes
-    ----------
-    ['name'] : pandas.DataFrame
-        If a name of a valid dataframe is passed, the corresponding dataframe will be returned.
-    web : SQLRestAPI
-        A SQLRestAPI object (See class for more info)
-    query_regex : str, default='^SELECT [^;]*;$'
-        Regular expression that SQL queries are validated against
+        def error(self, exception: Exception) -> tuple:
+            '''Message and status for a failed query - exceeded limits are reported with their own status and name'''
+            self.rest_api.metrics.inc('singupy_query_errors_total', type=type(exception).__name__)
+            message = {'error': f"Query failed with message '{exception}'"}
+            if isinstance(exception, QueryLimitError):
+                message['limit'] = exception.limit
+                return message, exception.status
+            return message, 400
 
-    '''
-    def __init__(self, dataframe: pd.DataFrame = None, dbname: str = 'dataframe', query_regex: str = r'^SELECT [^;]*;$',
-                 port: int = 5000, endpoint: str = '', enable_web: bool = True):
-        '''
-        Parameters
-        ----------
-        dataframe : pd.DataFrame, default=None
-            If provided, this dataframe will be served at startup
-        dbname : str, default='dataframe'
-            Name of the database (i.e. SELECT * FROM <dbname>)
-        query_regex : str, default='^SELECT [^;]*;$'
-            Regular expression that SQL queries are validated against
-        port : int, default=5000
-            The port to expose the webservice on
-        endpoint : str, default=''
-            Route/Endpoint of the webservice (i.e. http://host:port/<endpoint>)
-        enable_web : bool. default=True
-            If true the webservice will be started at instantiation
-        '''
-        # Setup DataFrameAPI and add any included dataframes
-        self.__dataframes = {}
-        self.query_regex = query_regex
-        self[dbname] = dataframe
+        def stream(self, query: str, fmt: str = None, **options) -> Response:
+            '''Stream the result of a query in chunks - the first chunk is fetched up front so errors give a 400'''
+            if self.stream_callable is None:
+                raise NotImplementedError('Streaming is not supported by this endpoint.')
+            fmt = 'ndjson' if fmt is None else fmt
+            if fmt not in STREAM_FORMATS:
+                raise ValueError(f"Format '{fmt}' cannot be streamed - valid formats are: {STREAM_FORMATS}")
 
-        # Setup WEB Host / SQLRestAPI
-        self.web = SQLRestAPI(port=port, endpoint=endpoint, getcall=self.metadata, postcall=self.query, start=enable_web)
+            chunks = iter(self.stream_callable(query, self.rest_api.chunksize, **options))
+            first = next(chunks, pd.DataFrame())
+            g.metrics_queried = time.perf_counter()
+            return Response(self.generate(first, chunks, fmt), status=200, mimetype=RESPONSE_FORMATS[fmt])
 
-    def __len__(self):
-        return len(self.__dataframes)
+        def subscribe(self, query: str, **options) -> Response:
+            '''
+            Push the events of a subscription to a query as Server-Sent Events - the first event is fetched up front
+            so errors give a 400. If all workers that can be held by subscriptions are in use, a 503 is returned.
+            '''
+            if self.subscribe_callable is None:
+                raise NotImplementedError('Subscriptions are not supported by this endpoint.')
+            if self.subscriptions is not None and not self.subscriptions.acquire(blocking=False):
+                log.warning('Rejected a subscription as the maximum number of subscriptions is open.')
+                return {'error': f"Too many subscriptions - at most {self.rest_api.max_subscriptions} can be open "
+                                 f"at once."}, 503
+            try:
+                events = iter(self.subscribe_callable(query, **options))
+                first = next(events)
+            except BaseException:
+                if self.subscriptions is not None:
+                    self.subscriptions.release()
+                raise
+            g.metrics_queried = time.perf_counter()
+            response = Response(self.generate_events(first, events, self.rest_api.stopping), status=200,
+                                mimetype='text/event-stream')
+            response.headers['Cache-Control'] = 'no-cache'
+            if self.subscriptions is not None:
+                # The response is closed by the server when it is done, also if it is never iterated
+                response.call_on_close(self.subscriptions.release)
+            return response
 
-    def __iter__(self):
-        return iter(self.__dataframes.keys())
+        @staticmethod
+        def generate_events(first: tuple, events: Iterator[tuple], stopping: Event) -> Iterator[bytes]:
+            '''
+            Serialize the already fetched first event and the following events, until the webservice is stopped - the
+            events are closed when done (i.e. when the client disconnects).
+            '''
+            try:
+                yield _serialize_event(*first)
+                for event in events:
+                    if stopping.is_set():
+                        break
+                    yield _serialize_event(*event)
+            finally:
+                if hasattr(events, 'close'):
+                    events.close()
 
-    def __getitem__(self, name) -> pd.DataFrame:
-        try:
-            return self.__dataframes[name]
-        except Exception:
-            log.error(f"Could not access DataFrame with name '{name}' in DataFrameAPI.")
-            raise KeyError(f"API Contains no DataFrame with name '{name}'.")
+        @staticmethod
+        def generate(first: pd.DataFrame, chunks: Iterator[pd.DataFrame], fmt: str) -> Iterator[bytes]:
+            '''Serialize the already fetched first chunk and the remaining chunks - the chunks are closed when done.'''
+            def chain():
+                yield first
+                yield from chunks
 
-    def __setitem__(self, name, dataframe):
-        if isinstance(dataframe, pd.DataFrame):
-            self.__dataframes[name] = dataframe
-        elif dataframe is None:
-            if name in self.__dataframes:
-                del self.__dataframes[name]
-        else:
-            log.error(f"Tried to set value of '{name}' dataframe to an object of '{type(dataframe)} type in DataFrameAPI.'")
-            raise ValueError("'dataframe' variable must be either a valid dataframe or 'None'")
+            try:
+                yield from _serialize_chunks(chain(), fmt)
+            finally:
+                if hasattr(chunks, 'close'):
+                    chunks.close()
 
-    def __delitem__(self, name):
-        if name in self.__dataframes:
-            del self.__dataframes[name]
-        else:
-            log.error(f"Could not find (and thereby delete) DataFrame with name '{name}' in DataFrameAPI.")
-            raise KeyError(f"API Contains no DataFrame with name '{name}'.")
 
-    def clear(self):
-        '''Remove all dataframes from API.'''
-        self.__dataframes = {}
+class _TransactionConnection(sqlite3.Connection):
+    '''
+    SQLite connection that only commits (or rolls back) when the outermost transaction of a '_SQLiteEngine' ends, so
+    changes made with pandas (which commits after each call) are part of the transaction.
+    '''
+    depth = 0
 
-    def metadata(self) -> dict:
-        '''
-        Provide metadata about the API setup - used to query what is available.
+    def commit(self):
+        if not self.depth:
+            super().commit()
 
-        Returns
-        -------
-        dict
-            Dict with the query-regex and metadata about the dataframes hosted by the API.
-        '''
-        return {
-            'query_regex': self.query_regex,
-            'dataframes': {dfname: {'columns': list(self[dfname].columns),
-                                    'rowcount': self[dfname].shape[0]} for dfname in self}
-        }
+    def rollback(self):
+        if not self.depth:
+            super().rollback()
 
-    def query(self, query: str) -> dict:
-        '''
-        Return data corresponding to the given query
 
-        Parameters
-        ----------
-        query : str
-            The query to respond to in SQLite style.
+class _SQLiteEngine():
+    '''
+    Persistent SQLite database used by the DataFrameAPI to answer queries.
 
-        Returns
-        -------
-        dict
-            Dict with the data returned from the dataframe.
-        '''
-        log.debug(f"Received SQL Query: {query}")
+    Each dataframe is loaded once when it is set and only that table is reloaded when it is replaced or removed,
+    so queries are served from the already-loaded tables instead of copying every dataframe on each call.
 
-        # Make sure sql-query fits regex - used for security reasons.
+    Changes are made in transactions on a single writer connection, while queries run on a pool of reader connections.
+    The database is a file in a temporary directory (created in 'directory') in WAL mode, so each query reads the tables as
+    of the last committed transaction - queries never wait for changes, and changes made in one 'transaction' are seen
+    by queries all at once. If 'shared' is False, the database is kept in memory and queries use the writer connection
+    (used by worker processes, which run one query at a time).
+    '''
+    def __init__(self, shared: bool = True, directory: str = None):
+        self.__directory = None
+        self.__path = ':memory:'
+        if shared:
+            self.__directory = tempfile.mkdtemp(prefix='singupy-', dir=directory)
+            self.__path = os.path.join(self.__directory, 'engine.sqlite')
+            weakref.finalize(self, shutil.rmtree, self.__directory, True)
+        self.__local = local()
+        self.__write_lock = RLock()
+        self.__writer = self.__connect(factory=_TransactionConnection)
+        if shared:
+            self.__writer.execute('PRAGMA journal_mode=WAL')
+            self.__writer.execute('PRAGMA synchronous=OFF')
+        self.__readers = queue.SimpleQueue()
+        self.__tables = set()
+
+    def __connect(self, **kwargs) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.__path, check_same_thread=False, **kwargs)
+
+        # SQLite calls the progress handler (in the thread running the query) while working, so queries can be
+        # interrupted when the deadline of that thread has passed
+        connection.set_progress_handler(self.__deadline_passed, 10000)
+        return connection
+
+    def __deadline_passed(self) -> bool:
+        deadline = getattr(self.__local, 'deadline', None)
+        return deadline is not None and time.time() > deadline
+
+    @contextmanager
+    def __reader(self):
+        '''Borrow a reader connection from the pool (the writer connection if the database is not shared).'''
+        if self.__directory is None:
+            with self.__write_lock:
+                yield self.__writer
+            return
+
+        try:
+            connection = self.__readers.get_nowait()
+        except queue.Empty:
+            connection = self.__connect()
+            connection.execute('PRAGMA query_only=ON')
+        try:
+            yield connection
+        finally:
+            self.__readers.put(connection)
+
+    def __contains__(self, name) -> bool:
+        return name in self.__tables
+
+    @staticmethod
+    def _quote(name: str) -> str:
+        '''Quote a table or column name so it can be used as an SQLite identifier.'''
+        return '"' + str(name).replace('"', '""') + '"'
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Make changes in a transaction, so queries see all of them when the outermost transaction ends - or none of them
+        if an exception is raised. Transactions can be nested (they are part of the outermost transaction).
+        '''
+        with self.__write_lock:
+            connection = self.__writer
+            if not connection.depth:
+                connection.execute('BEGIN')
+            connection.depth += 1
+            try:
+                yield connection
+            except BaseException:
+                connection.depth -= 1
+                if not connection.depth:
+                    connection.rollback()
+                    self.__tables = {row[0] for row in
+                                     connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                raise
+            connection.depth -= 1
+            if not connection.depth:
+                connection.commit()
+
+    def load(self, name: str, dataframe: pd.DataFrame) -> None:
+        '''Load (or reload) a dataframe as a table - empty dataframes are not loaded as they cannot be queried.'''
+        with self.transaction() as connection:
+            self.drop(name)
+            if not dataframe.empty:
+                # pandasql (and the SQLAlchemy it loads) is imported when the first table is loaded, not with the module
+                from pandasql.sqldf import write_table
+
+                try:
+                    write_table(dataframe, name, connection)
+                except Exception as e:
+                    log.error(f"Could not load DataFrame with name '{name}' into the query engine: {e}")
+                    connection.execute(f'DROP TABLE IF EXISTS {self._quote(name)}')
+                else:
+                    self.__tables.add(name)
+
+    def append(self, name: str, rows: pd.DataFrame) -> None:
+        '''Insert rows into a loaded table - the rows must have the same layout as the loaded dataframe.'''
+        with self.transaction() as connection:
+            to_sql(rows, name=name, con=connection, if_exists='append',
+                   index=not any(level is None for level in rows.index.names))
+            self.__tables.add(name)
+
+    def upsert(self, name: str, rows: pd.DataFrame, key: list) -> None:
+        '''Replace the rows of a loaded table that match the key of the given rows and insert the remaining rows.'''
+        with self.transaction() as connection:
+            if name in self.__tables:
+                # Index the key columns (once per table load) so matching rows are found without a full scan
+                index_name = self._quote(f"upsert__{name}__{'__'.join(key)}")
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {self._quote(name)} "
+                                   f"({', '.join(self._quote(column) for column in key)})")
+                # The keys are written with pandas like the rows, so they are stored as the same SQLite values (i.e.
+                # timestamps as text) - and matched with 'IS', which (unlike '=') also matches NULL keys
+                keys = f"upsert_keys__{name}"
+                to_sql(rows[key], name=keys, con=connection, if_exists='replace', index=False)
+                values = connection.execute(f"SELECT * FROM {self._quote(keys)}").fetchall()
+                connection.execute(f"DROP TABLE {self._quote(keys)}")
+                where = ' AND '.join(f'{self._quote(column)} IS ?' for column in key)
+                connection.executemany(f'DELETE FROM {self._quote(name)} WHERE {where}', values)
+            self.append(name, rows)
+
+    def create_index(self, name: str, columns: tuple) -> None:
+        '''Index columns of a loaded table (if not already indexed) - tables not loaded are ignored.'''
+        with self.transaction() as connection:
+            if name in self.__tables:
+                index_name = self._quote(f"index__{name}__{'__'.join(columns)}")
+                connection.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {self._quote(name)} "
+                                   f"({', '.join(self._quote(column) for column in columns)})")
+
+    def drop(self, name: str) -> None:
+        '''Remove a table from the database if it is loaded.'''
+        with self.transaction() as connection:
+            if name in self.__tables:
+                connection.execute(f'DROP TABLE IF EXISTS {self._quote(name)}')
+                self.__tables.discard(name)
+
+    def clear(self) -> None:
+        '''Remove all tables from the database.'''
+        with self.transaction():
+            for name in list(self.__tables):
+                self.drop(name)
+
+    def backup(self, path: str) -> list:
+        '''Copy the committed database (tables and indexes) to a file - returns the names of the tables.'''
+        with self.__reader() as connection:
+            target = sqlite3.connect(path)
+            try:
+                connection.backup(target)
+                target.execute('PRAGMA journal_mode=DELETE')
+                return sorted(row[0] for row in target.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+            finally:
+                target.close()
+
+    def restore(self, path: str) -> None:
+        '''Replace the database by a copy saved with 'backup' - must not be called within a transaction.'''
+        with self.__write_lock:
+            source = sqlite3.connect(path)
+            try:
+                source.backup(self.__writer)
+            finally:
+                source.close()
+            self.__tables = {row[0] for row in self.__writer.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+    @contextmanager
+    def __deadline(self, deadline: float = None):
+        '''Interrupt the SQLite work done within the context when the deadline (a time.time() timestamp) passes.'''
+        self.__local.deadline = deadline
+        try:
+            yield
+        except sqlite3.OperationalError as e:
+            if deadline is not None and 'interrupted' in str(e):
+                raise QueryTimeoutError('Query was interrupted as it exceeded the time limit.') from None
+            raise
+        finally:
+            self.__local.deadline = None
+
+    def query(self, query: str, deadline: float = None, max_rows: int = None, params=None) -> pd.DataFrame:
+        '''
+        Run a query against the loaded tables and return the result as a dataframe.
+        If a deadline (as a time.time() timestamp) is given, the query is interrupted when it passes - and if max_rows
+        is given, the query fails as soon as the result is found to have more rows. The params (a list or dict) are
+        bound to the placeholders of the query.
+        '''
+        with self.__reader() as connection, self.__deadline(deadline):
+            cursor = connection.execute(query, () if params is None else params)
+            try:
+                columns = [column[0] for column in cursor.description]
+                rows = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows + 1)
+            finally:
+                cursor.close()
+        if max_rows is not None and len(rows) > max_rows:
+            raise QueryLimitError(f'Query result exceeds the limit of {max_rows} rows.', 'max_rows')
+        return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+    def explain(self, query: str, params=None) -> list:
+        '''Return the query plan of a query (the details of SQLite's 'EXPLAIN QUERY PLAN') without running it.'''
+        params = () if params is None else params
+        if self.__directory is None:
+            with self.__reader() as connection:
+                return [row[3] for row in connection.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()]
+
+        # Cached EXPLAIN statements of the pooled readers are not prepared again when indexes change, so a new
+        # connection is used
+        connection = self.__connect()
+        try:
+            return [row[3] for row in connection.execute(f'EXPLAIN QUERY PLAN {query}', params).fetchall()]
+        finally:
+            connection.close()
+
+    def iter_query(self, query: str, chunksize: int, deadline: float = None, max_rows: int = None,
+                   max_bytes: int = None, params=None) -> Iterator[pd.DataFrame]:
+        '''
+        Run a query against the loaded tables and return the result in dataframes of at most 'chunksize' rows.
+        At least one (possibly empty) dataframe is returned. All chunks are read from the tables as they were when the
+        query started, also if they are changed meanwhile.
+        If a deadline (as a time.time() timestamp) is given, the query is interrupted when it passes - also if it passes
+        while a chunk is being sent. If max_rows or max_bytes (the size of the chunks in memory) is given, a
+        QueryLimitError is raised as soon as the chunks returned so far exceed it.
+        '''
+        def fetch(function, *args):
+            if deadline is not None and time.time() > deadline:
+                raise QueryTimeoutError('Query was interrupted as it exceeded the time limit.')
+            with self.__deadline(deadline):
+                return function(*args)
+
+        def chunk(rows: list) -> pd.DataFrame:
+            nonlocal total_rows, total_bytes
+            dataframe = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+            total_rows += len(dataframe)
+            if max_rows is not None and total_rows > max_rows:
+                raise QueryLimitError(f'Query result exceeds the limit of {max_rows} rows.', 'max_rows')
+            if max_bytes is not None:
+                total_bytes += dataframe.memory_usage(index=False, deep=True).sum()
+                if total_bytes > max_bytes:
+                    raise QueryLimitError(f'Query result exceeds the limit of {max_bytes} bytes.', 'max_bytes')
+            return dataframe
+
+        total_rows = total_bytes = 0
+        with self.__reader() as connection:
+            cursor = fetch(connection.execute, query, () if params is None else params)
+            try:
+                columns = [column[0] for column in cursor.description]
+                rows = fetch(cursor.fetchmany, chunksize)
+                yield chunk(rows)
+                while len(rows) == chunksize:
+                    rows = fetch(cursor.fetchmany, chunksize)
+                    if rows:
+                        yield chunk(rows)
+            finally:
+                cursor.close()
+
+
+# State of a worker process of a '_ProcessEngine' - the engine and the files loaded into it for each table
+_worker_engine = None
+_worker_files = {}
+
+
+def _worker_query(catalog: dict, query: str, deadline: float = None, max_rows: int = None,
+                  params=None) -> pd.DataFrame:
+    '''Bring the tables of the worker up to date with the catalog and run the query (runs in the worker process).'''
+    global _worker_engine
+    if _worker_engine is None:
+        _worker_engine = _SQLiteEngine(shared=False)
+
+    for name in list(_worker_files):
+        if name not in catalog:
+            _worker_engine.drop(name)
+            del _worker_files[name]
+
+    for name, files in catalog.items():
+        loaded = _worker_files.get(name, ())
+        if files[:len(loaded)] != loaded:
+            loaded = ()
+        for path, operation, key in files[len(loaded):]:
+            if operation == 'index':
+                _worker_engine.create_index(name, key)
+                continue
+            dataframe = pd.read_pickle(path)
+            if operation == 'load':
+                _worker_engine.load(name, dataframe)
+            elif operation == 'append':
+                _worker_engine.append(name, dataframe)
+            else:
+                _worker_engine.upsert(name, dataframe, list(key))
+        _worker_files[name] = files
+
+    return _worker_engine.query(query, deadline=deadline, max_rows=max_rows, params=params)
+
+
+class _ProcessEngine():
+    '''
+    Pool of worker processes answering queries, each holding its own copy of the tables in a '_SQLiteEngine'.
+
+    Dataframes (and rows added with 'append' and 'upsert') are written once to files in a temporary directory when they
+    change, and each worker only loads the files it has not loaded yet - so the tables are not sent to the workers on
+    every query. Queries run outside of the GIL of the main process, so a slow query does not stall other requests.
+    Changes are made to a copy of the catalog of files, which replaces the catalog sent with queries when the
+    outermost 'transaction' ends.
+    '''
+    # Maximum number of append/upsert files of a table before the full dataframe should be written again
+    max_updates = 64
+
+    def __init__(self, processes: int):
+        self.__directory = tempfile.mkdtemp(prefix='singupy-')
+        self.__pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+        self.__catalog = {}
+        self.__staged = None
+        self.__counter = count(1)
+        self.__lock = RLock()
+        self.__futures = set()
+        weakref.finalize(self, _ProcessEngine._close, self.__pool, self.__directory, self.__futures)
+
+    @staticmethod
+    def _close(pool: ProcessPoolExecutor, directory: str, futures: set) -> None:
+        # Queries waiting for a worker are cancelled by hand ('cancel_futures' of 'shutdown' requires Python 3.9)
+        for future in list(futures):
+            future.cancel()
+        pool.shutdown(wait=False)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def __write(self, dataframe: pd.DataFrame) -> str:
+        path = os.path.join(self.__directory, f'{next(self.__counter)}.pkl')
+        dataframe.to_pickle(path)
+        return path
+
+    @staticmethod
+    def __remove(files: tuple) -> None:
+        for path, _, _ in files:
+            if path is None:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Make changes in a transaction, so queries see all of them when the outermost transaction ends - or none of them
+        if an exception is raised. Transactions can be nested (they are part of the outermost transaction).
+        '''
+        with self.__lock:
+            if self.__staged is not None:
+                yield self.__staged
+                return
+
+            self.__staged = dict(self.__catalog)
+            try:
+                yield self.__staged
+            except BaseException:
+                published = {file for files in self.__catalog.values() for file in files}
+                self.__remove([file for files in self.__staged.values() for file in files if file not in published])
+                raise
+            else:
+                # Files no longer in the catalog are removed - queries sent with them are retried by 'query'
+                staged = {file for files in self.__staged.values() for file in files}
+                old_files = [file for files in self.__catalog.values() for file in files if file not in staged]
+                self.__catalog = self.__staged
+                self.__remove(old_files)
+            finally:
+                self.__staged = None
+
+    def updates(self, name: str) -> int:
+        '''Number of append/upsert files the workers must apply on top of the full dataframe.'''
+        with self.transaction() as catalog:
+            return max(len(catalog.get(name, ())) - 1, 0)
+
+    def load(self, name: str, dataframe: pd.DataFrame) -> None:
+        '''Load (or reload) a dataframe as a table in the workers - empty dataframes are not loaded.'''
+        with self.transaction() as catalog:
+            catalog.pop(name, None)
+            if not dataframe.empty:
+                catalog[name] = ((self.__write(dataframe), 'load', None),)
+
+    def append(self, name: str, rows: pd.DataFrame) -> None:
+        '''Insert rows into a table in the workers.'''
+        with self.transaction() as catalog:
+            catalog[name] = catalog.get(name, ()) + ((self.__write(rows), 'append', None),)
+
+    def upsert(self, name: str, rows: pd.DataFrame, key: list) -> None:
+        '''Replace the rows matching the key of the given rows and insert the remaining rows in the workers.'''
+        with self.transaction() as catalog:
+            catalog[name] = catalog.get(name, ()) + ((self.__write(rows), 'upsert', tuple(key)),)
+
+    def create_index(self, name: str, columns: tuple) -> None:
+        '''Index columns of a table in the workers - tables not loaded are ignored.'''
+        with self.transaction() as catalog:
+            if name in catalog:
+                catalog[name] = catalog[name] + ((None, 'index', tuple(columns)),)
+
+    def drop(self, name: str) -> None:
+        '''Remove a table from the workers.'''
+        with self.transaction() as catalog:
+            catalog.pop(name, None)
+
+    def clear(self) -> None:
+        '''Remove all tables from the workers.'''
+        with self.transaction() as catalog:
+            catalog.clear()
+
+    def query(self, query: str, deadline: float = None, max_rows: int = None, params=None) -> pd.DataFrame:
+        '''
+        Run a query in a worker and return the result as a dataframe. If the query has not finished when the deadline
+        passes (also counting the time waiting for a worker), it is cancelled or interrupted and a QueryTimeoutError is
+        raised. See '_SQLiteEngine.query' for max_rows and params.
+        '''
+        for attempt in range(2):
+            future = self.__pool.submit(_worker_query, self.__catalog, query, deadline, max_rows, params)
+            self.__futures.add(future)
+            future.add_done_callback(self.__futures.discard)
+            try:
+                # Allow a moment for the worker to report the interruption after the deadline
+                return future.result(timeout=None if deadline is None else max(deadline - time.time(), 0) + 1)
+            except FutureTimeoutError:
+                future.cancel()
+                raise QueryTimeoutError('Query did not finish within the time limit.') from None
+            except FileNotFoundError:
+                # A dataframe was replaced while the query was sent - try again with the current tables
+                if attempt:
+                    raise
+
+
+# Tokens of the simple SELECT queries that the DataFrameAPI answers directly with pandas
+_TOKEN = re.compile(r'''\s*(?:(?P<string>'(?:[^']|'')*')|(?P<number>[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)|'''
+                    r'''(?P<quoted>"(?:[^"]|"")+")|(?P<name>[A-Za-z_]\w*)|(?P<symbol><=|>=|<>|!=|==|[=<>,()*;]))''')
+_KEYWORDS = {'select', 'from', 'where', 'and', 'or', 'not', 'in', 'between', 'is', 'null', 'order', 'by', 'asc',
+             'desc', 'limit', 'offset', 'as', 'group', 'having', 'join', 'on', 'union', 'distinct', 'like'}
+_COMPARISONS = {'=': '==', '==': '==', '!=': '!=', '<>': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+
+class _Tokens():
+    '''Tokens of a simple SELECT query with a cursor - the clause parsers consume them from the front.'''
+    def __init__(self, tokens: list):
+        self.tokens = tokens
+        self.index = 0
+
+    def accept(self, kind: str, value=None):
+        '''Consume the next token and return its value if it matches the kind (and value) - else return None.'''
+        token = self.tokens[self.index]
+        if token[0] == kind and (value is None or token[1] == value):
+            self.index += 1
+            return token[1]
+        return None
+
+    def expect(self, kind: str, value=None):
+        '''Like 'accept', but raise ValueError if the next token does not match.'''
+        result = self.accept(kind, value)
+        if result is None:
+            raise ValueError
+        return result
+
+    def at_end(self) -> bool:
+        '''Return True if all tokens are consumed.'''
+        return self.tokens[self.index][0] == 'end'
+
+
+def _tokenize(query: str) -> _Tokens:
+    '''Split a query into literal, name, keyword and symbol tokens - or return None if it has other characters.'''
+    tokens = []
+    position = 0
+    query = query.rstrip()
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if match is None or match.end() == position:
+            return None
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'string':
+            tokens.append(('literal', text[1:-1].replace("''", "'")))
+        elif kind == 'number':
+            tokens.append(('literal', float(text) if any(char in text for char in '.eE') else int(text)))
+        elif kind == 'quoted':
+            tokens.append(('name', text[1:-1].replace('""', '"')))
+        elif kind == 'name' and text.lower() in _KEYWORDS:
+            tokens.append(('keyword', text.lower()))
+        else:
+            tokens.append((kind, text))
+        position = match.end()
+    if tokens and tokens[-1] == ('symbol', ';'):
+        tokens.pop()
+    tokens.append(('end', None))
+    return _Tokens(tokens)
+
+
+def _parse_select_list(tokens: _Tokens) -> tuple:
+    '''Parse '* | col [AS alias], ...' into a tuple of (column, alias) - or None for '*'.'''
+    if tokens.accept('symbol', '*') is not None:
+        return None
+    columns = []
+    while True:
+        column = tokens.expect('name').lower()
+        alias = tokens.expect('name') if tokens.accept('keyword', 'as') is not None else None
+        columns.append((column, alias))
+        if tokens.accept('symbol', ',') is None:
+            return tuple(columns)
+
+
+def _parse_condition(tokens: _Tokens) -> tuple:
+    '''Parse 'col op literal', 'col [NOT] IN (literal, ...)' or 'col BETWEEN literal AND literal'.'''
+    column = tokens.expect('name').lower()
+    symbol = tokens.accept('symbol')
+    if symbol is not None:
+        if symbol not in _COMPARISONS:
+            raise ValueError
+        return column, _COMPARISONS[symbol], (tokens.expect('literal'),)
+    negate = tokens.accept('keyword', 'not') is not None
+    if tokens.accept('keyword', 'in') is not None:
+        tokens.expect('symbol', '(')
+        values = [tokens.expect('literal')]
+        while tokens.accept('symbol', ',') is not None:
+            values.append(tokens.expect('literal'))
+        tokens.expect('symbol', ')')
+        return column, 'not in' if negate else 'in', tuple(values)
+    if not negate and tokens.accept('keyword', 'between') is not None:
+        lower = tokens.expect('literal')
+        tokens.expect('keyword', 'and')
+        return column, 'between', (lower, tokens.expect('literal'))
+    raise ValueError
+
+
+def _parse_where(tokens: _Tokens) -> tuple:
+    '''Parse an optional 'WHERE cond AND ...' clause into a tuple of (column, operator, values).'''
+    conditions = []
+    if tokens.accept('keyword', 'where') is not None:
+        conditions.append(_parse_condition(tokens))
+        while tokens.accept('keyword', 'and') is not None:
+            conditions.append(_parse_condition(tokens))
+    return tuple(conditions)
+
+
+def _parse_order_by(tokens: _Tokens) -> tuple:
+    '''Parse an optional 'ORDER BY col [ASC|DESC], ...' clause into a tuple of (column, ascending).'''
+    order = []
+    if tokens.accept('keyword', 'order') is not None:
+        tokens.expect('keyword', 'by')
+        while True:
+            column = tokens.expect('name').lower()
+            descending = tokens.accept('keyword', 'desc') is not None
+            if not descending:
+                tokens.accept('keyword', 'asc')
+            order.append((column, not descending))
+            if tokens.accept('symbol', ',') is None:
+                break
+    return tuple(order)
+
+
+def _parse_limit(tokens: _Tokens) -> tuple:
+    '''Parse an optional 'LIMIT n [OFFSET m]' clause into (limit, offset), which are None if not given.'''
+    limit = offset = None
+    if tokens.accept('keyword', 'limit') is not None:
+        limit = tokens.expect('literal')
+        if tokens.accept('keyword', 'offset') is not None:
+            offset = tokens.expect('literal')
+        if any(not isinstance(value, int) or value < 0 for value in (limit, offset or 0)):
+            raise ValueError
+    return limit, offset
+
+
+@lru_cache(maxsize=1024)
+def _parse_simple_select(query: str) -> tuple:
+    '''
+    Parse a simple single-table query - 'SELECT * | col [AS alias], ... FROM table [WHERE cond AND ...]
+    [ORDER BY col [ASC|DESC], ...] [LIMIT n [OFFSET m]];' where each cond compares a column to literals with a
+    comparison operator, 'IN (...)' or 'BETWEEN ... AND ...'.
+
+    Returns the plan as a tuple of (table, columns, conditions, order, limit, offset) with lowercased identifiers
+    (except the aliases), where columns is None for '*' - or None if the query is not that simple.
+    '''
+    tokens = _tokenize(query)
+    if tokens is None:
+        return None
+    try:
+        tokens.expect('keyword', 'select')
+        columns = _parse_select_list(tokens)
+        tokens.expect('keyword', 'from')
+        table = tokens.expect('name').lower()
+        conditions = _parse_where(tokens)
+        order = _parse_order_by(tokens)
+        limit, offset = _parse_limit(tokens)
+        if not tokens.at_end():
+            raise ValueError
+    except ValueError:
+        return None
+    return table, columns, conditions, order, limit, offset
+
+
+def _compatible(kind: str, values: tuple) -> bool:
+    '''Return True if the literals can be compared to a column of the kind ('int', 'float' or 'str').'''
+    if kind == 'str':
+        return all(isinstance(value, str) for value in values)
+    return all(isinstance(value, (int, float)) for value in values)
+
+
+def _matches(frame: pd.DataFrame, conditions: tuple, columns: dict) -> pd.DataFrame:
+    '''Return the rows of a frame that match all the conditions of a plan.'''
+    mask = None
+    for column, operator, values in conditions:
+        name, _, nulls = columns[column]
+        series = frame[name]
+        if operator == 'in':
+            condition = series.isin(values)
+        elif operator == 'not in':
+            condition = ~series.isin(values)
+        elif operator == 'between':
+            condition = (series >= values[0]) & (series <= values[1])
+        else:
+            condition = {'==': series.__eq__, '!=': series.__ne__, '<': series.__lt__, '<=': series.__le__,
+                         '>': series.__gt__, '>=': series.__ge__}[operator](values[0])
+        if nulls:
+            # Comparisons with NULL are never true in SQL
+            condition &= series.notna()
+        mask = condition if mask is None else mask & condition
+    return frame if mask is None else frame[mask.to_numpy()]
+
+
+def _filter_rows(dataframe: pd.DataFrame, conditions: tuple, columns: dict, needed: int = None) -> pd.DataFrame:
+    '''
+    Return the rows of the dataframe that match the conditions - if only the first 'needed' rows are used, stop
+    scanning when enough rows are found (like SQLite) by filtering the dataframe in growing slices.
+    '''
+    if not conditions or needed is None:
+        return _matches(dataframe, conditions, columns)
+    parts, found, start, size = [], 0, 0, max(256, needed * 4)
+    while found < needed and start < len(dataframe):
+        part = _matches(dataframe.iloc[start:start + size], conditions, columns)
+        parts.append(part)
+        found += len(part)
+        start, size = start + size, size * 4
+    return pd.concat(parts) if len(parts) > 1 else parts[0] if parts else dataframe.iloc[:0]
+
+
+def _first_positions(values: np.ndarray, ascending: bool, nulls: bool, needed: int) -> np.ndarray:
+    '''
+    Return the positions of the first 'needed' numeric values in stable sort order without sorting all of them -
+    NULLs are placed first when ascending and last when descending (like SQLite).
+    '''
+    positions = np.arange(len(values))
+    missing = np.isnan(values) if nulls else np.zeros(len(values), dtype=bool)
+    null_positions, positions = positions[missing], positions[~missing]
+    keys = values[positions] if ascending else -values[positions]
+    wanted = min(max(needed - len(null_positions), 0) if ascending else needed, len(positions))
+    best = np.argpartition(keys, wanted - 1)[:wanted] if wanted else positions[:0]
+    best = positions[best[np.lexsort((best, keys[best]))]]
+    nulls_used = null_positions[:needed - wanted]
+    return np.concatenate((nulls_used, best) if ascending else (best, nulls_used))
+
+
+def _run_simple_select(plan: tuple, dataframe: pd.DataFrame, columns: dict):
+    '''
+    Run a plan from '_parse_simple_select' on a dataframe with vectorized pandas operations, giving the same result
+    as the SQLite engine. 'columns' maps the lowercased names of the columns that can be used to (name, kind, nulls),
+    where kind is 'int', 'float' or 'str' - None is returned if the plan uses other columns or does not fit the kinds.
+    '''
+    _, selected, conditions, order, limit, offset = plan
+    if any(column not in columns or not _compatible(columns[column][1], values) for column, _, values in conditions):
+        return None
+    if any(column not in columns for column, _ in order):
+        return None
+    ascending = [direction for _, direction in order]
+    if len(set(ascending)) > 1 and any(columns[column][2] for column, _ in order):
+        return None
+
+    needed = None if limit is None else (offset or 0) + limit
+    result = _filter_rows(dataframe, conditions, columns, None if order else needed)
+    if order:
+        name, kind, nulls = columns[order[0][0]]
+        if len(order) == 1 and needed is not None and needed < len(result) // 2 and kind != 'str':
+            # Only the first rows are needed, so select them before sorting (like SQLite does)
+            result = result.iloc[_first_positions(result[name].to_numpy(), ascending[0], nulls, needed)]
+        else:
+            # SQLite sorts NULLs first (so they come last when descending)
+            result = result.sort_values([columns[column][0] for column, _ in order], ascending=ascending,
+                                        kind='stable', na_position='first' if ascending[0] else 'last')
+    return _project(result, dataframe, selected, columns, offset, limit)
+
+
+def _project(result: pd.DataFrame, dataframe: pd.DataFrame, selected: tuple, columns: dict, offset: int,
+             limit: int) -> pd.DataFrame:
+    '''Apply the offset/limit and select the columns of a result of '_run_simple_select'.'''
+    if limit is not None or offset is not None:
+        start = offset or 0
+        result = result.iloc[start:None if limit is None else start + limit]
+
+    if selected is None:
+        if any(str(column).lower() not in columns for column in dataframe.columns):
+            return None
+    else:
+        if any(column not in columns for column, _ in selected):
+            return None
+        result = result[[columns[column][0] for column, _ in selected]]
+        result.columns = [alias if alias is not None else columns[column][0] for column, alias in selected]
+    return result.reset_index(drop=True)
+
+
+class _QueryCache():
+    '''
+    Thread-safe LRU cache of query results used by the DataFrameAPI.
+
+    Keys must include the versions of the dataframes a query depends on, so updated dataframes never serve stale results.
+    '''
+    def __init__(self, maxsize: int = 128, ttl: float = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = Lock()
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def get(self, key):
+        '''Return the cached value for the key, or None if it is not cached (or has expired).'''
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self.__entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value) -> None:
+        '''Add a value to the cache, evicting the least recently used entries if the cache is full.'''
+        if self.maxsize <= 0:
+            return
+        with self.__lock:
+            self.__entries[key] = (time.monotonic(), value)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.maxsize:
+                self.__entries.popitem(last=False)
+
+    def clear(self) -> None:
+        '''Remove all entries from the cache.'''
+        with self.__lock:
+            self.__entries.clear()
+
+    def stats(self) -> dict:
+        '''Return the hit/miss counters and size of the cache.'''
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self), 'maxsize': self.maxsize, 'ttl': self.ttl}
+
+
+# Dataframes served by a DataFrameAPI, the rows added to them with 'append' or 'upsert' that are not yet applied to the
+# dataframes, the version of each dataframe and its statistics for the metadata (as the time it was last changed and a
+# dict of statistics, or None until they are computed) - a published catalog is never changed, only replaced as a whole
+_Catalog = namedtuple('_Catalog', ['dataframes', 'pending', 'versions', 'stats'])
+
+
+def _json_scalar(value):
+    '''Convert a scalar of a dataframe (i.e. the minimum of a column) to a JSON serializable value - None if null.'''
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if hasattr(value, 'item'):
+        value = value.item()
+    return value if isinstance(value, (str, int, float, bool)) else str(value)
+
+
+def _combine_extreme(first, second, function):
+    '''Combine two minimums (or maximums) of a column with 'function' (min or max) - None if they are not comparable.'''
+    if first is None or second is None:
+        return second if first is None else first
+    try:
+        return function(first, second)
+    except TypeError:
+        return None
+
+
+class DataFrameAPI():
+    '''
+    Class for creating an SQL API for a pandas DataFrame.
+    It includes the 'SQLRestAPI' class so it can be exposed on a webservice.
+
+    Attributes
+    ----------
+    ['name'] : pandas.DataFrame
+        If a name of a valid dataframe is passed, the corresponding dataframe will be returned.
+    web : SQLRestAPI
+        A SQLRestAPI object (See class for more info) - either its own or the shared 'server' it is mounted on
+    query_regex : str, default='^SELECT [^;]*;$'
+        Regular expression that SQL queries are validated against
+    cache : _QueryCache
+        LRU cache of query results - its size and ttl can be changed with the 'maxsize' and 'ttl' attributes
+    query_timeout : float
+        Maximum time in seconds a query may take - slower queries are interrupted (None for no limit)
+    max_rows : int
+        Maximum number of rows in the result of a query (None for no limit)
+    max_bytes : int
+        Maximum size in bytes (in memory) of the result of a query (None for no limit)
+    slow_query_threshold : float
+        Queries taking at least this many seconds are recorded in 'slow_queries' (None to disable the log)
+    explain_slow_queries : bool
+        If set, the SQLite query plan is added to the recorded slow queries
+    profile_rate : float
+        Fraction of queries that are run with cProfile - their profile is recorded in 'slow_queries'
+    slow_queries : deque
+        The most recent slow (and profiled) queries, see 'slow_query_log'
+    auto_index : bool
+        If set, columns often compared in WHERE/JOIN clauses of queries are indexed automatically
+    auto_index_threshold : int
+        Number of queries comparing a column before it is indexed automatically
+    fast_path : bool
+        If set, simple single-table queries are answered directly from the dataframes with pandas
+    snapshot_path : str
+        Directory snapshots are saved to by the periodic snapshots (None if not set)
+    snapshot_interval : float
+        Seconds between periodic snapshots - can be changed while the snapshots are running
+    column_stats : bool
+        If set, the metadata includes the minimum and maximum of each column of the dataframes
+    subscription_heartbeat : float
+        Seconds between heartbeats of subscriptions without changes, see 'subscribe'
+
+    '''
+    def __init__(self, dataframe: pd.DataFrame = None, dbname: str = 'dataframe', query_regex: str = r'^SELECT [^;]*;$',
+                 port: int = 5000, endpoint: str = '', enable_web: bool = True, cache_size: int = 128,
+                 cache_ttl: float = None, backend: str = 'werkzeug', workers: int = None, processes: int = None,
+                 query_timeout: float = None, max_rows: int = None, max_bytes: int = None,
+                 slow_query_threshold: float = None, slow_query_log_size: int = 100, explain_slow_queries: bool = False,
+                 profile_rate: float = 0, slow_query_endpoint: str = 'slow-queries', indexes: dict = None,
+                 auto_index: bool = False, auto_index_threshold: int = 3, fast_path: bool = True,
+                 snapshot_path: str = None, snapshot_interval: float = None, server: SQLRestAPI = None,
+                 column_stats: bool = False, subscription_heartbeat: float = 10, engine_directory: str = None):
+        '''
+        Parameters
+        ----------
+        dataframe : pd.DataFrame, default=None
+            If provided, this dataframe will be served at startup
+        dbname : str, default='dataframe'
+            Name of the database (i.e. SELECT * FROM <dbname>)
+        query_regex : str, default='^SELECT [^;]*;$'
+            Regular expression that SQL queries are validated against
+        port : int, default=5000
+            The port to expose the webservice on
+        endpoint : str, default=''
+            Route/Endpoint of the webservice (i.e. http://host:port/<endpoint>)
+        enable_web : bool. default=True
+            If true the webservice will be started at instantiation
+        cache_size : int, default=128
+            Maximum number of query results to cache - set to 0 to disable the cache
+        cache_ttl : float, default=None
+            Maximum age in seconds of cached query results - if None, results are cached until the dataframes change
+        backend : str, default='werkzeug'
+            Server backend of the webservice (see SQLRestAPI)
+        workers : int, default=None
+            Number of worker threads of the webservice (see SQLRestAPI)
+        processes : int, default=None
+            If set, queries are run in a pool of this many worker processes (each holding a copy of the dataframes), so
+            slow queries do not stall other requests and throughput scales with the number of cores
+        query_timeout : float, default=None
+            Maximum time in seconds a query may take - slower queries are interrupted
+        max_rows : int, default=None
+            Maximum number of rows in the result of a query
+        max_bytes : int, default=None
+            Maximum size in bytes (in memory) of the result of a query
+        slow_query_threshold : float, default=None
+            Queries taking at least this many seconds are recorded in the slow query log - None disables the log
+        slow_query_log_size : int, default=100
+            Number of slow queries kept in the log (the oldest are dropped first)
+        explain_slow_queries : bool, default=False
+            If set, the SQLite query plan ('EXPLAIN QUERY PLAN') is added to the recorded slow queries
+        profile_rate : float, default=0
+            Fraction (0-1) of queries to run with cProfile - profiled queries are recorded in the slow query log with
+            the top functions by cumulative time, whether they are slow or not
+        slow_query_endpoint : str, default='slow-queries'
+            Route of the webservice serving the slow query log (i.e. http://host:port/slow-queries) - None disables it
+        indexes : dict, default=None
+            Indexes to build in the query engine, as a dict of dataframe name: list of indexes, where each index is a
+            column name or a list of column names (i.e. {'lines': ['station', ['station', 'bay']]})
+        auto_index : bool, default=False
+            If set, columns compared in the WHERE/JOIN clauses of at least 'auto_index_threshold' queries are indexed
+        auto_index_threshold : int, default=3
+            Number of queries comparing a column before it is indexed automatically
+        fast_path : bool, default=True
+            If set, simple single-table queries (selecting columns, filtering them with comparisons combined with AND,
+            ordering and limiting) are answered directly from the dataframes with vectorized pandas operations instead
+            of the SQLite engine - other queries always run in the engine
+        snapshot_path : str, default=None
+            Directory to save snapshots of the dataframes to (see 'save_snapshot') - if it holds a snapshot at startup,
+            it is loaded before the webservice starts, so a restarted API serves the data it had right away
+        snapshot_interval : float, default=None
+            If set (together with 'snapshot_path'), a snapshot is saved in the background every this many seconds when
+            any dataframe has changed since the last snapshot
+        server : SQLRestAPI, default=None
+            If given, the API is added to this webservice at 'endpoint' (see 'SQLRestAPI.add_endpoint') instead of
+            having its own - 'port', 'backend', 'workers' and 'enable_web' are then ignored, and the webservice must be
+            started by its owner once all APIs are added. The slow query log is served at '<endpoint>/<slow_query_endpoint>'
+        column_stats : bool, default=False
+            If set, the metadata includes the minimum and maximum of each column (where the values can be compared) -
+            they are computed when a dataframe is set and updated from the added rows by 'append'
+        subscription_heartbeat : float, default=10
+            Seconds between heartbeats of subscriptions (see 'subscribe') while their dataframes do not change - the
+            webservice sends them as comments, so connections of clients that are gone are closed
+        engine_directory : str, default=None
+            Directory to keep the query engine database in - None uses the default temporary directory. A RAM-backed
+            directory (i.e. '/dev/shm') makes changes faster, but it must have room for all dataframes - tables that do
+            not fit are not loaded (and logged as errors)
+        '''
+        # Setup DataFrameAPI and add any included dataframes
+        self.__catalog = _Catalog({}, {}, {}, {})
+        self.__staged = None
+        self.__writer = None
+        self.__version_counter = count(1)
+        self.__described = {}
+        self.column_stats = column_stats
+        self.__published = Condition()
+        self.subscription_heartbeat = subscription_heartbeat
+        self.__etag_salt = os.urandom(8).hex()
+        self.cache = _QueryCache(maxsize=cache_size, ttl=cache_ttl)
+        self.__lock = RLock()
+        self.__engine = _SQLiteEngine(directory=engine_directory)
+        self.__processes = _ProcessEngine(processes) if processes else None
+        self.__engines = (self.__engine, self.__processes) if processes else (self.__engine,)
+        self.query_timeout = query_timeout
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.slow_query_threshold = slow_query_threshold
+        self.explain_slow_queries = explain_slow_queries
+        self.profile_rate = profile_rate
+        self.__profiling = Lock()
+        self.slow_queries = deque(maxlen=slow_query_log_size)
+        self.auto_index = auto_index
+        self.auto_index_threshold = auto_index_threshold
+        self.__indexes = {}
+        self.__column_uses = Counter()
+        self.__uses_lock = Lock()
+        self.__indexing = set()
+        self.fast_path = fast_path
+        self.__fast_columns = {}
+        self.query_regex = query_regex
+        self.__statements = {}
+        for name, columns_list in (indexes or {}).items():
+            for columns in columns_list:
+                self.add_index(name, columns)
+        self[dbname] = dataframe
+
+        # Load the last snapshot (if any) and start the periodic snapshots
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.__snapshot_files = {}
+        self.__snapshot_stop = Event()
+        self.__snapshot_thread = None
+        if snapshot_path is not None and os.path.isfile(os.path.join(snapshot_path, SNAPSHOT_MANIFEST)):
+            self.load_snapshot(snapshot_path)
+        if snapshot_path is not None and snapshot_interval:
+            self.start_snapshots()
+
+        # Setup WEB Host / SQLRestAPI - or add the API to a shared one
+        if server is None:
+            self.web = SQLRestAPI(port=port, endpoint=endpoint, getcall=self.metadata, postcall=self.query_dataframe,
+                                  streamcall=self.query_chunks, start=False, backend=backend, workers=workers,
+                                  etagcall=self.etag, subscribecall=self.subscribe)
+            self.__metric_labels = ()
+        else:
+            self.web = server
+            self.web.add_endpoint(endpoint, getcall=self.metadata, postcall=self.query_dataframe,
+                                  streamcall=self.query_chunks, etagcall=self.etag, subscribecall=self.subscribe)
+            self.__metric_labels = (('endpoint', endpoint),)
+            if slow_query_endpoint is not None and endpoint:
+                slow_query_endpoint = f"{endpoint}/{slow_query_endpoint}"
+        self.web.metrics.add_collector(self.__table_metrics)
+        self.web.add_stop_callback(self.__wake_subscriptions)
+        if slow_query_endpoint is not None:
+            self.web.add_route(slow_query_endpoint, self.slow_query_log)
+        if enable_web and server is None:
+            self.web.start()
+
+    def __len__(self):
+        return len(self.__state.dataframes)
+
+    def __iter__(self):
+        return iter(self.__state.dataframes.keys())
+
+    @property
+    def __state(self) -> _Catalog:
+        '''The catalog staged by a transaction in the thread running it, otherwise the published catalog.'''
+        staged = self.__staged
+        return staged if staged is not None and self.__writer == get_ident() else self.__catalog
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Group changes of the dataframes (setting, removing, 'append', 'upsert' or 'clear'), so queries see all of them
+        at once when the transaction ends - or none of them if an exception is raised.
+
+        Changes are made to a copy of the catalog of dataframes (and in transactions of the query engines), which
+        replaces the catalog used by queries when the outermost transaction ends. Queries never wait for changes - each
+        query uses the catalog that was current when it started. Other threads changing the dataframes wait until the
+        transaction ends, and changes made by the thread running the transaction are seen by it right away.
+
+        Yields
+        ------
+        DataFrameAPI
+            The API itself, i.e. "with my_api.transaction() as api: api['a'] = a; api['b'] = b".
+        '''
+        with self.__lock:
+            if self.__staged is not None:
+                yield self
+                return
+
+            catalog = self.__catalog
+            self.__staged = _Catalog(dict(catalog.dataframes), dict(catalog.pending), dict(catalog.versions),
+                                     dict(catalog.stats))
+            self.__writer = get_ident()
+            try:
+                with ExitStack() as stack:
+                    for engine in self.__engines:
+                        stack.enter_context(engine.transaction())
+                    yield self
+
+                # The engines are committed first, so a query never gets older data than the catalog it uses
+                self.__catalog = self.__staged
+                with self.__published:
+                    self.__published.notify_all()
+            finally:
+                self.__staged = self.__writer = None
+
+    def __getitem__(self, name) -> pd.DataFrame:
+        try:
+            return self.__consolidate(self.__state, name)
+        except Exception:
+            log.error(f"Could not access DataFrame with name '{name}' in DataFrameAPI.")
+            raise KeyError(f"API Contains no DataFrame with name '{name}'.")
+
+    def __setitem__(self, name, dataframe):
+        if isinstance(dataframe, pd.DataFrame):
+            with self.transaction():
+                self.__state.pending.pop(name, None)
+                self.__state.dataframes[name] = dataframe
+                for engine in self.__engines:
+                    engine.load(name, dataframe)
+                    self.__create_indexes(name, engine)
+                self.__changed(name, self.__describe(dataframe))
+        elif dataframe is None:
+            with self.transaction():
+                if name in self.__state.dataframes:
+                    del self.__state.dataframes[name]
+                    self.__state.pending.pop(name, None)
+                    self.__state.versions.pop(name, None)
+                    self.__state.stats.pop(name, None)
+                    for engine in self.__engines:
+                        engine.drop(name)
+        else:
+            log.error(f"Tried to set value of '{name}' dataframe to an object of '{type(dataframe)} type in DataFrameAPI.'")
+            raise ValueError("'dataframe' variable must be either a valid dataframe or 'None'")
+
+    def __delitem__(self, name):
+        with self.transaction():
+            if name in self.__state.dataframes:
+                del self.__state.dataframes[name]
+                self.__state.pending.pop(name, None)
+                self.__state.versions.pop(name, None)
+                self.__state.stats.pop(name, None)
+                for engine in self.__engines:
+                    engine.drop(name)
+            else:
+                log.error(f"Could not find (and thereby delete) DataFrame with name '{name}' in DataFrameAPI.")
+                raise KeyError(f"API Contains no DataFrame with name '{name}'.")
+
+    def __validate_rows(self, name: str, rows: pd.DataFrame) -> bool:
+        '''Verify rows can be added to a dataframe - returns False if the dataframe must be set instead.'''
+        if not isinstance(rows, pd.DataFrame):
+            log.error(f"Tried to add rows to '{name}' dataframe from an object of '{type(rows)}' type in DataFrameAPI.")
+            raise ValueError("'rows' variable must be a valid dataframe")
+        if name not in self.__state.dataframes or (self.__state.dataframes[name].empty and name not in self.__state.pending):
+            return False
+
+        dataframe = self.__state.dataframes[name]
+        if set(rows.columns) != set(dataframe.columns) or list(rows.index.names) != list(dataframe.index.names):
+            log.error(f"Tried to add rows with columns '{list(rows.columns)}' to '{name}' dataframe in DataFrameAPI.")
+            raise ValueError(f"The columns of 'rows' must match the columns of the '{name}' dataframe: " +
+                             f"'{list(dataframe.columns)}'.")
+        return True
+
+    def __consolidate(self, catalog: _Catalog, name: str) -> pd.DataFrame:
+        '''Return a dataframe of a catalog with the rows added with 'append' or 'upsert' applied to it.'''
+        pending = catalog.pending.get(name)
+        if not pending:
+            return catalog.dataframes[name]
+
+        # Rows are added in the same order as the query engine does, so both return the same data
+        frames = [catalog.dataframes[name]]
+        ignore_index = all(level is None for level in frames[0].index.names)
+        for rows, key in pending:
+            if key is not None:
+                dataframe = pd.concat(frames, ignore_index=ignore_index) if len(frames) > 1 else frames[0]
+                frames = [dataframe[~self.__key_index(dataframe, key).isin(self.__key_index(rows, key))]]
+            frames.append(rows)
+        dataframe = pd.concat(frames, ignore_index=ignore_index)
+
+        # Keep the result (with the same version) if the dataframe was not changed meanwhile, so the rows are only
+        # applied once - unless a writer holds the lock, as that would make the reader wait
+        if self.__lock.acquire(blocking=False):
+            try:
+                state = self.__state
+                if state.pending.get(name) is pending and state.dataframes.get(name) is catalog.dataframes[name]:
+                    if state is self.__staged:
+                        state.dataframes[name] = dataframe
+                        del state.pending[name]
+                    else:
+                        self.__catalog = _Catalog({**state.dataframes, name: dataframe},
+                                                  {other: rows for other, rows in state.pending.items() if other != name},
+                                                  state.versions, state.stats)
+            finally:
+                self.__lock.release()
+        return dataframe
+
+    @staticmethod
+    def __key_index(dataframe: pd.DataFrame, key: list) -> pd.Index:
+        '''Return the key columns of a dataframe as an index, so rows can be matched on the key.'''
+        if len(key) == 1:
+            return pd.Index(dataframe[key[0]])
+        return pd.MultiIndex.from_frame(dataframe[key])
+
+    def append(self, name: str, rows: pd.DataFrame):
+        '''
+        Add rows to a served dataframe without reloading the full dataframe.
+
+        Parameters
+        ----------
+        name : str
+            Name of the dataframe to add rows to - if it does not exist (or is empty) the rows will be set as the dataframe.
+        rows : pd.DataFrame
+            Rows to add, must have the same columns as the served dataframe.
+        '''
+        with self.transaction():
+            if not self.__validate_rows(name, rows):
+                self[name] = rows
+            elif not rows.empty:
+                rows = rows[list(self.__state.dataframes[name].columns)]
+                for engine in self.__engines:
+                    engine.append(name, rows)
+                self.__state.pending[name] = self.__state.pending.get(name, ()) + ((rows, None),)
+                self.__changed(name, self.__append_stats(name, rows))
+                self.__compact(name)
+
+    def upsert(self, name: str, rows: pd.DataFrame, key: list):
+        '''
+        Update rows of a served dataframe that match the key of the given rows and add the rest, without reloading
+        the full dataframe. Updated rows are moved to the end of the dataframe.
+
+        Parameters
+        ----------
+        name : str
+            Name of the dataframe to update - if it does not exist (or is empty) the rows will be set as the dataframe.
+        rows : pd.DataFrame
+            Rows to update or add, must have the same columns as the served dataframe.
+        key : list
+            List of columns which identifies a row (i.e. the primary key of the dataframe).
+        '''
+        key = [key] if isinstance(key, str) else list(key)
+        with self.transaction():
+            if not self.__validate_rows(name, rows):
+                self[name] = rows
+            elif not rows.empty:
+                if not set(key).issubset(rows.columns):
+                    log.error(f"Tried to upsert '{name}' dataframe on key '{key}' which is not part of the columns.")
+                    raise ValueError(f"The columns {list(set(key) - set(rows.columns))} of 'key' are missing in 'rows'.")
+                rows = rows[list(self.__state.dataframes[name].columns)]
+                for engine in self.__engines:
+                    engine.upsert(name, rows, key)
+                self.__state.pending[name] = self.__state.pending.get(name, ()) + ((rows, key),)
+                self.__changed(name)
+                self.__compact(name)
+
+    def __changed(self, name: str, stats: dict = None, updated: str = None) -> None:
+        '''Give a changed dataframe a new version and its statistics (None to compute them when the metadata is read).'''
+        self.__state.versions[name] = next(self.__version_counter)
+        self.__state.stats[name] = (updated or datetime.now(timezone.utc).isoformat(), stats)
+
+    def __describe(self, dataframe: pd.DataFrame) -> dict:
+        '''Compute the statistics of a dataframe for the metadata.'''
+        stats = {'columns': list(dataframe.columns),
+                 'rowcount': dataframe.shape[0],
+                 'dtypes': {str(column): str(dtype) for column, dtype in dataframe.dtypes.items()},
+                 'memory': int(dataframe.memory_usage(index=False).sum())}
+        if self.column_stats:
+            stats['min'], stats['max'] = {}, {}
+            for position, column in enumerate(dataframe.columns):
+                values = dataframe.iloc[:, position]
+                try:
+                    stats['min'][str(column)], stats['max'][str(column)] = (_json_scalar(values.min()),
+                                                                            _json_scalar(values.max()))
+                except (TypeError, ValueError):
+                    continue
+        return stats
+
+    def __append_stats(self, name: str, rows: pd.DataFrame) -> dict:
+        '''
+        Update the statistics of a dataframe with the rows appended to it, without going through the full dataframe -
+        None if they must be computed again (i.e. when the rows change the dtypes of the dataframe).
+        '''
+        stats = self.__state.stats[name][1]
+        if stats is None or list(rows.dtypes) != list(self.__state.dataframes[name].dtypes):
+            return None
+        added = self.__describe(rows)
+        if ('min' in stats) != ('min' in added):
+            return None
+
+        updated = {**stats, 'rowcount': stats['rowcount'] + added['rowcount'], 'memory': stats['memory'] + added['memory']}
+        if 'min' in stats:
+            updated['min'], updated['max'] = {}, {}
+            for column in (column for column in stats['min'] if column in added['min']):
+                updated['min'][column] = _combine_extreme(stats['min'][column], added['min'][column], min)
+                updated['max'][column] = _combine_extreme(stats['max'][column], added['max'][column], max)
+        return updated
+
+    def __stats(self, catalog: _Catalog, name: str) -> tuple:
+        '''
+        Return the time a dataframe of a catalog was last changed and its statistics - statistics not known since the
+        change (i.e. after 'upsert') are computed once per version of the dataframe.
+        '''
+        updated, stats = catalog.stats[name]
+        if stats is None or self.column_stats != ('min' in stats):
+            version = catalog.versions[name]
+            stats = self.__described.get(version)
+            if stats is None or self.column_stats != ('min' in stats):
+                stats = self.__describe(self.__consolidate(catalog, name))
+                current = set(self.__catalog.versions.values())
+                self.__described = {**{key: value for key, value in self.__described.items() if key in current},
+                                    version: stats}
+        return updated, stats
+
+    def __compact(self, name: str):
+        '''Write the full dataframe for the worker processes, when they have too many updates to apply to it.'''
+        if self.__processes is not None and self.__processes.updates(name) >= self.__processes.max_updates:
+            self.__processes.load(name, self[name])
+            self.__create_indexes(name, self.__processes)
+
+    def __create_indexes(self, name: str, engine) -> None:
+        '''Build the indexes of a dataframe in an engine - indexes on columns the dataframe does not have are skipped.'''
+        columns = set(self.__state.dataframes[name].columns) if name in self.__state.dataframes else set()
+        for index in self.__indexes.get(name, ()):
+            if set(index) <= columns:
+                engine.create_index(name, index)
+
+    def add_index(self, name: str, columns) -> None:
+        '''
+        Index columns of a dataframe in the query engine, so queries filtering or joining on them do not scan the full
+        table. The index is kept when the dataframe is replaced and rebuilt with it.
+
+        Parameters
+        ----------
+        name : str
+            Name of the dataframe - the dataframe does not have to exist yet.
+        columns : str or list
+            Column or list of columns to index.
+        '''
+        columns = (columns,) if isinstance(columns, str) else tuple(columns)
+        with self.__lock:
+            if columns in self.__indexes.get(name, ()):
+                return
+            self.__indexes[name] = self.__indexes.get(name, ()) + (columns,)
+            if name in self.__state.dataframes:
+                if not set(columns) <= set(self.__state.dataframes[name].columns):
+                    log.warning(f"Index on {list(columns)} of '{name}' dataframe is not built, as columns are missing.")
+                for engine in self.__engines:
+                    self.__create_indexes(name, engine)
+        log.info(f"Added index on {list(columns)} of '{name}' dataframe in DataFrameAPI.")
+
+    def indexes(self, name: str) -> list:
+        '''Return the indexed columns (declared or automatic) of a dataframe, as a list of lists of column names.'''
+        return [list(columns) for columns in self.__indexes.get(name, ())]
+
+    def prepare(self, name: str, query: str) -> None:
+        '''
+        Register a named statement - a query with placeholders ('?' or ':name') that clients run by its name with
+        different parameters. The query is validated against the query regex once, when it is registered.
+
+        Parameters
+        ----------
+        name : str
+            Name of the statement - an existing statement with the name is replaced.
+        query : str
+            The query in SQLite style - if None, the statement is removed.
+
+        Raises
+        ------
+        PermissionError
+            If the query does not match the query regex.
+        '''
+        if query is None:
+            self.__statements.pop(name, None)
+            return
         if not re.search(self.query_regex, query):
+            log.error(f"Tried to prepare the statement '{name}' with a query that did not fit the query regex.")
+            raise PermissionError(f"Query was denied due to not matching regex '{self.query_regex}'")
+        self.__statements[name] = self.__normalize(query)
+        log.info(f"Prepared statement '{name}' in DataFrameAPI.")
+
+    @property
+    def statements(self) -> dict:
+        return dict(self.__statements)
+
+    def __resolve(self, query: str, statement: str) -> str:
+        '''The query to run - the query of a prepared statement, or the given query if it matches the query regex.'''
+        if statement is not None:
+            if query is not None:
+                raise ValueError('Give either a query or the name of a prepared statement, not both.')
+            try:
+                return self.__statements[statement]
+            except KeyError:
+                raise LookupError(f"No statement named '{statement}' has been prepared.") from None
+
+        # Make sure sql-query fits regex - used for security reasons.
+        if query is None or not re.search(self.query_regex, query):
             log.error('Tried to query data that did not fit the query regex.')
             raise PermissionError(f"Query was denied due to not matching regex '{self.query_regex}'")
+        return query
 
-        # Only include dataframes that are not empty
-        dbdict = {dfname: self[dfname] for dfname in self if not self[dfname].empty}
+    def __fast_query(self, query: str, catalog: _Catalog) -> pd.DataFrame:
+        '''Answer a simple query directly from a dataframe with pandas - returns None if the engine must be used.'''
+        plan = _parse_simple_select(query)
+        if plan is None:
+            return None
+        name = next((name for name in catalog.dataframes if str(name).lower() == plan[0]), None)
+        if name is None or catalog.dataframes[name].empty:
+            return None
+        dataframe = self.__consolidate(catalog, name)
+        version = catalog.versions.get(name)
+        cached = self.__fast_columns.get(name)
+        if cached is None or cached[0] != version:
+            cached = (version, self.__column_kinds(dataframe))
+            self.__fast_columns[name] = cached
+        return _run_simple_select(plan, dataframe, cached[1])
 
+    @staticmethod
+    def __column_kinds(dataframe: pd.DataFrame) -> dict:
+        '''
+        Find the columns a query can use in the fast path - those that give the same values and dtypes in pandas as
+        when loaded into SQLite (int64, float64 and strings without nulls). Returns a dict of lowercased name: (name,
+        kind, has nulls). No columns can be used if the index is stored as columns in SQLite (a named index).
+        '''
+        if any(level is not None for level in dataframe.index.names):
+            return {}
+        lowered = [str(column).lower() for column in dataframe.columns]
+        kinds = {}
+        for column, lower in zip(dataframe.columns, lowered):
+            if not isinstance(column, str) or lowered.count(lower) > 1:
+                continue
+            series = dataframe[column]
+            if series.dtype == 'int64':
+                kinds[lower] = (column, 'int', False)
+            elif series.dtype == 'float64':
+                kinds[lower] = (column, 'float', bool(series.isna().any()))
+            elif (pd.api.types.is_object_dtype(series.dtype) or pd.api.types.is_string_dtype(series.dtype)) and \
+                    pd.api.types.infer_dtype(series, skipna=False) == 'string':
+                kinds[lower] = (column, 'str', False)
+        return kinds
+
+    def __learn_indexes(self, query: str) -> None:
+        '''Count the columns compared in WHERE/JOIN clauses of a query and index those used often enough.'''
+        lowered = query.lower()
+        match = re.search(r'\b(where|on)\b', lowered)
+        if match is None:
+            return
+        compared = {name.strip('"`[]').lower() for name in re.findall(
+            r'([A-Za-z_]\w*|"[^"]+"|`[^`]+`|\[[^\]]+\])\s*(?:[=<>!]=?|<>|\bin\b|\bbetween\b|\blike\b|\bis\b)',
+            query[match.start():], flags=re.IGNORECASE)}
+        for name, dataframe in self.__catalog.dataframes.items():
+            if re.search(rf'(?<!\w){re.escape(str(name).lower())}(?!\w)', lowered) is None:
+                continue
+            for column in dataframe.columns:
+                if str(column).lower() not in compared:
+                    continue
+                # The counts have their own lock, so queries never wait for writers holding the lock of the dataframes
+                with self.__uses_lock:
+                    self.__column_uses[(name, column)] += 1
+                    start = self.__column_uses[(name, column)] >= self.auto_index_threshold and \
+                        (column,) not in self.__indexes.get(name, ()) and (name, column) not in self.__indexing
+                    if start:
+                        self.__indexing.add((name, column))
+                if start:
+                    # The index is built in the background, so the query crossing the threshold does not wait for it
+                    Thread(target=self.__auto_index, args=(name, column), daemon=True,
+                           name=f'singupy-index-{name}-{column}').start()
+
+    def __auto_index(self, name, column) -> None:
+        '''Index a column that is compared in many queries (runs in a background thread).'''
         try:
-            return PandaSQL(persist=False)(query, dbdict).to_dict()
+            log.info(f"Automatically indexing column '{column}' of '{name}' dataframe.")
+            self.add_index(name, column)
         except Exception as e:
-            if "no such table" in e.__str__():
-                return {'error': "Requested dataframe does not exist or is empty."}
+            log.warning(f"Could not automatically index column '{column}' of '{name}' dataframe: {e!r}")
+        finally:
+            with self.__uses_lock:
+                self.__indexing.discard((name, column))
+
+    def clear(self):
+        '''Remove all dataframes from API.'''
+        with self.transaction():
+            self.__state.dataframes.clear()
+            self.__state.pending.clear()
+            self.__state.versions.clear()
+            self.__state.stats.clear()
+            with self.__uses_lock:
+                self.__column_uses.clear()
+            for engine in self.__engines:
+                engine.clear()
+            self.cache.clear()
+
+    def save_snapshot(self, path: str) -> dict:
+        '''
+        Save all dataframes (and their declared indexes) to a directory in the Arrow IPC (Feather v2) format, so they
+        can be loaded again with 'load_snapshot' - i.e. when the API is restarted. The files are uncompressed so they
+        can be memory-mapped when loaded. A copy of the query engine database is saved with them, so an empty API
+        loading the snapshot does not have to rebuild it. The manifest listing the files is replaced last, so a
+        snapshot being saved never affects loading the previous one. Dataframes that have not changed since the last
+        snapshot saved to the same directory are not written again.
+
+        Parameters
+        ----------
+        path : str
+            Directory to save the snapshot to - it is created if it does not exist.
+
+        Returns
+        -------
+        dict
+            The manifest of the snapshot, with the time it was created and the file, rowcount, version, indexes and time
+            of the last change of each dataframe.
+
+        Raises
+        ------
+        ImportError
+            If 'pyarrow' is not installed.
+        '''
+        if find_spec('pyarrow') is None:
+            log.error("Tried to save a snapshot of the DataFrameAPI without 'pyarrow' installed.")
+            raise ImportError("Snapshots require the 'pyarrow' package to be installed.")
+        import pyarrow as pa
+
+        os.makedirs(path, exist_ok=True)
+        created = datetime.now(timezone.utc)
+        stamp = created.strftime('%Y%m%dT%H%M%S%f')
+
+        # The query engine is copied as well (while no dataframe can change), so it does not have to be rebuilt
+        engine_file = f'engine-{stamp}.sqlite'
+        with self.__lock:
+            dataframes = {name: (self[name], self.__state.versions[name], self.indexes(name),
+                                 self.__state.stats[name][0]) for name in self}
+            tables = self.__engine.backup(os.path.join(path, engine_file + '.tmp'))
+        os.replace(os.path.join(path, engine_file + '.tmp'), os.path.join(path, engine_file))
+        saved = {} if self.__snapshot_files.get('path') != os.path.abspath(path) else self.__snapshot_files['files']
+        manifest = {'created': created.isoformat(), 'engine': {'file': engine_file, 'tables': tables}, 'dataframes': {}}
+        for name, (dataframe, version, indexes, updated) in dataframes.items():
+            file = saved[name][1] if name in saved and saved[name][0] == version else None
+            if file is None or not os.path.isfile(os.path.join(path, file)):
+                # Names are sanitised for the file system, so a hash of the name keeps names like 'a b' and 'a_b'
+                # from sharing a file - the manifest keeps the real name
+                digest = hashlib.blake2b(str(name).encode(), digest_size=6).hexdigest()
+                file = f"{re.sub(r'[^A-Za-z0-9_-]', '_', str(name))}-{digest}-{stamp}.arrow"
+                table = pa.Table.from_pandas(dataframe)
+                with pa.OSFile(os.path.join(path, file + '.tmp'), 'wb') as sink:
+                    with pa.ipc.new_file(sink, table.schema) as writer:
+                        writer.write_table(table)
+                os.replace(os.path.join(path, file + '.tmp'), os.path.join(path, file))
+            manifest['dataframes'][name] = {'file': file, 'rowcount': len(dataframe), 'version': version,
+                                            'indexes': indexes, 'updated': updated}
+
+        with open(os.path.join(path, SNAPSHOT_MANIFEST + '.tmp'), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+        os.replace(os.path.join(path, SNAPSHOT_MANIFEST + '.tmp'), os.path.join(path, SNAPSHOT_MANIFEST))
+        self.__snapshot_files = {'path': os.path.abspath(path),
+                                 'files': {name: (entry['version'], entry['file'])
+                                           for name, entry in manifest['dataframes'].items()}}
+
+        # Files of earlier snapshots are removed (dataframes loaded from them stay valid while memory-mapped)
+        files = {entry['file'] for entry in manifest['dataframes'].values()} | {engine_file}
+        for file in os.listdir(path):
+            if file.endswith(('.arrow', '.sqlite')) and file not in files:
+                try:
+                    os.remove(os.path.join(path, file))
+                except OSError as e:
+                    log.warning(f"Could not remove '{file}' of an earlier snapshot: {e!r}")
+        log.info(f"Saved snapshot of {len(dataframes)} dataframe(s) to '{path}'.")
+        return manifest
+
+    def load_snapshot(self, path: str, memory_map: bool = True) -> list:
+        '''
+        Load the dataframes (and their declared indexes) of a snapshot saved with 'save_snapshot'. Dataframes with
+        the same names are replaced, other dataframes are kept. If the API is empty, the query engine is restored
+        from its copy in the snapshot instead of loading the dataframes into it one by one.
+
+        Parameters
+        ----------
+        path : str
+            Directory the snapshot was saved to.
+        memory_map : bool, default True
+            If set, the files are memory-mapped instead of read, so numeric columns are not copied into memory.
+
+        Returns
+        -------
+        list
+            Names of the loaded dataframes.
+
+        Raises
+        ------
+        FileNotFoundError
+            If the directory holds no snapshot.
+        ImportError
+            If 'pyarrow' is not installed.
+        '''
+        if find_spec('pyarrow') is None:
+            log.error("Tried to load a snapshot to the DataFrameAPI without 'pyarrow' installed.")
+            raise ImportError("Snapshots require the 'pyarrow' package to be installed.")
+        import pyarrow as pa
+
+        try:
+            with open(os.path.join(path, SNAPSHOT_MANIFEST)) as manifest_file:
+                manifest = json.load(manifest_file)
+        except FileNotFoundError:
+            log.error(f"Could not find a snapshot in '{path}'.")
+            raise FileNotFoundError(f"No snapshot found in '{path}' (missing '{SNAPSHOT_MANIFEST}').")
+
+        loaded = {}
+        with self.__lock:
+            # The engine can only be restored outside of a transaction (and only replaces tables if the API is empty)
+            restore = len(self) == 0 and self.__staged is None and 'engine' in manifest
+            if restore:
+                self.__engine.restore(os.path.join(path, manifest['engine']['file']))
+            with self.transaction():
+                for name, entry in manifest['dataframes'].items():
+                    file = os.path.join(path, entry['file'])
+                    with (pa.memory_map(file) if memory_map else pa.OSFile(file)) as source:
+                        dataframe = pa.ipc.open_file(source).read_all().to_pandas(split_blocks=True)
+                    for columns in entry.get('indexes', []):
+                        self.add_index(name, columns)
+                    # The dataframes keep the time they were last changed before the snapshot
+                    updated = entry.get('updated', manifest['created'])
+                    if restore:
+                        # The restored engine already holds the table and its indexes
+                        self.__state.dataframes[name] = dataframe
+                        self.__changed(name, self.__describe(dataframe), updated)
+                        for engine in self.__engines[1:]:
+                            engine.load(name, dataframe)
+                            self.__create_indexes(name, engine)
+                    else:
+                        self[name] = dataframe
+                        self.__state.stats[name] = (updated, self.__state.stats[name][1])
+                    loaded[name] = (self.__state.versions[name], entry['file'])
+
+        # The loaded dataframes are not written again by the next snapshot to the same directory, unless changed
+        self.__snapshot_files = {'path': os.path.abspath(path), 'files': loaded}
+        log.info(f"Loaded snapshot of {len(manifest['dataframes'])} dataframe(s) created at {manifest['created']} " +
+                 f"from '{path}'.")
+        return list(manifest['dataframes'])
+
+    def start_snapshots(self) -> None:
+        '''Start saving snapshots to 'snapshot_path' every 'snapshot_interval' seconds in a background thread.'''
+        if self.snapshot_path is None or not self.snapshot_interval:
+            log.error("Tried to start periodic snapshots without 'snapshot_path' and 'snapshot_interval' set.")
+            raise ValueError("'snapshot_path' and 'snapshot_interval' must be set to start periodic snapshots.")
+        if self.__snapshot_thread is not None and self.__snapshot_thread.is_alive():
+            log.error('Start of periodic snapshots requested, but they are already running.')
+            return
+        self.__snapshot_stop.clear()
+        self.__snapshot_thread = Thread(target=self.__snapshot_loop, daemon=True, name='DataFrameAPI-snapshots')
+        self.__snapshot_thread.start()
+
+    def stop_snapshots(self, save: bool = True, timeout: float = 15) -> None:
+        '''
+        Stop the periodic snapshots.
+
+        Parameters
+        ----------
+        save : bool, default True
+            If set, a final snapshot is saved (if any dataframe changed since the last one).
+        timeout : float, default 15
+            How long to wait for a snapshot being saved to finish.
+        '''
+        if self.__snapshot_thread is None or not self.__snapshot_thread.is_alive():
+            log.error('Stop of periodic snapshots requested, but they are not running.')
+            return
+        self.__snapshot_stop.set()
+        self.__snapshot_thread.join(timeout=timeout)
+        if self.__snapshot_thread.is_alive():
+            log.error(f'Periodic snapshots did not stop within timeout of {timeout} seconds.')
+            raise TimeoutError(f'Periodic snapshots did not stop within timeout of {timeout} seconds.')
+        if save:
+            self.__save_changed_snapshot()
+
+    def __save_changed_snapshot(self) -> None:
+        '''Save a snapshot to 'snapshot_path' if any dataframe was changed (or removed) since the last snapshot.'''
+        saved = self.__snapshot_files.get('files', {}) if self.__snapshot_files.get('path') == \
+            os.path.abspath(self.snapshot_path) else None
+        if saved is None or {name: version for name, (version, _) in saved.items()} != self.__catalog.versions:
+            self.save_snapshot(self.snapshot_path)
+
+    def __snapshot_loop(self) -> None:
+        '''Save snapshots until stopped - errors are logged, so a failing snapshot is retried at the next interval.'''
+        while not self.__snapshot_stop.wait(self.snapshot_interval):
+            try:
+                self.__save_changed_snapshot()
+            except Exception as e:
+                log.error(f"Periodic snapshot to '{self.snapshot_path}' failed: {e!r}")
+
+    def metadata(self) -> dict:
+        '''
+        Provide metadata about the API setup - used to query what is available.
+
+        The statistics of the dataframes are kept with each version of them (and updated from the added rows by
+        'append'), so the metadata is provided without going through the dataframes.
+
+        Returns
+        -------
+        dict
+            Dict with the query-regex, supported response formats, query cache statistics, prepared statements and
+            metadata about the dataframes hosted by the API: their columns, rowcount, indexes, dtypes, memory usage
+            in bytes (shallow, without the index), time of the last change and - if 'column_stats' is set - the
+            minimum and maximum of each column.
+        '''
+        catalog = self.__state
+        dataframes = {}
+        for dfname in catalog.dataframes:
+            updated, stats = self.__stats(catalog, dfname)
+            dataframes[dfname] = {'columns': stats['columns'], 'rowcount': stats['rowcount'],
+                                  'indexes': self.indexes(dfname), 'dtypes': stats['dtypes'], 'memory': stats['memory'],
+                                  'updated': updated}
+            if 'min' in stats:
+                dataframes[dfname].update(min=stats['min'], max=stats['max'])
+        return {
+            'query_regex': self.query_regex,
+            'formats': supported_formats(),
+            'cache': self.cache.stats(),
+            'statements': self.statements,
+            'dataframes': dataframes
+        }
+
+    def slow_query_log(self) -> dict:
+        '''
+        Provide the slow query log - used by the webservice on the slow query route.
+
+        Returns
+        -------
+        dict
+            Dict with the threshold and the recorded queries (oldest first). Each query has the time it was received,
+            the normalized query, the rowcount of the dataframes named in it, the rowcount of the result (None if it
+            failed), the error (if any), the elapsed seconds in total and per stage ('cache' lookup, 'query' and
+            'check' of the limits), the source of the result ('cache', 'pandas' for the fast path or 'sqlite') and -
+            if enabled - the query 'plan' (only for 'sqlite') and 'profile'.
+        '''
+        return {'threshold': self.slow_query_threshold, 'queries': list(self.slow_queries)}
+
+    def __record_query(self, query: str, received: datetime, elapsed: float, stages: dict, source: str,
+                       result: pd.DataFrame, error: Exception, profiler: cProfile.Profile, params=None) -> None:
+        '''Add a slow (or profiled) query to the slow query log.'''
+        normalized = self.__normalize(query)
+        lowered = normalized.lower()
+        entry = {'time': received.isoformat(),
+                 'query': normalized,
+                 'params': params,
+                 'tables': {name: len(self[name]) for name in list(self)
+                            if re.search(rf'(?<!\w){re.escape(str(name).lower())}(?!\w)', lowered)},
+                 'rows': None if result is None else len(result),
+                 'error': None if error is None else f'{type(error).__name__}: {error}',
+                 'elapsed': elapsed,
+                 'stages': stages,
+                 'source': source}
+        if self.explain_slow_queries and source == 'sqlite':
+            try:
+                entry['plan'] = self.__engine.explain(query, params)
+            except Exception as e:
+                entry['plan'] = [f'Query plan failed with message {e}']
+        if profiler is not None:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(25)
+            entry['profile'] = stream.getvalue()
+        if self.slow_query_threshold is not None and elapsed >= self.slow_query_threshold:
+            log.warning(f"Slow query took {elapsed:.3f} seconds: {normalized}")
+        self.slow_queries.append(entry)
+
+    def __table_metrics(self) -> list:
+        '''Sizes of the dataframes for the metrics of the webservice'''
+        catalog = self.__catalog
+        sizes = {name: (stats['rowcount'], stats['memory'])
+                 for name, (_, stats) in ((name, self.__stats(catalog, name)) for name in catalog.dataframes)}
+        labels = {name: (('dataframe', name),) + self.__metric_labels for name in sizes}
+        return [('singupy_dataframe_rows', 'gauge', 'Number of rows of the dataframes',
+                 {labels[name]: rows for name, (rows, _) in sizes.items()}),
+                ('singupy_dataframe_bytes', 'gauge', 'Memory used by the dataframes (shallow, without the index)',
+                 {labels[name]: int(size) for name, (_, size) in sizes.items()})]
+
+    @staticmethod
+    def __normalize(query: str) -> str:
+        '''Collapse whitespace outside of quoted strings/identifiers, so formatting does not affect the query cache.'''
+        return re.sub(r'''('(?:[^']|'')*'|"(?:[^"]|"")*")|\s+''', lambda match: match.group(1) or ' ', query).strip()
+
+    def __cache_key(self, query: str, catalog: _Catalog, params=None) -> tuple:
+        '''
+        Key of a query (with its params) in the cache - the version of every dataframe whose name appears in the query
+        is included.
+        '''
+        lowered = query.lower()
+        versions = sorted((name, version) for name, version in catalog.versions.items() if str(name).lower() in lowered)
+        bound = None if params is None else json.dumps(params, sort_keys=True, default=str)
+        return self.__normalize(query), tuple(versions), bound
+
+    def etag(self, query: str = None, params=None, statement: str = None) -> str:
+        '''
+        Provide a tag of the response to a query - it changes whenever any dataframe named in the query is changed (and
+        when the API is restarted), so clients can reuse a response they already have while the tag is the same.
+
+        Parameters
+        ----------
+        query : str, default None
+            The query in SQLite style - if None (and no statement is given), the tag of the metadata is returned (it
+            changes whenever any dataframe, index or statement is changed, but not with the query cache statistics).
+        params : list or dict, default None
+            Parameters of the query, see 'query_dataframe'.
+        statement : str, default None
+            Name of a prepared statement to find the tag of instead of a query.
+
+        Returns
+        -------
+        str
+            The tag, or None if the query is denied by 'query_regex' (or the statement does not exist).
+        '''
+        catalog = self.__state
+        if query is None and statement is None:
+            key = (sorted(catalog.versions.items(), key=repr), sorted(self.__indexes.items(), key=repr), self.query_regex,
+                   sorted(self.__statements.items()), self.column_stats)
+        else:
+            try:
+                key = self.__cache_key(self.__resolve(query, statement), catalog, params)
+            except (PermissionError, LookupError, ValueError):
+                return None
+        return hashlib.blake2b(f'{self.__etag_salt}{key!r}'.encode(), digest_size=12).hexdigest()
+
+    def query(self, query: str = None, params=None, statement: str = None) -> dict:
+        '''
+        Return data corresponding to the given query
+
+        Parameters
+        ----------
+        query : str
+            The query to respond to in SQLite style.
+        params : list or dict, default None
+            Parameters of the query, see 'query_dataframe'.
+        statement : str, default None
+            Name of a prepared statement to run instead of a query.
+
+        Returns
+        -------
+        dict
+            Dict with the data returned from the dataframe.
+        '''
+        try:
+            return self.query_dataframe(query, params=params, statement=statement).to_dict()
+        except PermissionError:
+            raise
+        except LookupError as e:
+            return {'error': str(e)}
+        except Exception as e:
+            return {'error': e}
+
+    def query_dataframe(self, query: str = None, params=None, statement: str = None) -> pd.DataFrame:
+        '''
+        Return data corresponding to the given query as a DataFrame - used by the webservice, so the client can choose
+        the format of the response.
+
+        Parameters
+        ----------
+        query : str
+            The query to respond to in SQLite style.
+        params : list or dict, default None
+            Values bound to the placeholders of the query - a list for '?' placeholders or a dict for ':name'
+            placeholders. The query text is then the same for all values, so SQLite reuses the compiled statement and
+            the values never have to be escaped into the query.
+        statement : str, default None
+            Name of a statement registered with 'prepare' to run (with 'params') instead of a query - its query is not
+            validated against the query regex again.
+
+        Returns
+        -------
+        pd.DataFrame
+            DataFrame with the data returned from the dataframe. It may be shared with the query cache, so it must not
+            be modified.
+
+        Raises
+        ------
+        PermissionError
+            If the query does not match the query regex.
+        LookupError
+            If the query refers to a dataframe that does not exist or is empty (or the statement does not exist).
+        '''
+        log.debug(f"Received SQL Query: {query if statement is None else f'statement {statement}'}")
+        query = self.__resolve(query, statement)
+
+        # Time the stages of the query for the slow query log (and profile a sample of the queries)
+        received = datetime.now(timezone.utc)
+        start = last = time.perf_counter()
+        stages = {}
+        result = error = None
+        source = 'cache'
+        profiler = cProfile.Profile() if self.profile_rate and random.random() < self.profile_rate else None
+
+        # The catalog is taken once, so the query uses one version of the dataframes - the engines are never older
+        catalog = self.__state
+
+        # Empty dataframes are never loaded into the engine, so they will result in a 'no such table' error
+        try:
+            key = self.__cache_key(query, catalog, params)
+            cached = self.cache.get(key)
+            stages['cache'], last = time.perf_counter() - last, time.perf_counter()
+            if cached is None:
+                nbytes = None
+                source = 'sqlite'
+                if profiler is not None and not self.__start_profiler(profiler):
+                    profiler = None
+                try:
+                    result, source = self.__run_query(query, catalog, params)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                        self.__profiling.release()
+                    stages['query'], last = time.perf_counter() - last, time.perf_counter()
             else:
-                return {'error': e}
+                result, nbytes = cached
+
+            # The limits are checked for cached results as well, as they may have been lowered since they were cached
+            try:
+                nbytes = self.__check_limits(result, nbytes)
+            except QueryLimitError:
+                result = None
+                raise
+            stages['check'] = time.perf_counter() - last
+            if cached is None:
+                # The size is cached with the result, so it is only computed once
+                self.cache.put(key, (result, nbytes))
+            return result
+        except Exception as e:
+            error = e
+            if "no such table" in e.__str__():
+                raise LookupError("Requested dataframe does not exist or is empty.") from None
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if profiler is not None or (self.slow_query_threshold is not None and elapsed >= self.slow_query_threshold):
+                self.__record_query(query, received, elapsed, stages, source, result, error, profiler, params)
+
+    def __run_query(self, query: str, catalog: _Catalog, params=None) -> tuple:
+        '''
+        Run a query that is not cached - with pandas if it is simple enough (see 'fast_path'), else with the query
+        engine within the query timeout. Returns the result and where it was run ('pandas' or 'sqlite').
+        '''
+        if self.fast_path and params is None:
+            result = self.__fast_query(query, catalog)
+            if result is not None:
+                return result, 'pandas'
+        deadline = None if self.query_timeout is None else time.time() + self.query_timeout
+        engine = self.__engine if self.__processes is None else self.__processes
+        result = engine.query(query, deadline=deadline, max_rows=self.max_rows, params=params)
+        if self.auto_index:
+            self.__learn_indexes(query)
+        return result, 'sqlite'
+
+    def __check_limits(self, result: pd.DataFrame, nbytes: int = None) -> int:
+        '''
+        Raise a QueryLimitError if a result exceeds 'max_rows' or 'max_bytes' - returns the size of the result in bytes
+        if it was needed (else the given size, which is None if unknown).
+        '''
+        if self.max_rows is not None and len(result) > self.max_rows:
+            raise QueryLimitError(f'Query result exceeds the limit of {self.max_rows} rows.', 'max_rows')
+        if self.max_bytes is not None:
+            nbytes = int(result.memory_usage(index=False, deep=True).sum()) if nbytes is None else nbytes
+            if nbytes > self.max_bytes:
+                raise QueryLimitError(f'Query result exceeds the limit of {self.max_bytes} bytes.', 'max_bytes')
+        return nbytes
+
+    def __start_profiler(self, profiler: cProfile.Profile) -> bool:
+        '''
+        Enable the profiler of a query, unless another profiler is active (only one can be active at a time on Python
+        3.12+) - the query is then run without profiling.
+        '''
+        if not self.__profiling.acquire(blocking=False):
+            return False
+        try:
+            profiler.enable()
+            return True
+        except ValueError as e:
+            # I.e. a profiler enabled outside of the API
+            self.__profiling.release()
+            log.debug(f"Query is run without profiling: {e}")
+            return False
+
+    def query_chunks(self, query: str = None, chunksize: int = 10000, params=None,
+                     statement: str = None) -> Iterator[pd.DataFrame]:
+        '''
+        Return data corresponding to the given query in chunks - used by the webservice to stream large results, so
+        the full result is never held in memory. Results are not cached.
+
+        Parameters
+        ----------
+        query : str
+            The query to respond to in SQLite style.
+        chunksize : int, default=10000
+            Maximum number of rows in each chunk.
+        params : list or dict, default None
+            Parameters of the query, see 'query_dataframe'.
+        statement : str, default None
+            Name of a prepared statement to run instead of a query.
+
+        Returns
+        -------
+        Iterator[pd.DataFrame]
+            Iterator of DataFrames with the data returned from the dataframe - at least one (possibly empty) DataFrame
+            is returned. All chunks are read from the dataframes as they were when the query started.
+
+        Raises
+        ------
+        PermissionError
+            If the query does not match the query regex.
+        LookupError
+            If the query refers to a dataframe that does not exist or is empty.
+        QueryLimitError
+            If the chunks returned so far exceed 'max_rows' or 'max_bytes', or the query (including the time spent
+            between chunks) takes longer than 'query_timeout' - the stream is then cut off.
+        '''
+        log.debug(f"Received SQL Query for streaming: {query if statement is None else f'statement {statement}'}")
+        query = self.__resolve(query, statement)
+
+        try:
+            deadline = None if self.query_timeout is None else time.time() + self.query_timeout
+            yield from self.__engine.iter_query(query, chunksize, deadline=deadline, max_rows=self.max_rows,
+                                                max_bytes=self.max_bytes, params=params)
+        except Exception as e:
+            if "no such table" in e.__str__():
+                raise LookupError("Requested dataframe does not exist or is empty.") from None
+            raise
+
+    def subscribe(self, query: str = None, params=None, statement: str = None, key: list = None) -> Iterator[tuple]:
+        '''
+        Subscribe to the result of a query - used by the webservice to push changes of the result to clients as
+        Server-Sent Events, so they do not have to poll the query. The query is run again (through the query cache,
+        so subscribers to the same query share the result) only when a dataframe named in it has changed, and only
+        the rows that differ from the previous result are returned.
+
+        Parameters
+        ----------
+        query : str
+            The query to subscribe to in SQLite style.
+        params : list or dict, default None
+            Parameters of the query, see 'query_dataframe'.
+        statement : str, default None
+            Name of a prepared statement to subscribe to instead of a query.
+        key : list, default None
+            Columns of the result identifying a row - if given, changed rows are only sent once (as updated rows) and
+            removed rows are sent as their key. Otherwise a changed row is sent as both a removed and an added row.
+
+        Returns
+        -------
+        Iterator[tuple]
+            Iterator of events as tuples of the event name and a dict of data:
+            ('snapshot', {'rows': DataFrame}) with the full result first, then ('update', {'rows': DataFrame,
+            'deleted': DataFrame}) with the added/changed and removed rows whenever the result changes. If the query
+            fails after a change, ('error', {'error': message}) is the last event. (None, None) is returned after
+            'subscription_heartbeat' seconds without changes, so the caller can stop (i.e. if the client is gone). The
+            iterator ends at once when the webservice is stopped.
+
+        Raises
+        ------
+        PermissionError
+            If the query does not match the query regex.
+        LookupError
+            If the query refers to a dataframe that does not exist or is empty (or the statement does not exist).
+        ValueError
+            If a column of 'key' is not part of the result.
+        '''
+        def versions() -> tuple:
+            # Versions of the dataframes named in the query - changes of other dataframes do not wake the subscription
+            return self.__cache_key(self.__resolve(query, statement), self.__catalog, params)
+
+        key = [key] if isinstance(key, str) else key
+        seen = versions()
+        result = self.query_dataframe(query, params=params, statement=statement)
+        if key is not None and not set(key).issubset(result.columns):
+            log.error(f"Tried to subscribe to a query with key '{key}' which is not part of the result.")
+            raise ValueError(f"The columns {list(set(key) - set(result.columns))} of 'key' are missing in the result.")
+        yield 'snapshot', {'rows': result}
+
+        while True:
+            # A statement that is removed meanwhile counts as a change, so its error is sent below
+            with self.__published:
+                changed = self.__published.wait_for(lambda: self.web.stopping.is_set() or
+                                                    self.__statements.get(statement, query) is None or
+                                                    versions() != seen, timeout=self.subscription_heartbeat)
+            if self.web.stopping.is_set():
+                return
+            if not changed:
+                yield None, None
+                continue
+
+            try:
+                seen = versions()
+                latest = self.query_dataframe(query, params=params, statement=statement)
+                added, deleted = self.__diff(result, latest, key)
+            except Exception as e:
+                log.warning(f"Subscribed query failed after a change of the dataframes: {e}")
+                yield 'error', {'error': f"Query failed with message '{e}'"}
+                return
+            result = latest
+            if not added.empty or not deleted.empty:
+                yield 'update', {'rows': added, 'deleted': deleted}
+
+    def __wake_subscriptions(self) -> None:
+        '''Wake the subscriptions waiting for changes, so they end when the webservice is stopped.'''
+        with self.__published:
+            self.__published.notify_all()
+
+    def __diff(self, old: pd.DataFrame, new: pd.DataFrame, key: list = None) -> tuple:
+        '''
+        Compare two results of a query - returns the rows of the new result that are not in the old one, and the rows
+        of the old result that are not in the new one (only the key of rows with a key that is gone, if 'key' is given).
+        Rows are compared by their hash, and duplicates are matched one to one.
+        '''
+        if list(old.columns) != list(new.columns) or list(old.dtypes) != list(new.dtypes):
+            return new, old[key] if key is not None else old
+
+        def rows(dataframe: pd.DataFrame) -> pd.MultiIndex:
+            hashes = pd.util.hash_pandas_object(dataframe, index=False).to_numpy()
+            return pd.MultiIndex.from_arrays([hashes, pd.Series(hashes).groupby(hashes).cumcount().to_numpy()])
+
+        old_rows, new_rows = rows(old), rows(new)
+        added, deleted = new[~new_rows.isin(old_rows)], old[~old_rows.isin(new_rows)]
+        if key is not None:
+            deleted = deleted.loc[~self.__key_index(deleted, key).isin(self.__key_index(new, key)), key]
+        return added, deleted
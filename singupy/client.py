@@ -0,0 +1,345 @@
+"""
+Clients for querying a SQLRestAPI/DataFrameAPI endpoint (see the 'api' module) and getting the results as DataFrames.
+"""
+from __future__ import annotations
+
+# Modules related to web
+import requests
+from requests.adapters import HTTPAdapter
+
+# Modules related to pandas
+import pandas as pd
+
+# Generic modules
+import asyncio
+import io
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib.util import find_spec
+from typing import AsyncIterator, Iterator
+
+# Initialize log
+log = logging.getLogger(__name__)
+
+# Response formats in order of preference - the first one supported by both server and client is used
+PREFERRED_FORMATS = ['arrow', 'parquet', 'split', 'records', 'csv', 'dict']
+
+
+def _decode(response: requests.Response, fmt: str) -> pd.DataFrame:
+    '''Decode the response of a query sent in the given format to a DataFrame.'''
+    if fmt == 'arrow':
+        import pyarrow as pa
+
+        return pa.ipc.open_stream(response.content).read_pandas()
+    elif fmt == 'parquet':
+        return pd.read_parquet(io.BytesIO(response.content))
+    elif fmt == 'split':
+        data = response.json()
+        return pd.DataFrame(data['data'], columns=data['columns'])
+    elif fmt == 'records':
+        return pd.DataFrame.from_records(response.json())
+    elif fmt == 'csv':
+        return pd.read_csv(io.StringIO(response.text))
+    elif fmt == 'ndjson':
+        return pd.read_json(io.StringIO(response.text), lines=True)
+
+    # The 'dict' format has the index as (string) keys
+    dataframe = pd.DataFrame(response.json())
+    try:
+        dataframe.index = dataframe.index.astype(int)
+    except (TypeError, ValueError):
+        pass
+    return dataframe
+
+
+def _read_events(response: requests.Response) -> Iterator[tuple]:
+    '''
+    Parse the Server-Sent Events of a streamed response as they arrive - returns tuples of the event name and its
+    (JSON) data, where lists are decoded as DataFrames. Comments (which keep the connection alive) are skipped.
+    '''
+    # Data is read as soon as it arrives, also when the response is not chunked (urllib3 1.x can only read byte by byte)
+    if hasattr(response.raw, 'read1'):
+        chunks = iter(lambda: response.raw.read1(65536, decode_content=True), b'')
+    else:
+        chunks = response.iter_content(chunk_size=1)
+
+    buffer = b''
+    event, data = None, []
+    for chunk in chunks:
+        *lines, buffer = (buffer + chunk).split(b'\n')
+        for line in lines:
+            field, _, value = line.decode().rstrip('\r').partition(':')
+            if field == 'event':
+                event = value.strip()
+            elif field == 'data':
+                data.append(value[1:] if value.startswith(' ') else value)
+            elif not field and not value and data:
+                # A blank line ends the event
+                message = json.loads('\n'.join(data))
+                yield event, {name: pd.DataFrame.from_records(values) if isinstance(values, list) else values
+                              for name, values in message.items()}
+                event, data = None, []
+
+
+class SQLClient():
+    '''
+    Client for querying a SQLRestAPI/DataFrameAPI endpoint and getting the results as pandas DataFrames.
+    Connections are kept alive and reused from a pool, so many queries can be sent (also concurrently) without the
+    overhead of connecting for each query.
+
+    Attributes
+    ----------
+    url : str
+        URL of the endpoint (i.e. http://host:port/endpoint)
+    format : str
+        The response format used for queries - negotiated with the server if not given
+    timeout : float
+        Timeout in seconds of each request
+    metadata_ttl : float
+        How long the metadata from the endpoint is cached in seconds
+    session : requests.Session
+        The session holding the pooled connections
+
+    '''
+    def __init__(self, url: str, format: str = None, pool_size: int = 10, timeout: float = 30, metadata_ttl: float = 60):
+        '''
+        Parameters
+        ----------
+        url : str
+            URL of the endpoint (i.e. http://host:port/endpoint)
+        format : str, default None
+            Response format to use for queries (see api.RESPONSE_FORMATS). If None, the most efficient format supported
+            by both the server and the client is used.
+        pool_size : int, default 10
+            Maximum number of connections kept in the pool (i.e. the number of concurrent queries)
+        timeout : float, default 30
+            Timeout in seconds of each request
+        metadata_ttl : float, default 60
+            How long the metadata from the endpoint is cached in seconds
+        '''
+        self.url = url
+        self.timeout = timeout
+        self.metadata_ttl = metadata_ttl
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.__format = format
+        self.__metadata = None
+        self.__metadata_etag = None
+        self.__metadata_time = 0
+        self.__executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self) -> None:
+        '''Close the pooled connections (and threads used for concurrent queries).'''
+        if self.__executor is not None:
+            self.__executor.shutdown()
+            self.__executor = None
+        self.session.close()
+
+    def metadata(self, refresh: bool = False) -> dict:
+        '''
+        Get the metadata of the endpoint (the response to a 'GET') - it is cached for 'metadata_ttl' seconds, after which
+        it is only sent again by the endpoint if it has changed (checked with its ETag).
+
+        Parameters
+        ----------
+        refresh : bool, default False
+            If set, the metadata is fetched from the endpoint even if it is cached.
+
+        Returns
+        -------
+        dict
+            The metadata returned by the endpoint.
+        '''
+        if refresh or self.__metadata is None or time.monotonic() - self.__metadata_time > self.metadata_ttl:
+            headers = {'If-None-Match': self.__metadata_etag} if self.__metadata_etag is not None else {}
+            response = self.session.get(self.url, timeout=self.timeout, headers=headers)
+            if response.status_code != 304:
+                self.__raise_for_error(response)
+                self.__metadata = response.json()
+                self.__metadata_etag = response.headers.get('ETag')
+            self.__metadata_time = time.monotonic()
+        return self.__metadata
+
+    @property
+    def format(self) -> str:
+        if self.__format is None:
+            client_formats = [fmt for fmt in PREFERRED_FORMATS
+                              if fmt not in ('arrow', 'parquet') or find_spec('pyarrow') is not None]
+            try:
+                server_formats = self.metadata().get('formats', ['dict'])
+            except Exception as e:
+                log.warning(f"Could not get supported formats from '{self.url}', using 'dict' format: {e}")
+                return 'dict'
+            self.__format = next((fmt for fmt in client_formats if fmt in server_formats), 'dict')
+            log.debug(f"Using format '{self.__format}' for queries to '{self.url}'.")
+        return self.__format
+
+    @format.setter
+    def format(self, value: str):
+        self.__format = value
+
+    @staticmethod
+    def __raise_for_error(response: requests.Response) -> None:
+        '''Raise an HTTPError including the error message from the server, if the request failed.'''
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('error', response.text)
+            except ValueError:
+                message = response.text
+            log.error(f"Request to '{response.url}' failed with status {response.status_code}: {message}")
+            raise requests.HTTPError(f"{response.status_code} Error: {message}", response=response)
+
+    def query(self, query: str = None, params=None, statement: str = None) -> pd.DataFrame:
+        '''
+        Send a query to the endpoint.
+
+        Parameters
+        ----------
+        query : str
+            The query to send in SQLite style.
+        params : list or dict, default None
+            Values bound to the placeholders of the query ('?' for a list, ':name' for a dict) by the server.
+        statement : str, default None
+            Name of a statement prepared on the server to run (with 'params') instead of a query.
+
+        Returns
+        -------
+        pd.DataFrame
+            DataFrame with the result of the query.
+
+        Raises
+        ------
+        requests.HTTPError
+            If the server responds with an error (i.e. the query is not valid).
+        '''
+        fmt = self.format
+        payload = {'sql-query': query, 'params': params, 'statement': statement, 'format': fmt}
+        response = self.session.post(self.url, json={key: value for key, value in payload.items() if value is not None},
+                                     timeout=self.timeout)
+        self.__raise_for_error(response)
+        return _decode(response, fmt)
+
+    def subscribe(self, query: str = None, params=None, statement: str = None, key: list = None) -> Iterator[tuple]:
+        '''
+        Subscribe to a query - the endpoint sends the full result first and then only the rows that change (as
+        Server-Sent Events), so the query does not have to be polled. The subscription ends when the iterator is closed
+        (or the endpoint stops) - the endpoint must send heartbeats more often than 'timeout'.
+
+        Parameters
+        ----------
+        query : str
+            The query to subscribe to in SQLite style.
+        params : list or dict, default None
+            Values bound to the placeholders of the query, see 'query'.
+        statement : str, default None
+            Name of a statement prepared on the server to subscribe to instead of a query.
+        key : list, default None
+            Columns of the result identifying a row - if given, removed rows are sent as their key only, and changed
+            rows are only sent as updated rows (and not also as removed rows).
+
+        Returns
+        -------
+        Iterator[tuple]
+            Iterator of events as tuples of the event name and a dict of data: ('snapshot', {'rows': DataFrame}) first,
+            then ('update', {'rows': DataFrame, 'deleted': DataFrame}) with the added/changed and removed rows of each
+            change. An ('error', {'error': message}) event ends the subscription if the query fails after a change.
+
+        Raises
+        ------
+        requests.HTTPError
+            If the server responds with an error (i.e. the query is not valid).
+        '''
+        payload = {'sql-query': query, 'params': params, 'statement': statement, 'key': key, 'subscribe': True}
+        with self.session.post(self.url, json={key: value for key, value in payload.items() if value is not None},
+                               timeout=self.timeout, stream=True) as response:
+            self.__raise_for_error(response)
+            yield from _read_events(response)
+
+    def query_many(self, queries: list) -> list:
+        '''
+        Send several queries to the endpoint concurrently (at most 'pool_size' at a time).
+
+        Parameters
+        ----------
+        queries : list
+            List of queries to send in SQLite style.
+
+        Returns
+        -------
+        list
+            List of DataFrames with the results, in the same order as the queries.
+        '''
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='SQLClient')
+        _ = self.format
+        return list(self.__executor.map(self.query, queries))
+
+
+class AsyncSQLClient():
+    '''
+    Asyncio client for querying a SQLRestAPI/DataFrameAPI endpoint and getting the results as pandas DataFrames.
+    Requests are sent from a pool of threads sharing the pooled connections of a 'SQLClient', so queries can be awaited
+    (and gathered) from an event loop without blocking it.
+
+    Attributes
+    ----------
+    client : SQLClient
+        The underlying client - see the 'SQLClient' class for the format, timeout and metadata settings
+
+    '''
+    def __init__(self, url: str, format: str = None, pool_size: int = 10, timeout: float = 30, metadata_ttl: float = 60):
+        '''
+        Parameters
+        ----------
+        Same as for the 'SQLClient' class.
+        '''
+        self.client = SQLClient(url, format=format, pool_size=pool_size, timeout=timeout, metadata_ttl=metadata_ttl)
+        self.__executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='AsyncSQLClient')
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def __run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, function, *args)
+
+    async def close(self) -> None:
+        '''Close the pooled connections and threads.'''
+        await self.__run(self.client.close)
+        self.__executor.shutdown()
+
+    async def metadata(self, refresh: bool = False) -> dict:
+        '''Get the metadata of the endpoint - see 'SQLClient.metadata'.'''
+        return await self.__run(self.client.metadata, refresh)
+
+    async def query(self, query: str = None, params=None, statement: str = None) -> pd.DataFrame:
+        '''Send a query to the endpoint - see 'SQLClient.query'.'''
+        return await self.__run(self.client.query, query, params, statement)
+
+    async def subscribe(self, query: str = None, params=None, statement: str = None,
+                        key: list = None) -> AsyncIterator[tuple]:
+        '''Subscribe to a query - see 'SQLClient.subscribe'. A thread of the pool waits for the events.'''
+        events = self.client.subscribe(query, params, statement, key)
+        try:
+            while (event := await self.__run(next, events, None)) is not None:
+                yield event
+        finally:
+            await self.__run(events.close)
+
+    async def query_many(self, queries: list) -> list:
+        '''Send several queries to the endpoint concurrently - see 'SQLClient.query_many'.'''
+        await self.__run(lambda: self.client.format)
+        return list(await asyncio.gather(*(self.query(query) for query in queries)))
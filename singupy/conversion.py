@@ -1,3 +1,16 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+# numpy and pandas are only imported by 'kv_to_letters', so 'kv_to_letter' can be used without loading them
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Lower edges (in kV) of the voltage regions and the letters of the regions - below the first edge is 'N'
+KV_EDGES = [1, 6, 10, 20, 30, 45, 60, 110, 220, 380, 420]
+KV_LETTERS = ['N', 'M', 'L', 'K', 'J', 'H', 'G', 'F', 'E', 'D', 'C', 'B']
+
+
 def kv_to_letter(kv: int) -> str:
     """Converts voltage level to voltage letter representation.
     Parameters
@@ -39,3 +52,44 @@ def kv_to_letter(kv: int) -> str:
         return 'N'
     else:
         raise ValueError(f'The value "{kv}" does not match a valid voltage region.')
+
+
+def kv_to_letters(kv, errors: str = 'raise') -> pd.Series:
+    """Converts many voltage levels to voltage letter representation at once (vectorized 'kv_to_letter').
+    Parameters
+    ----------
+    kv : pd.Series, np.ndarray or list
+        Voltage levels in kV. Values are truncated to integers like in 'kv_to_letter'.
+    errors : str
+        'raise' to raise an error on invalid values (NaN or non-numerical), 'coerce' to return NaN for them.
+        (Default = 'raise')
+    Returns
+    -------
+    pd.Series
+        Categorical series of voltage letters (with the index of 'kv' if it is a series).
+    Raises
+    ------
+    ValueError
+        If 'errors' is 'raise' and some values are not valid numerical values.
+    Example
+    -------
+        >>> kv_to_letters(pd.Series([400, 132, 10])).tolist()
+        ['C', 'E', 'K']
+    """
+    if errors not in ('raise', 'coerce'):
+        raise ValueError(f"'errors' must be 'raise' or 'coerce', not '{errors}'.")
+    import numpy as np
+    import pandas as pd
+
+    series = kv if isinstance(kv, pd.Series) else pd.Series(np.asarray(kv, dtype=object))
+    values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+    valid = np.isfinite(values)
+
+    if errors == 'raise' and not valid.all():
+        invalid = series[~valid].unique()
+        raise ValueError(f'{len(invalid)} value(s) are not valid numerical values, i.e. {list(invalid[:5])}.')
+
+    codes = np.searchsorted(KV_EDGES, np.trunc(values[valid]), side='right')
+    all_codes = np.full(len(values), -1, dtype=np.int8)
+    all_codes[valid] = codes
+    return pd.Series(pd.Categorical.from_codes(all_codes, categories=KV_LETTERS), index=series.index, name=series.name)
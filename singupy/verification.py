@@ -1,5 +1,11 @@
-import pandas as pd
+from __future__ import annotations
+
 import logging
+from typing import TYPE_CHECKING
+
+# pandas is first imported when a dtype or report needs it, so importing the module does not load it
+if TYPE_CHECKING:
+    import pandas as pd
 
 log = logging.getLogger(__name__)
 
@@ -37,3 +43,259 @@ def dataframe_columns(dataframe: pd.DataFrame, expected_columns: list, allow_ext
         else:
             raise ValueError(f"The columns: '{dataframe_columns}' in dataframe does not match expected columns: " +
                              f"'{expected_columns}'.")
+
+
+# Dtype kinds accepted as 'dtype' of a Column, and the functions of 'pandas.api.types' checking them (any must match)
+DTYPE_KINDS = {'numeric': ('is_numeric_dtype',),
+               'integer': ('is_integer_dtype',),
+               'float': ('is_float_dtype',),
+               'bool': ('is_bool_dtype',),
+               'string': ('is_string_dtype', 'is_object_dtype'),
+               'datetime': ('is_datetime64_any_dtype',)}
+
+
+def _is_dtype_kind(dtype, kind: str) -> bool:
+    """Check if a dtype is of one of the kinds in 'DTYPE_KINDS'."""
+    import pandas as pd
+
+    return any(getattr(pd.api.types, check)(dtype) for check in DTYPE_KINDS[kind])
+
+
+class Column():
+    """
+    Expectations for a column of a dataframe, used in a 'DataFrameSchema'.
+
+    Attributes
+    ----------
+    dtype : str
+        Expected dtype - either a pandas dtype name (i.e. 'int64') or one of the kinds in 'DTYPE_KINDS'
+        (i.e. 'numeric'). None accepts any dtype.
+    nullable : bool
+        Set False if the column may not contain null values (NaN/None).
+    min, max : any
+        Lowest and highest allowed values (inclusive). None for no limit.
+    unique : bool
+        Set True if the values of the column must be unique.
+    """
+    def __init__(self, dtype: str = None, nullable: bool = True, min=None, max=None, unique: bool = False):
+        if dtype is not None and dtype not in DTYPE_KINDS:
+            import pandas as pd
+
+            dtype = str(pd.api.types.pandas_dtype(dtype))
+        self.dtype = dtype
+        self.nullable = nullable
+        self.min = min
+        self.max = max
+        self.unique = unique
+
+
+class ValidationReport():
+    """
+    Collected result of validating one or more dataframes against schemas.
+
+    Attributes
+    ----------
+    errors : list
+        One dict per problem found, with the keys 'dataframe', 'column', 'check', 'count' (number of offending values
+        where relevant) and 'message'.
+    """
+    def __init__(self):
+        self.errors = []
+
+    def __bool__(self):
+        return not self.errors
+
+    def __len__(self):
+        return len(self.errors)
+
+    def __repr__(self):
+        return f"ValidationReport({len(self.errors)} error(s))"
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def add(self, dataframe: str, column: str, check: str, message: str, count: int = None):
+        self.errors.append({'dataframe': dataframe, 'column': column, 'check': check, 'count': count,
+                            'message': message})
+
+    def extend(self, other: 'ValidationReport'):
+        self.errors.extend(other.errors)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Return the errors as a dataframe (one row per error)."""
+        import pandas as pd
+
+        return pd.DataFrame(self.errors, columns=['dataframe', 'column', 'check', 'count', 'message'])
+
+    def raise_for_errors(self):
+        """
+        Raises
+        ------
+        ValueError
+            If any errors were found - the message lists all of them.
+        """
+        if self.errors:
+            messages = '; '.join(f"{error['dataframe']}: {error['message']}" for error in self.errors)
+            log.error(f"Validation found {len(self.errors)} error(s): {messages}")
+            raise ValueError(f"Validation found {len(self.errors)} error(s): {messages}")
+
+
+class DataFrameSchema():
+    """
+    Compiled schema for validating dataframes - checks columns, dtypes, nulls, value ranges and unique keys at once and
+    collects all problems in a 'ValidationReport' instead of raising on the first one. The column sets and checks are
+    prepared once when the schema is created, so a schema can be reused cheaply for every update.
+
+    Attributes
+    ----------
+    columns : dict
+        The expected columns, as a dict of column name: Column.
+    allow_extra_columns : bool
+        Set True if columns in addition to the expected columns are accepted.
+    key : list
+        Columns whose combined values must be unique (None for no key).
+    """
+    def __init__(self, columns, allow_extra_columns: bool = False, key: list = None):
+        """
+        Parameters
+        ----------
+        columns : dict or list
+            The expected columns, either as a dict of column name: Column (or None for no expectations to the
+            values) or a list of column names.
+        allow_extra_columns : bool
+            Set True if columns in addition to the expected columns are accepted.
+            (Default = False)
+        key : str or list
+            Column(s) whose combined values must be unique.
+            (Default = None)
+        """
+        if not isinstance(columns, dict):
+            columns = dict.fromkeys(columns)
+        self.columns = {name: column if column is not None else Column() for name, column in columns.items()}
+        self.allow_extra_columns = allow_extra_columns
+        self.key = [key] if isinstance(key, str) else key
+
+        # Precompute the column set and the checks to run, so validating only does the checks that are needed
+        self.__expected = frozenset(self.columns)
+        self.__dtype_checks = [(name, column.dtype) for name, column in self.columns.items() if column.dtype is not None]
+        self.__null_checks = [name for name, column in self.columns.items() if not column.nullable]
+        self.__range_checks = [(name, column.min, column.max) for name, column in self.columns.items()
+                               if column.min is not None or column.max is not None]
+        self.__unique_checks = [name for name, column in self.columns.items() if column.unique]
+
+        missing_key = set(self.key or []) - self.__expected
+        if missing_key:
+            log.error(f"The key columns {sorted(missing_key)} are not in the schema.")
+            raise ValueError(f"The key columns {sorted(missing_key)} are not in the schema.")
+
+    def validate(self, dataframe: pd.DataFrame, name: str = None) -> ValidationReport:
+        """
+        Validate a dataframe against the schema.
+
+        Parameters
+        ----------
+        dataframe : pd.DataFrame
+            The dataframe to validate.
+        name : str
+            Name of the dataframe used in the report.
+            (Default = None)
+
+        Returns
+        -------
+        ValidationReport
+            Report with all problems found (empty if the dataframe is valid).
+        """
+        report = ValidationReport()
+        present = frozenset(dataframe.columns)
+        for check in (self.__check_columns, self.__check_dtypes, self.__check_nulls, self.__check_ranges,
+                      self.__check_unique, self.__check_key):
+            check(dataframe, present, name, report)
+        return report
+
+    def __check_columns(self, dataframe: pd.DataFrame, present: frozenset, name: str, report: ValidationReport):
+        """Report missing, unexpected and duplicated columns."""
+        missing = self.__expected - present
+        if missing:
+            report.add(name, None, 'columns', f"The columns {sorted(missing, key=str)} are missing in the dataframe")
+        if not self.allow_extra_columns:
+            extra = present - self.__expected
+            if extra:
+                report.add(name, None, 'columns', f"The columns {sorted(extra, key=str)} are not expected in the dataframe")
+        if dataframe.columns.has_duplicates:
+            duplicated = dataframe.columns[dataframe.columns.duplicated()].unique().tolist()
+            report.add(name, None, 'columns', f"The columns {duplicated} appear more than once in the dataframe")
+
+    def __check_dtypes(self, dataframe: pd.DataFrame, present: frozenset, name: str, report: ValidationReport):
+        """Report columns that do not have the expected dtype (or dtype kind)."""
+        for column, dtype in self.__dtype_checks:
+            if column in present:
+                actual = dataframe[column].dtype
+                valid = _is_dtype_kind(actual, dtype) if dtype in DTYPE_KINDS else str(actual) == dtype
+                if not valid:
+                    report.add(name, column, 'dtype', f"Column '{column}' has dtype '{actual}', expected '{dtype}'")
+
+    def __check_nulls(self, dataframe: pd.DataFrame, present: frozenset, name: str, report: ValidationReport):
+        """Report null values in columns that are not nullable."""
+        for column in self.__null_checks:
+            if column in present:
+                count = int(dataframe[column].isna().sum())
+                if count:
+                    report.add(name, column, 'nullable', f"Column '{column}' has {count} null value(s)", count)
+
+    def __check_ranges(self, dataframe: pd.DataFrame, present: frozenset, name: str, report: ValidationReport):
+        """Report values outside the range of their column (and columns that cannot be compared to it)."""
+        for column, lower, upper in self.__range_checks:
+            if column in present:
+                values = dataframe[column]
+                try:
+                    count = int((values < lower).sum()) if lower is not None else 0
+                    count += int((values > upper).sum()) if upper is not None else 0
+                except TypeError as e:
+                    report.add(name, column, 'range', f"Column '{column}' could not be compared to its range: {e}")
+                    continue
+                if count:
+                    report.add(name, column, 'range',
+                               f"Column '{column}' has {count} value(s) outside the range [{lower}, {upper}]", count)
+
+    def __check_unique(self, dataframe: pd.DataFrame, present: frozenset, name: str, report: ValidationReport):
+        """Report duplicated values in unique columns."""
+        for column in self.__unique_checks:
+            if column in present:
+                count = int(dataframe[column].duplicated().sum())
+                if count:
+                    report.add(name, column, 'unique', f"Column '{column}' has {count} duplicated value(s)", count)
+
+    def __check_key(self, dataframe: pd.DataFrame, present: frozenset, name: str, report: ValidationReport):
+        """Report duplicated values of the key."""
+        if self.key and set(self.key) <= present:
+            count = int(dataframe.duplicated(subset=self.key).sum())
+            if count:
+                report.add(name, None, 'key', f"The key {self.key} has {count} duplicated value(s)", count)
+
+
+def validate_dataframes(dataframes: dict, schemas) -> ValidationReport:
+    """
+    Validate many dataframes in one pass and collect all problems in one report.
+
+    Parameters
+    ----------
+    dataframes : dict
+        Dict of name: dataframe to validate.
+    schemas : DataFrameSchema or dict
+        A schema used for all dataframes, or a dict of name: DataFrameSchema. Dataframes without a schema in the dict
+        are reported as errors.
+
+    Returns
+    -------
+    ValidationReport
+        Report with all problems found (empty if all dataframes are valid).
+    """
+    report = ValidationReport()
+    for name, dataframe in dataframes.items():
+        schema = schemas if isinstance(schemas, DataFrameSchema) else schemas.get(name)
+        if schema is None:
+            report.add(name, None, 'schema', f"There is no schema for dataframe '{name}'")
+        else:
+            report.extend(schema.validate(dataframe, name))
+    return report
@@ -2,7 +2,10 @@ import pytest
 import logging
 from singupy import api
 import requests
+import time
+import threading
 import pandas as pd
+import json
 
 log = logging.getLogger(__name__)
 
@@ -162,3 +165,796 @@ def test_DataFrameAPI(DataFrameAPI_resource, caplog):
     assert response.status_code == 200
     expected_return = {'name': {'0': 'tom', '1': 'jerry'}, 'age': {'0': 80, '1': 82}, 'speed': {'0': 10, '1': 15}}
     assert response.json() == expected_return
+
+
+def test_DataFrameAPI_query_engine(tmp_path):
+    # Setup api without web - the query engine is independent of the webservice
+    test_api = api.DataFrameAPI(dataframe=pd.DataFrame({"name": ["tom", "jerry"]}), dbname='Cartoon', enable_web=False)
+    test_api['Numbers'] = pd.DataFrame({"number": [1, 2, 3]})
+    assert test_api.query("SELECT COUNT(*) AS cnt FROM Numbers;") == {'cnt': {0: 3}}
+
+    # Verify replacing a dataframe reloads the table, and the other table is untouched
+    test_api['Numbers'] = pd.DataFrame({"number": [1, 2, 3, 4]})
+    assert test_api.query("SELECT COUNT(*) AS cnt FROM Numbers;") == {'cnt': {0: 4}}
+    assert test_api.query("SELECT name FROM Cartoon;") == {'name': {0: 'tom', 1: 'jerry'}}
+
+    # Verify joins across tables loaded at different times work
+    test_api['Ages'] = pd.DataFrame({"name": ["tom", "jerry"], "age": [80, 82]})
+    assert test_api.query("SELECT c.name, a.age FROM Cartoon c JOIN Ages a ON c.name = a.name WHERE a.age > 81;") == \
+        {'name': {0: 'jerry'}, 'age': {0: 82}}
+
+    # Verify removed, emptied and cleared dataframes are no longer queryable
+    del test_api['Numbers']
+    assert 'error' in test_api.query("SELECT * FROM Numbers;")
+    test_api['Ages'] = pd.DataFrame()
+    assert 'error' in test_api.query("SELECT * FROM Ages;")
+    test_api.clear()
+    assert 'error' in test_api.query("SELECT * FROM Cartoon;")
+
+    # Verify the engine database is kept in the given directory
+    placed_api = api.DataFrameAPI(dataframe=pd.DataFrame({"number": [1]}), dbname='Numbers', enable_web=False,
+                                  engine_directory=str(tmp_path))
+    assert [file.name for file in tmp_path.glob('singupy-*/engine.sqlite')] == ['engine.sqlite']
+    assert placed_api.query("SELECT * FROM Numbers;") == {'number': {0: 1}}
+
+
+def test_DataFrameAPI_append_upsert():
+    test_api = api.DataFrameAPI(dataframe=pd.DataFrame({"station": ["A", "B"], "kv": [400, 150]}), dbname='Stations',
+                                enable_web=False)
+
+    # Verify append adds rows to both the stored dataframe and the query engine (columns are aligned by name)
+    test_api.append('Stations', pd.DataFrame({"kv": [60], "station": ["C"]}))
+    assert test_api.query("SELECT * FROM Stations;") == {'station': {0: 'A', 1: 'B', 2: 'C'}, 'kv': {0: 400, 1: 150, 2: 60}}
+    assert test_api['Stations'].equals(pd.DataFrame({"station": ["A", "B", "C"], "kv": [400, 150, 60]}))
+
+    # Verify upsert replaces rows matching the key and adds new rows - the engine and dataframe must agree
+    test_api.upsert('Stations', pd.DataFrame({"station": ["A", "D"], "kv": [220, 10]}), key=['station'])
+    expected = pd.DataFrame({"station": ["B", "C", "A", "D"], "kv": [150, 60, 220, 10]})
+    assert test_api.query("SELECT * FROM Stations;") == expected.to_dict()
+    assert test_api['Stations'].equals(expected)
+
+    # Verify upsert with a multi-column key and several pending updates
+    test_api.append('Stations', pd.DataFrame({"station": ["E"], "kv": [10]}))
+    test_api.upsert('Stations', pd.DataFrame({"station": ["E", "D"], "kv": [10, 15]}), key=["station", "kv"])
+    expected = pd.DataFrame({"station": ["B", "C", "A", "D", "E", "D"], "kv": [150, 60, 220, 10, 10, 15]})
+    assert test_api.query("SELECT * FROM Stations;") == expected.to_dict()
+    assert test_api['Stations'].equals(expected)
+
+    # Verify upsert matches timestamp and null keys in the engine like in the dataframe (COUNT(*) is run by SQLite)
+    readings = pd.DataFrame({"time": pd.to_datetime(["2024-01-01 00:00", "2024-01-01 00:15"]), "mw": [1.0, 2.0]})
+    test_api['Readings'] = readings
+    test_api.upsert('Readings', pd.DataFrame({"time": pd.to_datetime(["2024-01-01 00:15"]), "mw": [3.0]}), key='time')
+    assert test_api.query("SELECT mw FROM Readings WHERE time = '2024-01-01 00:15:00';") == {'mw': {0: 3.0}}
+    assert test_api.query("SELECT COUNT(*) AS n FROM Readings;") == {'n': {0: 2}}
+    test_api['Loads'] = pd.DataFrame({"kv": [400.0, None], "mw": [1.0, 2.0]})
+    test_api.upsert('Loads', pd.DataFrame({"kv": [float('nan')], "mw": [3.0]}), key='kv')
+    assert len(test_api['Loads']) == 2
+    assert test_api.query("SELECT COUNT(*) AS n, SUM(mw) AS mw FROM Loads;") == {'n': {0: 2}, 'mw': {0: 4.0}}
+
+    # Verify append/upsert to a missing dataframe sets it
+    test_api.upsert('New', pd.DataFrame({"station": ["A"]}), key='station')
+    assert test_api.query("SELECT * FROM New;") == {'station': {0: 'A'}}
+
+    # Verify mismatching columns, missing key columns and non-dataframes are refused
+    with pytest.raises(ValueError):
+        test_api.append('Stations', pd.DataFrame({"station": ["F"]}))
+    with pytest.raises(ValueError):
+        test_api.upsert('Stations', pd.DataFrame({"station": ["F"], "kv": [1]}), key=["name"])
+    with pytest.raises(ValueError):
+        test_api.append('Stations', {"station": "F", "kv": 1})
+
+    # Verify setting the dataframe discards pending updates
+    test_api.append('Stations', pd.DataFrame({"station": ["F"], "kv": [1]}))
+    test_api['Stations'] = pd.DataFrame({"station": ["G"], "kv": [1]})
+    assert test_api['Stations'].equals(pd.DataFrame({"station": ["G"], "kv": [1]}))
+    assert test_api.query("SELECT station FROM Stations;") == {'station': {0: 'G'}}
+
+
+def test_DataFrameAPI_query_cache():
+    test_api = api.DataFrameAPI(dataframe=pd.DataFrame({"number": [1, 2, 3]}), dbname='Numbers', enable_web=False,
+                                cache_size=2)
+    test_api['Other'] = pd.DataFrame({"number": [4]})
+    query = "SELECT SUM(number) AS total FROM Numbers;"
+
+    # Verify repeated queries (also with other formatting) are served from the cache
+    assert test_api.query(query) == {'total': {0: 6}}
+    assert test_api.query("SELECT   SUM(number) AS total\nFROM Numbers;") == {'total': {0: 6}}
+    assert test_api.metadata()['cache']['hits'] == 1
+    assert test_api.metadata()['cache']['misses'] == 1
+
+    # Verify whitespace in strings is not normalized
+    assert test_api.query("SELECT 'a  b' AS text FROM Numbers LIMIT 1;") == {'text': {0: 'a  b'}}
+    assert test_api.query("SELECT 'a b' AS text FROM Numbers LIMIT 1;") == {'text': {0: 'a b'}}
+
+    # Verify updating an unrelated dataframe does not invalidate, but all updates of the queried dataframe do
+    test_api.cache.maxsize = 10
+    test_api.query(query)
+    hits = test_api.cache.hits
+    test_api['Other'] = pd.DataFrame({"number": [5]})
+    assert test_api.query(query) == {'total': {0: 6}}
+    assert test_api.cache.hits == hits + 1
+
+    test_api['Numbers'] = pd.DataFrame({"number": [1, 2, 3, 4]})
+    assert test_api.query(query) == {'total': {0: 10}}
+    test_api.append('Numbers', pd.DataFrame({"number": [5]}))
+    assert test_api.query(query) == {'total': {0: 15}}
+    test_api.upsert('Numbers', pd.DataFrame({"number": [6]}), key='number')
+    assert test_api.query(query) == {'total': {0: 21}}
+    del test_api['Numbers']
+    assert 'error' in test_api.query(query)
+    test_api['Numbers'] = pd.DataFrame({"number": [1]})
+    assert test_api.query(query) == {'total': {0: 1}}
+    test_api.clear()
+    assert 'error' in test_api.query(query)
+    assert len(test_api.cache) == 0
+
+    # Verify the size limit and the ttl is respected
+    test_api['Numbers'] = pd.DataFrame({"number": [1]})
+    for limit in range(1, 20):
+        test_api.query(f"SELECT * FROM Numbers LIMIT {limit};")
+    assert len(test_api.cache) == 10
+    test_api.cache.ttl = 0
+    misses = test_api.cache.misses
+    test_api.query("SELECT * FROM Numbers LIMIT 19;")
+    assert test_api.cache.misses == misses + 1
+
+
+def test_DataFrameAPI_response_formats(DataFrameAPI_resource):
+    test_api = DataFrameAPI_resource
+    test_api['MiniData'] = pd.DataFrame({"name": ["tom", "jerry"], "age": [80, 82]})
+    url = f'http://localhost:{test_api.web.port}/{test_api.web.endpoint}'
+    query = "SELECT * FROM MiniData;"
+    assert set(test_api.metadata()['formats']) >= {'dict', 'split', 'records', 'csv'}
+
+    # Verify the default format is unchanged
+    response = requests.post(url, json={"sql-query": query})
+    assert response.json() == {'name': {'0': 'tom', '1': 'jerry'}, 'age': {'0': 80, '1': 82}}
+
+    # Verify JSON orients and CSV can be requested with the 'format' key
+    response = requests.post(url, json={"sql-query": query, "format": "split"})
+    assert response.json() == {'columns': ['name', 'age'], 'index': [0, 1], 'data': [['tom', 80], ['jerry', 82]]}
+    response = requests.post(url, json={"sql-query": query, "format": "records"})
+    assert response.json() == [{'name': 'tom', 'age': 80}, {'name': 'jerry', 'age': 82}]
+    response = requests.post(url, json={"sql-query": query, "format": "csv"})
+    assert response.headers['Content-Type'].startswith('text/csv')
+    assert response.text.splitlines() == ['name,age', 'tom,80', 'jerry,82']
+
+    # Verify the format can be negotiated with the Accept header
+    response = requests.post(url, json={"sql-query": query}, headers={'Accept': 'text/csv'})
+    assert response.text.splitlines()[0] == 'name,age'
+
+    # Verify invalid formats and errors are still reported as errors
+    assert requests.post(url, json={"sql-query": query, "format": "xml"}).status_code == 400
+    response = requests.post(url, json={"sql-query": "SELECT * FROM Missing;", "format": "csv"})
+    assert response.status_code == 400
+    assert 'does not exist' in response.json()['error']
+
+
+def test_DataFrameAPI_binary_formats(DataFrameAPI_resource):
+    pa = pytest.importorskip('pyarrow')
+    import io
+
+    test_api = DataFrameAPI_resource
+    mini_df = pd.DataFrame({"name": ["tom", "jerry"], "age": [80, 82]})
+    test_api['MiniData'] = mini_df
+    url = f'http://localhost:{test_api.web.port}/{test_api.web.endpoint}'
+
+    response = requests.post(url, json={"sql-query": "SELECT * FROM MiniData;", "format": "arrow"})
+    assert response.headers['Content-Type'] == api.RESPONSE_FORMATS['arrow']
+    assert pa.ipc.open_stream(response.content).read_pandas().equals(mini_df)
+
+    response = requests.post(url, json={"sql-query": "SELECT * FROM MiniData;"},
+                             headers={'Accept': api.RESPONSE_FORMATS['parquet']})
+    assert pd.read_parquet(io.BytesIO(response.content)).equals(mini_df)
+
+
+def test_DataFrameAPI_streaming(DataFrameAPI_resource):
+    test_api = DataFrameAPI_resource
+    test_api.web.chunksize = 2
+    numbers_df = pd.DataFrame({"number": range(5), "text": [f"t{n}" for n in range(5)]})
+    test_api['Numbers'] = numbers_df
+    url = f'http://localhost:{test_api.web.port}/{test_api.web.endpoint}'
+
+    # Verify the chunks of the query engine
+    chunks = list(test_api.query_chunks("SELECT * FROM Numbers;", chunksize=2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+    assert list(test_api.query_chunks("SELECT * FROM Numbers WHERE number > 10;"))[0].empty
+
+    # Verify NDJSON (default) and CSV streams
+    response = requests.post(url, json={"sql-query": "SELECT * FROM Numbers;", "stream": True}, stream=True)
+    assert response.headers['Content-Type'] == api.RESPONSE_FORMATS['ndjson']
+    response.raw.decode_content = True
+    assert pd.read_json(response.raw, lines=True).equals(numbers_df)
+    response = requests.post(url, json={"sql-query": "SELECT * FROM Numbers;", "stream": True, "format": "csv"})
+    assert response.text.splitlines() == ['number,text'] + [f'{n},t{n}' for n in range(5)]
+
+    # Verify an empty result and errors
+    response = requests.post(url, json={"sql-query": "SELECT * FROM Numbers WHERE number > 10;", "stream": True})
+    assert response.status_code == 200 and response.text == ''
+    response = requests.post(url, json={"sql-query": "SELECT * FROM Missing;", "stream": True})
+    assert response.status_code == 400
+    assert requests.post(url, json={"sql-query": "SELECT * FROM Numbers;", "stream": True,
+                                    "format": "split"}).status_code == 400
+
+    # Verify the dataframes can be updated after streaming
+    test_api['Numbers'] = numbers_df.head(1)
+    assert test_api.query("SELECT COUNT(*) AS cnt FROM Numbers;") == {'cnt': {0: 1}}
+
+    # Verify arrow record batches
+    pa = pytest.importorskip('pyarrow')
+    test_api['Numbers'] = numbers_df
+    response = requests.post(url, json={"sql-query": "SELECT * FROM Numbers;", "stream": True, "format": "arrow"})
+    reader = pa.ipc.open_stream(response.content)
+    batches = list(reader)
+    assert [batch.num_rows for batch in batches] == [2, 2, 1]
+    assert pa.Table.from_batches(batches).to_pandas().equals(numbers_df)
+
+
+@pytest.mark.parametrize("backend, workers", [('werkzeug', None), ('werkzeug', 2), ('waitress', 2)])
+def test_SQLRestAPI_backends(backend, workers):
+    if backend == 'waitress':
+        pytest.importorskip('waitress')
+    from concurrent.futures import ThreadPoolExecutor
+
+    web = api.SQLRestAPI(port=PORT, endpoint=ENDPOINT, getcall=GetDummy, postcall=PostDummy, start=False,
+                         backend=backend, workers=workers)
+    assert web.backend == backend and web.workers == workers
+    try:
+        web.start()
+        assert web.ready is True
+        with pytest.raises(AttributeError):
+            web.workers = 8
+
+        # Verify concurrent requests (more than the number of workers) are all handled
+        url = f'http://localhost:{web.port}/{web.endpoint}'
+        query = "SELECT * FROM A-TEAM;"
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            responses = list(pool.map(lambda _: requests.post(url, json={"sql-query": query}), range(32)))
+        assert all(response.json() == PostDummy(query) for response in responses)
+
+        # Verify waitress keeps connections alive (werkzeug always closes them), so pooling clients can reuse them
+        with requests.Session() as session:
+            for _ in range(3):
+                response = session.post(url, json={"sql-query": query})
+                assert response.json() == PostDummy(query)
+                assert (response.headers.get('Connection') != 'close') == (backend == 'waitress')
+    finally:
+        web.stop()
+    assert web.ready is False
+
+    # Verify unknown backends are refused
+    with pytest.raises(ValueError):
+        api.SQLRestAPI(backend='gunicorn', start=False)
+
+
+def test_SQLRestAPI_readiness_and_health(SQLRestAPI_resource):
+    calls = []
+    web = SQLRestAPI_resource
+    web.getcall = lambda: calls.append('GET') or GetDummy()
+    web.endpoint = ENDPOINT
+
+    # Verify start returns as soon as the server is bound, without calling the endpoint
+    start = time.time()
+    web.start()
+    assert time.time() - start < 1
+    assert web.ready is True
+    assert calls == []
+
+    # Verify the health check responds without calling 'getcall'
+    response = requests.get(f'http://localhost:{web.port}/{web.health_endpoint}')
+    assert response.status_code == 200
+    assert response.json() == {'status': 'ok'}
+    assert calls == []
+    assert requests.get(f'http://localhost:{web.port}/{web.endpoint}').json() == GetDummy()
+    assert calls == ['GET']
+
+    # Verify a server that can not bind its port fails fast instead of timing out
+    other = api.SQLRestAPI(port=web.port, getcall=GetDummy, postcall=PostDummy, start=False)
+    with pytest.raises(RuntimeError):
+        other.start(timeout=10)
+    assert other.ready is False
+
+
+def test_DataFrameAPI_processes():
+    test_api = api.DataFrameAPI(dataframe=pd.DataFrame({"number": range(1000)}), dbname='Numbers', enable_web=False,
+                                processes=2, query_timeout=2, cache_size=0)
+    query = "SELECT COUNT(*) AS cnt, SUM(number) AS total FROM Numbers;"
+
+    # Verify queries in the worker processes follow all kinds of updates
+    assert test_api.query(query) == {'cnt': {0: 1000}, 'total': {0: 499500}}
+    test_api['Numbers'] = pd.DataFrame({"number": range(10)})
+    assert test_api.query(query) == {'cnt': {0: 10}, 'total': {0: 45}}
+    test_api.append('Numbers', pd.DataFrame({"number": [100]}))
+    test_api.upsert('Numbers', pd.DataFrame({"number": [0, 200]}), key='number')
+    assert test_api.query(query) == {'cnt': {0: 12}, 'total': {0: 345}}
+    for number in range(1000, 1100):
+        test_api.append('Numbers', pd.DataFrame({"number": [number]}))
+    assert test_api.query(query) == {'cnt': {0: 112}, 'total': {0: 345 + sum(range(1000, 1100))}}
+    test_api['Other'] = pd.DataFrame({"number": [1]})
+    del test_api['Numbers']
+    assert 'error' in test_api.query(query)
+    assert test_api.query("SELECT * FROM Other;") == {'number': {0: 1}}
+
+    # Verify a slow query (a huge cross join) is interrupted and the workers still respond afterwards
+    test_api['Numbers'] = pd.DataFrame({"number": range(1000)})
+    start = time.time()
+    with pytest.raises(TimeoutError):
+        test_api.query_dataframe("SELECT COUNT(*) FROM Numbers a, Numbers b, Numbers c;")
+    assert time.time() - start < 5
+    assert test_api.query(query) == {'cnt': {0: 1000}, 'total': {0: 499500}}
+
+
+def test_DataFrameAPI_query_limits():
+    test_api = api.DataFrameAPI(dataframe=pd.DataFrame({"number": range(1000)}), dbname='Numbers', port=PORT,
+                                endpoint=ENDPOINT, query_timeout=1, max_rows=100, cache_size=0)
+    url = f"http://localhost:{PORT}/{ENDPOINT}"
+    try:
+        # Verify a slow query is interrupted in the request thread
+        start = time.time()
+        with pytest.raises(api.QueryTimeoutError):
+            test_api.query_dataframe("SELECT COUNT(*) FROM Numbers a, Numbers b, Numbers c;")
+        assert time.time() - start < 3
+        response = requests.post(url, json={"sql-query": "SELECT COUNT(*) FROM Numbers a, Numbers b, Numbers c;"})
+        assert response.status_code == 408 and response.json()['limit'] == 'query_timeout'
+
+        # Verify the row and byte limits
+        assert len(test_api.query_dataframe("SELECT * FROM Numbers WHERE number < 100;")) == 100
+        response = requests.post(url, json={"sql-query": "SELECT * FROM Numbers;"})
+        assert response.status_code == 413 and response.json()['limit'] == 'max_rows'
+        test_api.max_bytes = 100
+        with pytest.raises(api.QueryLimitError) as error:
+            test_api.query_dataframe("SELECT * FROM Numbers WHERE number < 100;")
+        assert error.value.limit == 'max_bytes'
+        assert len(test_api.query_dataframe("SELECT * FROM Numbers WHERE number < 10;")) == 10
+
+        # Verify the limits apply to cached results and to streamed queries
+        test_api.max_bytes, test_api.cache.maxsize = None, 16
+        assert len(test_api.query_dataframe("SELECT * FROM Numbers WHERE number < 50;")) == 50
+        test_api.max_rows = 20
+        with pytest.raises(api.QueryLimitError):
+            test_api.query_dataframe("SELECT * FROM Numbers WHERE number < 50;")
+        with pytest.raises(api.QueryLimitError):
+            list(test_api.query_chunks("SELECT * FROM Numbers;", chunksize=10))
+        response = requests.post(url, json={"sql-query": "SELECT * FROM Numbers;", "stream": True})
+        assert response.status_code == 413 and response.json()['limit'] == 'max_rows'
+    finally:
+        test_api.web.stop()
+
+
+def test_SQLRestAPI_metrics():
+    test_api = api.DataFrameAPI(dataframe=pd.DataFrame({"number": range(50)}), dbname='Numbers', port=PORT,
+                                endpoint=ENDPOINT)
+    url = f"http://localhost:{PORT}/{ENDPOINT}"
+    metrics = test_api.web.metrics
+    try:
+        assert requests.post(url, json={"sql-query": "SELECT * FROM Numbers;", "format": "csv"}).status_code == 200
+        assert requests.post(url, json={"sql-query": "SELECT * FROM Missing;"}).status_code == 400
+        requests.get(f"http://localhost:{PORT}/health")
+
+        # Verify requests to the endpoint are counted and timed per stage (the health check is not measured)
+        assert metrics.value('singupy_requests_total', method='POST', status=200) == 1
+        assert metrics.value('singupy_requests_total', method='POST', status=400) == 1
+        assert metrics.value('singupy_requests_total', method='GET', status=200) is None
+        assert metrics.value('singupy_query_errors_total', type='LookupError') == 1
+        for stage in ['parse', 'query', 'serialize', 'send', 'total']:
+            assert metrics.value('singupy_request_duration_seconds', stage=stage) >= 1
+        assert metrics.value('singupy_result_rows') == 1
+        assert metrics.value('singupy_requests_in_flight') == 0
+
+        # Verify the metrics endpoint renders the Prometheus text format, including the dataframe sizes
+        response = requests.get(f"http://localhost:{PORT}/metrics")
+        assert response.headers['content-type'].startswith('text/plain')
+        assert '# TYPE singupy_request_duration_seconds histogram' in response.text
+        assert 'singupy_request_duration_seconds_count{stage="query"} 1' in response.text
+        assert 'singupy_result_rows_bucket{le="100"} 1' in response.text
+        assert 'singupy_dataframe_rows{dataframe="Numbers"} 50' in response.text
+    finally:
+        test_api.web.stop()
+
+
+def test_DataFrameAPI_slow_query_log():
+    test_api = api.DataFrameAPI(dataframe=pd.DataFrame({"number": range(1000)}), dbname='Numbers', port=PORT,
+                                endpoint=ENDPOINT, slow_query_threshold=60, slow_query_log_size=2, cache_size=0,
+                                fast_path=False)
+    try:
+        # Verify fast queries are not recorded
+        test_api.query_dataframe("SELECT * FROM Numbers WHERE number < 10;")
+        assert len(test_api.slow_queries) == 0
+
+        # Verify slow (and failed) queries are recorded with their stages and query plan
+        test_api.slow_query_threshold = 0
+        test_api.explain_slow_queries = True
+        test_api.query_dataframe("SELECT   * FROM Numbers  WHERE number < 10;")
+        with pytest.raises(LookupError):
+            test_api.query_dataframe("SELECT * FROM Missing;")
+        first, second = test_api.slow_queries
+        assert first['query'] == "SELECT * FROM Numbers WHERE number < 10;"
+        assert first['tables'] == {'Numbers': 1000} and first['rows'] == 10 and first['error'] is None
+        assert set(first['stages']) == {'cache', 'query', 'check'}
+        assert any('SCAN' in step for step in first['plan'])
+        assert second['tables'] == {} and second['rows'] is None and 'no such table' in second['error']
+
+        # Verify the log is bounded, served on the slow query route and profiled queries include their profile
+        test_api.slow_query_threshold = None
+        test_api.profile_rate = 1
+        test_api.query_dataframe("SELECT COUNT(*) FROM Numbers;")
+        response = requests.get(f"http://localhost:{PORT}/slow-queries").json()
+        assert response['threshold'] is None
+        assert [entry['query'] for entry in response['queries']] == ["SELECT * FROM Missing;", "SELECT COUNT(*) FROM Numbers;"]
+        assert 'cumulative' in response['queries'][-1]['profile']
+
+        # Verify concurrent profiled queries do not fail (only one profiler can be active on Python 3.12+)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda number: test_api.query_dataframe(
+                f"SELECT COUNT(*) AS count FROM Numbers a, Numbers b WHERE a.number < {number};"), range(8)))
+        assert [result['count'][0] for result in results] == [number * 1000 for number in range(8)]
+    finally:
+        test_api.web.stop()
+
+
+def test_DataFrameAPI_indexes():
+    lines = pd.DataFrame({"station": [f"S{number % 100}" for number in range(1000)], "bay": range(1000),
+                          "kv": [400, 150] * 500})
+    test_api = api.DataFrameAPI(dataframe=lines, dbname='Lines', enable_web=False, cache_size=0, fast_path=False,
+                                explain_slow_queries=True, slow_query_threshold=0, indexes={'Lines': ['station']})
+
+    def plan(query):
+        test_api.query_dataframe(query)
+        return ' '.join(test_api.slow_queries[-1]['plan'])
+
+    # Verify declared indexes are used, listed in the metadata and rebuilt when the dataframe is replaced
+    assert 'USING INDEX' in plan("SELECT * FROM Lines WHERE station = 'S1';")
+    assert test_api.metadata()['dataframes']['Lines']['indexes'] == [['station']]
+    test_api['Lines'] = lines
+    assert 'USING INDEX' in plan("SELECT * FROM Lines WHERE station = 'S1';")
+    assert len(test_api.query_dataframe("SELECT * FROM Lines WHERE station = 'S1';")) == 10
+
+    # Verify indexes can be added later, also on several columns
+    test_api.add_index('Lines', ['kv', 'bay'])
+    assert 'USING INDEX' in plan("SELECT * FROM Lines WHERE kv = 400 AND bay < 10;")
+
+    # Verify columns compared in enough queries are indexed automatically
+    test_api.auto_index = True
+    test_api.auto_index_threshold = 2
+    assert 'USING INDEX' not in plan("SELECT * FROM Lines WHERE bay = 5;")
+    plan("SELECT * FROM Lines WHERE bay BETWEEN 1 AND 3;")
+
+    # The index is built in the background
+    deadline = time.time() + 5
+    while 'USING INDEX' not in plan("SELECT * FROM Lines WHERE bay = 5;") and time.time() < deadline:
+        time.sleep(0.05)
+    assert ['bay'] in test_api.indexes('Lines')
+    assert 'USING INDEX' in plan("SELECT * FROM Lines WHERE bay = 5;")
+    assert test_api.query_dataframe("SELECT kv FROM Lines WHERE bay = 5;")['kv'].tolist() == [150]
+
+
+def test_DataFrameAPI_fast_path():
+    lines = pd.DataFrame({"id": range(2000), "station": [f"S{number % 50}" for number in range(2000)],
+                          "value": [None if number % 7 == 0 else number / 3 for number in range(2000)]})
+    fast_api = api.DataFrameAPI(dataframe=lines, dbname='Lines', enable_web=False, cache_size=0, slow_query_threshold=0)
+    sqlite_api = api.DataFrameAPI(dataframe=lines, dbname='Lines', enable_web=False, cache_size=0, fast_path=False)
+
+    # Verify simple queries are answered by pandas with the same result as SQLite
+    for query in ["SELECT * FROM Lines;",
+                  "SELECT id, station AS name FROM lines WHERE station = 'S3' AND id >= 500;",
+                  "SELECT id FROM Lines WHERE station IN ('S1', 'S2') AND value BETWEEN 10 AND 300;",
+                  "SELECT id, value FROM Lines WHERE id < 900 ORDER BY value DESC LIMIT 20 OFFSET 5;",
+                  "SELECT id, value FROM Lines ORDER BY value LIMIT 10;",
+                  "SELECT * FROM Lines WHERE value > 100 LIMIT 15;",
+                  "SELECT station, id FROM Lines ORDER BY station DESC, id LIMIT 30;"]:
+        result = fast_api.query_dataframe(query)
+        assert fast_api.slow_queries[-1]['source'] == 'pandas'
+        expected = sqlite_api.query_dataframe(query)
+        assert result.astype(object).where(result.notna(), None).values.tolist() == \
+            expected.astype(object).where(expected.notna(), None).values.tolist()
+        assert list(result.columns) == list(expected.columns)
+
+    # Verify other queries fall back to SQLite
+    for query in ["SELECT station, COUNT(*) FROM Lines GROUP BY station;", "SELECT * FROM Lines WHERE station > 5;"]:
+        fast_api.query_dataframe(query)
+        assert fast_api.slow_queries[-1]['source'] == 'sqlite'
+
+    # Verify each clause of the simple queries is parsed on its own
+    assert api._parse_select_list(api._tokenize("*")) is None
+    assert api._parse_select_list(api._tokenize('Id, "Station" AS Name')) == (('id', None), ('station', 'Name'))
+    assert api._parse_where(api._tokenize("WHERE a <> 'x' AND b NOT IN (1, 2.5) AND c BETWEEN -1 AND 1")) == \
+        (('a', '!=', ('x',)), ('b', 'not in', (1, 2.5)), ('c', 'between', (-1, 1)))
+    assert api._parse_where(api._tokenize("LIMIT 1")) == ()
+    assert api._parse_order_by(api._tokenize("ORDER BY a DESC, b ASC, c")) == (('a', False), ('b', True), ('c', True))
+    assert api._parse_limit(api._tokenize("LIMIT 10 OFFSET 5")) == (10, 5)
+    for clause, parser in [("WHERE a LIKE 'x'", api._parse_where), ("WHERE a = b", api._parse_where),
+                           ("LIMIT 1.5", api._parse_limit), ("LIMIT -1", api._parse_limit)]:
+        with pytest.raises(ValueError):
+            parser(api._tokenize(clause))
+    assert api._parse_simple_select("SELECT * FROM Lines WHERE id = 1 extra;") is None
+
+
+def test_DataFrameAPI_snapshots(tmp_path):
+    lines = pd.DataFrame({"station": ["S1", "S2", "S3"], "kv": [400, 150, 132], "load": [0.5, None, 1.5]})
+    stations = pd.DataFrame({"name": ["Station 1", "Station 2"]}, index=pd.Index(["S1", "S2"], name="station"))
+    test_api = api.DataFrameAPI(dataframe=lines, dbname='Lines', enable_web=False, indexes={'Lines': ['station']})
+    test_api['Stations'] = stations
+
+    # Verify a snapshot is loaded at startup, including the engine and the declared indexes
+    manifest = test_api.save_snapshot(str(tmp_path))
+    assert set(manifest['dataframes']) == {'Lines', 'Stations'}
+    restored = api.DataFrameAPI(enable_web=False, snapshot_path=str(tmp_path))
+    assert restored['Lines'].equals(lines) and restored['Stations'].equals(stations)
+    assert restored.indexes('Lines') == [['station']]
+    assert restored.metadata()['dataframes']['Lines']['updated'] == test_api.metadata()['dataframes']['Lines']['updated']
+    assert restored.query_dataframe("SELECT s.name FROM Lines l JOIN Stations s ON l.station = s.station " +
+                                    "WHERE l.kv = 150;")['name'].tolist() == ['Station 2']
+
+    # Verify unchanged dataframes are not written again and files of earlier snapshots are removed
+    test_api.append('Lines', pd.DataFrame({"station": ["S4"], "kv": [60], "load": [2.0]}))
+    files = test_api.save_snapshot(str(tmp_path))['dataframes']
+    assert files['Stations']['file'] == manifest['dataframes']['Stations']['file']
+    assert files['Lines']['file'] != manifest['dataframes']['Lines']['file']
+    assert len([file for file in tmp_path.iterdir() if file.suffix == '.arrow']) == 2
+
+    # Verify loading into an API with dataframes replaces only the dataframes of the snapshot
+    restored['Other'] = lines
+    assert restored.load_snapshot(str(tmp_path)) == ['Lines', 'Stations']
+    assert len(restored.query_dataframe("SELECT * FROM Lines;")) == 4 and 'Other' in restored
+
+    # Verify names that are the same when sanitised for the file system are saved to separate files
+    colliding = api.DataFrameAPI(enable_web=False)
+    colliding['a b'], colliding['a_b'] = lines.iloc[:1], lines.iloc[1:]
+    files = colliding.save_snapshot(str(tmp_path / 'colliding'))['dataframes']
+    assert files['a b']['file'] != files['a_b']['file']
+    restored_colliding = api.DataFrameAPI(enable_web=False, snapshot_path=str(tmp_path / 'colliding'))
+    assert restored_colliding['a b'].equals(lines.iloc[:1]) and restored_colliding['a_b'].equals(lines.iloc[1:])
+
+    # Verify periodic snapshots are saved when a dataframe changes
+    restored.snapshot_path, restored.snapshot_interval = str(tmp_path), 0.1
+    restored.start_snapshots()
+    restored['Lines'] = lines.head(1)
+    time.sleep(0.5)
+    restored.stop_snapshots()
+    assert len(api.DataFrameAPI(enable_web=False, snapshot_path=str(tmp_path))['Lines']) == 1
+    with pytest.raises(FileNotFoundError):
+        restored.load_snapshot(str(tmp_path / 'missing'))
+
+
+def test_DataFrameAPI_transaction():
+    test_api = api.DataFrameAPI(enable_web=False, cache_size=0)
+    test_api['Lines'] = pd.DataFrame({"station": ["S1", "S2"], "kv": [400, 150]})
+    test_api['Stations'] = pd.DataFrame({"station": ["S1", "S2"], "name": ["Station 1", "Station 2"]})
+    join = "SELECT l.kv, s.name FROM Lines l JOIN Stations s ON l.station = s.station ORDER BY l.kv;"
+
+    def query_in_thread(query):
+        results = []
+        thread = threading.Thread(target=lambda: results.append(test_api.query_dataframe(query)))
+        thread.start()
+        thread.join(timeout=5)
+        return results[0]
+
+    # Verify queries (also from other threads) do not wait for - or see - a transaction until it ends
+    with test_api.transaction():
+        test_api['Lines'] = pd.DataFrame({"station": ["S3"], "kv": [132]})
+        test_api.append('Stations', pd.DataFrame({"station": ["S3"], "name": ["Station 3"]}))
+        assert test_api['Lines']['kv'].tolist() == [132]
+        assert query_in_thread(join)['kv'].tolist() == [150, 400]
+        assert query_in_thread("SELECT kv FROM Lines;")['kv'].tolist() == [400, 150]
+    assert query_in_thread(join)['name'].tolist() == ["Station 3"]
+
+    # Verify nothing is changed if the transaction fails
+    with pytest.raises(ValueError):
+        with test_api.transaction():
+            test_api['Lines'] = None
+            test_api.upsert('Stations', pd.DataFrame({"station": ["S3"], "name": ["Renamed"]}), key='station')
+            raise ValueError("Failed update")
+    assert test_api.query_dataframe(join)['name'].tolist() == ["Station 3"]
+    assert test_api['Stations']['name'].tolist() == ["Station 1", "Station 2", "Station 3"]
+
+
+def test_SQLRestAPI_compression_and_etags():
+    test_api = api.DataFrameAPI(dataframe=pd.DataFrame({"number": range(1000)}), dbname='Numbers', port=PORT,
+                                endpoint=ENDPOINT)
+    url = f"http://localhost:{PORT}/{ENDPOINT}"
+    query = {"sql-query": "SELECT * FROM Numbers;", "format": "records"}
+    try:
+        # Verify large responses (and streams) are compressed when accepted, but small ones are not
+        response = requests.post(url, json=query)
+        assert response.headers['Content-Encoding'] == 'gzip' and len(response.json()) == 1000
+        assert 'Accept-Encoding' in response.headers['Vary']
+        response = requests.post(url, json={**query, "format": "ndjson", "stream": True})
+        assert response.headers['Content-Encoding'] == 'gzip' and len(response.text.split()) == 1000
+        response = requests.post(url, json={**query, "sql-query": "SELECT * FROM Numbers LIMIT 2;"})
+        assert 'Content-Encoding' not in response.headers
+        assert 'Content-Encoding' not in requests.post(url, json=query, headers={'Accept-Encoding': 'identity'}).headers
+        if 'zstd' in api.supported_encodings():
+            import zstandard
+
+            response = requests.post(url, json=query, headers={'Accept-Encoding': 'zstd, gzip'}, stream=True)
+            content = zstandard.ZstdDecompressor().decompress(response.raw.read(decode_content=False))
+            assert response.headers['Content-Encoding'] == 'zstd' and content.startswith(b'[{"number":0}')
+
+        # Verify clients sending back the ETag get a '304 Not Modified' until the dataframe is changed
+        metadata = requests.get(url)
+        result = requests.post(url, json=query)
+        assert metadata.headers['ETag'].startswith('W/') and result.headers['ETag'] != metadata.headers['ETag']
+        assert requests.get(url, headers={'If-None-Match': metadata.headers['ETag']}).status_code == 304
+        response = requests.post(url, json=query, headers={'If-None-Match': result.headers['ETag']})
+        assert response.status_code == 304 and response.content == b''
+        assert requests.post(url, json={**query, "format": "csv"},
+                             headers={'If-None-Match': result.headers['ETag']}).status_code == 200
+        test_api['Numbers'] = pd.DataFrame({"number": range(10)})
+        assert requests.get(url, headers={'If-None-Match': metadata.headers['ETag']}).status_code == 200
+        response = requests.post(url, json=query, headers={'If-None-Match': result.headers['ETag']})
+        assert response.status_code == 200 and len(response.json()) == 10
+        assert test_api.etag("DROP TABLE Numbers;") is None
+    finally:
+        test_api.web.stop()
+
+
+def test_SQLRestAPI_endpoints():
+    server = api.SQLRestAPI(port=PORT, endpoint='', start=False, workers=4)
+    lines = api.DataFrameAPI(dataframe=pd.DataFrame({"kv": [400, 150]}), dbname='Lines', endpoint='lines',
+                             server=server)
+    stations = api.DataFrameAPI(dataframe=pd.DataFrame({"name": ["S1"]}), dbname='Stations', endpoint='stations',
+                                server=server)
+    server.add_endpoint('dummy', getcall=GetDummy, postcall=PostDummy)
+    with pytest.raises(ValueError):
+        api.DataFrameAPI(endpoint='lines', server=server)
+    assert server.endpoints == ['', 'lines', 'stations', 'dummy'] and lines.web is server
+    assert not server.ready
+
+    url = f"http://localhost:{PORT}"
+    server.start()
+    try:
+        # Verify each endpoint is served by its own functions on the shared server
+        assert requests.get(f"{url}/lines").json()['dataframes'].keys() == {'Lines'}
+        assert requests.post(f"{url}/lines", json={"sql-query": "SELECT * FROM Lines;"}).json() == \
+            {'kv': {'0': 400, '1': 150}}
+        assert requests.post(f"{url}/stations", json={"sql-query": "SELECT * FROM Lines;"}).status_code == 400
+        assert requests.post(f"{url}/stations", json={"sql-query": "SELECT * FROM Stations;"}).status_code == 200
+        assert requests.get(f"{url}/dummy").json() == GetDummy()
+        assert requests.get(f"{url}/lines/slow-queries").status_code == 200
+
+        # Verify requests to all endpoints are measured and the dataframe metrics are labeled with their endpoint
+        assert server.metrics.value('singupy_requests_total', method='POST', status=200) == 2
+        metrics = requests.get(f"{url}/metrics").text
+        assert metrics.count('# TYPE singupy_dataframe_rows gauge') == 1
+        assert 'singupy_dataframe_rows{dataframe="Stations",endpoint="stations"} 1' in metrics
+        with pytest.raises(AttributeError):
+            server.add_endpoint('more', getcall=GetDummy)
+    finally:
+        server.stop()
+    assert stations.query("SELECT COUNT(*) AS cnt FROM Stations;") == {'cnt': {0: 1}}
+
+
+def test_DataFrameAPI_prepared_statements():
+    test_api = api.DataFrameAPI(dataframe=pd.DataFrame({"station": ["S1", "S2", "S2"], "kv": [400, 150, 132]}),
+                                dbname='Lines', port=PORT, endpoint=ENDPOINT)
+    url = f"http://localhost:{PORT}/{ENDPOINT}"
+    try:
+        # Verify parameters are bound to the placeholders of a query (and are part of the cache key)
+        query = "SELECT kv FROM Lines WHERE station = ? ORDER BY kv;"
+        assert test_api.query_dataframe(query, params=["S2"])['kv'].tolist() == [132, 150]
+        assert test_api.query_dataframe(query, params=["S1"])['kv'].tolist() == [400]
+        assert test_api.query("SELECT kv FROM Lines WHERE kv > :kv;", params={"kv": 140}) == {'kv': {0: 400, 1: 150}}
+        response = requests.post(url, json={"sql-query": query, "params": ["S2"], "format": "records"})
+        assert response.json() == [{"kv": 132}, {"kv": 150}]
+        assert requests.post(url, json={"sql-query": query, "params": "S2"}).status_code == 400
+        assert requests.post(url, json={"sql-query": query, "params": []}).status_code == 400
+
+        # Verify prepared statements are validated once and run by name with different parameters
+        test_api.prepare('by_station', query)
+        with pytest.raises(PermissionError):
+            test_api.prepare('drop', "DROP TABLE Lines;")
+        assert test_api.statements == {'by_station': query}
+        assert requests.get(url).json()['statements'] == {'by_station': query}
+        assert test_api.query_dataframe(statement='by_station', params=["S1"])['kv'].tolist() == [400]
+        response = requests.post(url, json={"statement": "by_station", "params": ["S2"], "format": "records"})
+        assert response.json() == [{"kv": 132}, {"kv": 150}]
+        response = requests.post(url, json={"statement": "by_station", "params": ["S2"], "stream": True})
+        assert len(response.text.split()) == 2
+        first = requests.post(url, json={"statement": "by_station", "params": ["S1"]}).headers['ETag']
+        assert requests.post(url, json={"statement": "by_station", "params": ["S2"]}).headers['ETag'] != first
+        assert requests.post(url, json={"statement": "missing"}).status_code == 400
+        with pytest.raises(ValueError):
+            test_api.query_dataframe(query, statement='by_station')
+        test_api.prepare('by_station', None)
+        with pytest.raises(LookupError):
+            test_api.query_dataframe(statement='by_station', params=["S1"])
+    finally:
+        test_api.web.stop()
+
+
+def test_DataFrameAPI_metadata_stats():
+    lines = pd.DataFrame({"station": ["S1", "S2", "S3"], "kv": [400, 150, 132], "load": [0.5, None, 1.5]})
+    test_api = api.DataFrameAPI(dataframe=lines, dbname='Lines', enable_web=False, column_stats=True)
+
+    # Verify the statistics are provided together with the columns and rowcount
+    metadata = test_api.metadata()['dataframes']['Lines']
+    assert metadata['dtypes'] == {'station': str(lines['station'].dtype), 'kv': 'int64', 'load': 'float64'}
+    assert metadata['memory'] == lines.memory_usage(index=False).sum()
+    assert metadata['min'] == {'station': 'S1', 'kv': 132, 'load': 0.5}
+    assert metadata['max'] == {'station': 'S3', 'kv': 400, 'load': 1.5}
+
+    # Verify the statistics are updated from appended rows, and computed again after an upsert
+    updated = metadata['updated']
+    test_api.append('Lines', pd.DataFrame({"station": ["S0"], "kv": [60], "load": [None]}))
+    metadata = test_api.metadata()['dataframes']['Lines']
+    assert metadata['rowcount'] == 4 and metadata['updated'] > updated
+    assert metadata['memory'] == test_api['Lines'].memory_usage(index=False).sum()
+    assert metadata['min'] == {'station': 'S0', 'kv': 60, 'load': 0.5}
+    test_api.upsert('Lines', pd.DataFrame({"station": ["S1"], "kv": [450], "load": [3.5]}), key='station')
+    metadata = test_api.metadata()['dataframes']['Lines']
+    assert metadata['rowcount'] == 4 and metadata['max'] == {'station': 'S3', 'kv': 450, 'load': 3.5}
+
+    # Verify the minimum and maximum are left out unless enabled
+    test_api.column_stats = False
+    assert 'min' not in test_api.metadata()['dataframes']['Lines']
+    assert json.dumps(test_api.metadata())
+
+
+def test_DataFrameAPI_subscriptions():
+    lines = pd.DataFrame({"station": ["S1", "S2"], "kv": [400, 150]})
+    test_api = api.DataFrameAPI(dataframe=lines, dbname='Lines', enable_web=False, subscription_heartbeat=0.1)
+
+    # Verify the full result is sent first, and changes of other dataframes only give heartbeats
+    events = test_api.subscribe("SELECT station, kv FROM Lines WHERE kv > 100;", key='station')
+    event, data = next(events)
+    assert event == 'snapshot' and data['rows'].equals(lines)
+    test_api['Other'] = lines
+    assert next(events) == (None, None)
+
+    # Verify only added/changed rows are sent, and rows leaving the result are sent as their key
+    test_api.append('Lines', pd.DataFrame({"station": ["S3"], "kv": [132]}))
+    event, data = next(events)
+    assert event == 'update' and data['rows'].to_dict('records') == [{"station": "S3", "kv": 132}]
+    assert data['deleted'].empty
+    test_api.upsert('Lines', pd.DataFrame({"station": ["S1", "S2"], "kv": [450, 50]}), key='station')
+    event, data = next(events)
+    assert data['rows'].to_dict('records') == [{"station": "S1", "kv": 450}]
+    assert data['deleted'].to_dict('records') == [{"station": "S2"}]
+
+    # Verify changed rows are sent as removed and added without a key
+    plain = test_api.subscribe("SELECT * FROM Lines WHERE kv < 200;")
+    next(plain)
+    test_api.upsert('Lines', pd.DataFrame({"station": ["S3"], "kv": [133]}), key='station')
+    event, data = next(plain)
+    assert data['rows'].to_dict('records') == [{"station": "S3", "kv": 133}]
+    assert data['deleted'].to_dict('records') == [{"station": "S3", "kv": 132}]
+
+    # Verify a subscription ends with an error if the query fails after a change, and invalid queries are raised
+    test_api['Lines'] = None
+    assert next(events)[0] == 'error'
+    with pytest.raises(StopIteration):
+        next(events)
+    with pytest.raises(PermissionError):
+        next(test_api.subscribe("DROP TABLE Lines;"))
+    with pytest.raises(ValueError):
+        next(test_api.subscribe("SELECT * FROM Other;", key='missing'))
+
+
+def test_DataFrameAPI_subscription_workers():
+    lines = pd.DataFrame({"station": ["S1", "S2"], "kv": [400, 150]})
+    test_api = api.DataFrameAPI(dataframe=lines, dbname='Lines', port=PORT, endpoint=ENDPOINT, workers=2,
+                                subscription_heartbeat=0.2)
+    url = f"http://localhost:{PORT}/{ENDPOINT}"
+    subscription = {"sql-query": "SELECT * FROM Lines;", "subscribe": True}
+    try:
+        # Verify a subscription holds at most all workers but one, so other requests are still served
+        assert test_api.web.max_subscriptions == 1
+        first = requests.post(url, json=subscription, stream=True, timeout=5)
+        assert first.status_code == 200 and next(first.iter_lines()).startswith(b'event: snapshot')
+        rejected = requests.post(url, json=subscription, timeout=5)
+        assert rejected.status_code == 503 and 'Too many subscriptions' in rejected.json()['error']
+        assert requests.get(f"http://localhost:{PORT}/health", timeout=5).json() == {'status': 'ok'}
+
+        # Verify the worker is released when the client is gone (noticed at the next heartbeat)
+        first.close()
+        start = time.time()
+        while (second := requests.post(url, json=subscription, stream=True, timeout=5)).status_code == 503:
+            assert time.time() - start < 15
+            time.sleep(0.1)
+    finally:
+        # Verify stopping the webservice ends open subscriptions at once instead of waiting for their heartbeat
+        start = time.time()
+        test_api.web.stop()
+        assert time.time() - start < 5
+    assert second.content.startswith(b'event: snapshot')
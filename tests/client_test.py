@@ -0,0 +1,90 @@
+import pytest
+import logging
+import asyncio
+import requests
+import pandas as pd
+from singupy import api, client
+
+log = logging.getLogger(__name__)
+
+# Constants for tests
+PORT = 5030
+ENDPOINT = 'dataframe'
+
+
+@pytest.fixture
+def DataFrameAPI_resource():
+    # Use fixture to make sure web service is taken down after testing
+    my_api = api.DataFrameAPI(pd.DataFrame({"name": ["tom", "jerry"], "age": [80, 82]}), dbname='MiniData',
+                              port=PORT, endpoint=ENDPOINT)
+    yield my_api
+
+    # Clean up after test (make sure web gets taken down)
+    if my_api.web.thread.is_alive():
+        my_api.web.stop()
+
+
+def test_SQLClient(DataFrameAPI_resource):
+    mini_df = DataFrameAPI_resource['MiniData']
+    url = f'http://localhost:{PORT}/{ENDPOINT}'
+
+    with client.SQLClient(url) as sql_client:
+        # Verify metadata is cached (and kept when refreshed while unchanged) and the most efficient format is negotiated
+        assert sql_client.metadata() is sql_client.metadata()
+        assert sql_client.metadata(refresh=True) is sql_client.metadata()
+        assert 'MiniData' in sql_client.metadata()['dataframes']
+        assert sql_client.format == next(fmt for fmt in client.PREFERRED_FORMATS if fmt in api.supported_formats())
+
+        # Verify queries return dataframes - also when sent concurrently
+        assert sql_client.query("SELECT * FROM MiniData;").equals(mini_df)
+        results = sql_client.query_many([f"SELECT * FROM MiniData WHERE age = {age};" for age in (80, 82)])
+        assert [result.loc[0, 'name'] for result in results] == ['tom', 'jerry']
+        assert sql_client.query("SELECT name FROM MiniData WHERE age = ?;", params=[82])['name'].tolist() == ['jerry']
+
+        # Verify errors from the server are raised with the message
+        with pytest.raises(requests.HTTPError, match='does not exist'):
+            sql_client.query("SELECT * FROM Missing;")
+
+    # Verify all formats decode to the same dataframe
+    for fmt in api.supported_formats():
+        with client.SQLClient(url, format=fmt) as sql_client:
+            assert sql_client.query("SELECT * FROM MiniData;").equals(mini_df), fmt
+
+
+def test_SQLClient_subscribe(DataFrameAPI_resource):
+    url = f'http://localhost:{PORT}/{ENDPOINT}'
+
+    with client.SQLClient(url) as sql_client:
+        # Verify the full result is received first and then only the changed rows
+        events = sql_client.subscribe("SELECT * FROM MiniData;", key='name')
+        event, data = next(events)
+        assert event == 'snapshot' and data['rows'].equals(DataFrameAPI_resource['MiniData'])
+        DataFrameAPI_resource.upsert('MiniData', pd.DataFrame({"name": ["tom"], "age": [81]}), key='name')
+        event, data = next(events)
+        assert event == 'update' and data['rows'].to_dict('records') == [{"name": "tom", "age": 81}]
+        events.close()
+
+        # Verify errors from the server are raised with the message
+        with pytest.raises(requests.HTTPError, match='missing'):
+            next(sql_client.subscribe("SELECT * FROM MiniData;", key='missing'))
+
+    # Verify browsers (EventSource) can subscribe with a 'GET'
+    response = requests.get(url, params={'sql-query': "SELECT name FROM MiniData;"}, stream=True, timeout=5)
+    assert response.headers['Content-Type'].startswith('text/event-stream')
+    assert next(response.iter_lines(chunk_size=1)) == b'event: snapshot'
+    response.close()
+
+
+def test_AsyncSQLClient(DataFrameAPI_resource):
+    mini_df = DataFrameAPI_resource['MiniData']
+
+    async def run_queries():
+        async with client.AsyncSQLClient(f'http://localhost:{PORT}/{ENDPOINT}') as sql_client:
+            assert 'MiniData' in (await sql_client.metadata())['dataframes']
+            single = await sql_client.query("SELECT * FROM MiniData;")
+            many = await sql_client.query_many(["SELECT * FROM MiniData;"] * 10)
+            return single, many
+
+    single, many = asyncio.run(run_queries())
+    assert single.equals(mini_df)
+    assert len(many) == 10 and all(result.equals(mini_df) for result in many)
@@ -1,6 +1,8 @@
 import pytest
 import logging
-from singupy.conversion import kv_to_letter
+import numpy as np
+import pandas as pd
+from singupy.conversion import kv_to_letter, kv_to_letters
 
 log = logging.getLogger(__name__)
 
@@ -26,3 +28,23 @@ def test_kv_to_letter():
     # Check raise error in case bad value is sent
     with pytest.raises(ValueError):
         kv_to_letter("fejl")
+
+
+def test_kv_to_letters():
+    # Check the vectorized version gives the same letters as the scalar version, including edges and truncation
+    values = [0, 0.5, 1, 5.9, 6, 10, 20, 33, 45, 60, 110, 132, 220, 380, 400, 419.9, 420, 1000, -3, "380"]
+    assert kv_to_letters(values).tolist() == [kv_to_letter(kv) for kv in values]
+
+    # Check series keep their index and name, and arrays work as well
+    series = pd.Series([400, 150], index=[7, 9], name='kv')
+    result = kv_to_letters(series)
+    assert result.dtype == 'category'
+    assert result.index.tolist() == [7, 9] and result.name == 'kv'
+    assert kv_to_letters(np.array([10, 60])).tolist() == ['K', 'F']
+
+    # Check invalid values raise an error or are coerced to NaN
+    with pytest.raises(ValueError):
+        kv_to_letters([400, "fejl"])
+    with pytest.raises(ValueError):
+        kv_to_letters([400, np.nan])
+    assert kv_to_letters([400, "fejl", None], errors='coerce').isna().tolist() == [False, True, True]
@@ -0,0 +1,39 @@
+import pytest
+import subprocess
+import sys
+import singupy
+
+# Dependencies that are slow to import - only the modules needing them may load them
+HEAVY_MODULES = ['numpy', 'pandas', 'flask', 'flask_restful', 'werkzeug', 'requests', 'sqlalchemy', 'pandasql']
+
+
+def import_in_subprocess(statement: str) -> tuple:
+    '''Run an import statement in a fresh interpreter and return its duration and the heavy modules it loaded.'''
+    code = (f"import sys, time; start = time.perf_counter(); {statement}; elapsed = time.perf_counter() - start; "
+            f"print(elapsed); print(','.join(module for module in {HEAVY_MODULES!r} if module in sys.modules))")
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout.split('\n')
+    return float(output[0]), [module for module in output[1].split(',') if module]
+
+
+def test_import_time():
+    # Verify the lightweight modules can be used without loading pandas or the web stack
+    _, loaded = import_in_subprocess("import singupy; singupy.conversion.kv_to_letter(400); "
+                                     "from singupy.verification import Column, DataFrameSchema; "
+                                     "DataFrameSchema({'kv': Column('numeric')})")
+    assert loaded == []
+
+    # Verify the import stays in the tens of milliseconds - the bound is generous and the best of a few runs is used,
+    # so a busy machine does not fail the test while an import of pandas (hundreds of milliseconds) would
+    elapsed = min(import_in_subprocess("import singupy; singupy.conversion")[0] for _ in range(3))
+    assert elapsed < 0.2
+
+    # Verify the api module leaves pandasql (and SQLAlchemy) until the query engine needs it
+    _, loaded = import_in_subprocess("import singupy.api")
+    assert 'pandas' in loaded and 'pandasql' not in loaded and 'sqlalchemy' not in loaded
+
+
+def test_lazy_modules():
+    assert set(singupy.__all__) <= set(dir(singupy))
+    assert singupy.conversion.kv_to_letter(132) == 'E'
+    with pytest.raises(AttributeError):
+        singupy.missing
@@ -1,7 +1,7 @@
 import pytest
 import logging
 import pandas as pd
-from singupy.verification import dataframe_columns
+from singupy.verification import dataframe_columns, Column, DataFrameSchema, validate_dataframes
 
 log = logging.getLogger(__name__)
 
@@ -26,3 +26,36 @@ def test_dataframe_columns():
     # Check raise error in case missing col in partial compare
     with pytest.raises(ValueError):
         dataframe_columns(testframe, ["col1", "col3"], True)
+
+
+def test_dataframe_schema():
+    schema = DataFrameSchema({"id": Column('int64', nullable=False, unique=True),
+                              "kv": Column('numeric', min=0, max=500),
+                              "name": Column('string')}, key=["id"])
+    valid = pd.DataFrame({"id": [1, 2, 3], "kv": [400.0, None, 10.0], "name": ["a", "b", "c"]})
+    invalid = pd.DataFrame({"id": [1, 1, None], "kv": [400, 600, -1], "extra": [0, 0, 0]})
+
+    # Test a valid dataframe gives an empty report
+    report = schema.validate(valid)
+    assert report.ok and len(report) == 0
+
+    # Test all problems of an invalid dataframe are collected
+    report = validate_dataframes({"valid": valid, "invalid": invalid}, schema)
+    assert not report.ok
+    checks = {(error['column'], error['check']): error['count'] for error in report.errors}
+    assert {error['dataframe'] for error in report.errors} == {"invalid"}
+    assert ("id", "dtype") in checks
+    assert checks[("id", "nullable")] == 1
+    assert checks[("id", "unique")] == 1
+    assert checks[("kv", "range")] == 2
+    assert sum(1 for error in report.errors if error['check'] == 'columns') == 2
+    assert len(report.to_frame()) == len(report)
+    with pytest.raises(ValueError):
+        report.raise_for_errors()
+
+    # Test schemas per dataframe, and dataframes without a schema
+    report = validate_dataframes({"valid": valid, "other": valid}, {"valid": schema})
+    assert [error['check'] for error in report.errors] == ['schema']
+
+    # Test a list of columns only checks the column names
+    assert DataFrameSchema(["id", "kv"], allow_extra_columns=True).validate(valid).ok